@@ -69,6 +69,34 @@ class TrackerClient(object):
 
         return item
 
+    @reraise_with_tracker_error
+    def get_items(self, count):
+        '''Check out up to `count` items in one request.
+
+        Returns a list of items, each from a different project.
+        '''
+        _logger.info('Contacting tracker for %d items.', count)
+
+        response = requests.post(
+            '{scheme}://{host}/api/get_batch'.format(
+                host=self.host,
+                scheme=self.scheme),
+            data={
+                'username': self.username,
+                'version': VERSION,
+                'client_version': self.client_version,
+                'count': count,
+            },
+            headers={
+                'User-Agent': self.user_agent
+            },
+            timeout=60,
+        )
+
+        response.raise_for_status()
+
+        return response.json()['items']
+
     @reraise_with_tracker_error
     def upload_item(self, claim_id, tamper_key, results):
         _logger.info('Uploading to tracker.')
@@ -86,6 +114,40 @@ class TrackerClient(object):
         )
         response.raise_for_status()
 
+    @reraise_with_tracker_error
+    def upload_items(self, items):
+        '''Upload results of several items in one request.
+
+        `items` is a list of ``(claim_id, tamper_key, results)`` tuples.
+        Returns a list of dicts with the ``claim_id`` and ``status`` of
+        each item. The status is ``invalid`` if the tracker rejected the
+        claim.
+        '''
+        _logger.info('Uploading %d items to tracker.', len(items))
+
+        response = requests.post(
+            '{scheme}://{host}/api/done_batch'.format(
+                host=self.host,
+                scheme=self.scheme),
+            data={
+                'items': json.dumps(
+                    [
+                        {
+                            'claim_id': claim_id,
+                            'tamper_key': tamper_key,
+                            'results': results,
+                        }
+                        for claim_id, tamper_key, results in items
+                    ],
+                    cls=NativeStringJSONEncoder
+                ),
+            },
+            timeout=60,
+        )
+        response.raise_for_status()
+
+        return response.json()['items']
+
     @reraise_with_tracker_error
     def report_error(self, claim_id, tamper_key, message):
         _logger.info('Sending error report to tracker.')
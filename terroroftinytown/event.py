@@ -14,11 +14,11 @@ class Bus(object):
         return self
 
     def fire(self, *args, **kwargs):
-        for handler in self.__handlers:
+        for handler in list(self.__handlers):
             handler(*args, **kwargs)
 
     def clear_handlers(self, obj=None):
-        for handler in self.__handlers:
+        for handler in list(self.__handlers):
             if not obj or handler.__self__ == obj:
                 self -= handler
 
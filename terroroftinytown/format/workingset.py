@@ -0,0 +1,337 @@
+'''Binary working set of drained results.
+
+A working set file starts with a header of the magic bytes, the format
+version and the block compression. Results follow in blocks. Each block
+has a header of the compressed size, the uncompressed size, the number
+of records and the CRC-32 of the compressed data. A block with no
+records ends the file.
+
+A record is the result ID, the datetime as microseconds since the epoch
+and the sizes of the project ID, shortcode, URL and encoding, followed
+by those strings in UTF-8.
+
+Run this module to inspect a working set file.
+'''
+import argparse
+import datetime
+import json
+import lzma
+import struct
+import zlib
+
+__all__ = ['WorkingSetError', 'WorkingSetWriter', 'WorkingSetReader',
+           'is_working_set']
+
+MAGIC = b'TOTTWS'
+VERSION = 1
+
+FILE_HEADER = struct.Struct('>6sBB')
+BLOCK_HEADER = struct.Struct('>IIII')
+RECORD_HEADER = struct.Struct('>qqHHIH')
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_LZMA = 2
+
+COMPRESSION_NAMES = {
+    'none': COMPRESSION_NONE,
+    'zlib': COMPRESSION_ZLIB,
+    'lzma': COMPRESSION_LZMA,
+}
+
+# Stored in place of the datetime of a result without one
+NO_DATETIME = -2 ** 63
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class WorkingSetError(ValueError):
+    '''The working set file is not valid.'''
+
+
+def is_working_set(path):
+    '''Return whether the file starts like a working set.'''
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def _encode_datetime(value):
+    if value is None:
+        return NO_DATETIME
+
+    delta = value - EPOCH
+
+    return (delta.days * 86400 + delta.seconds) * 1000000 + \
+        delta.microseconds
+
+
+def _decode_datetime(value):
+    if value == NO_DATETIME:
+        return None
+
+    return EPOCH + datetime.timedelta(microseconds=value)
+
+
+class WorkingSetWriter(object):
+    '''Write results to a working set file.
+
+    Records are buffered until about `block_size` bytes and then written
+    as a compressed block. :meth:`close` writes the last block and the
+    end of the file but does not close `file`.
+    '''
+    def __init__(self, file, compression='zlib', block_size=1024 * 1024,
+                 compress_level=1):
+        self.file = file
+        self.compression = COMPRESSION_NAMES[compression]
+        self.block_size = block_size
+        self.compress_level = compress_level
+        self._records = []
+        self._buffer_size = 0
+        self.record_count = 0
+
+        self.file.write(FILE_HEADER.pack(MAGIC, VERSION, self.compression))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if not exc_type:
+            self.close()
+
+    def write(self, result):
+        '''Write a result dict as returned by the reader.'''
+        project_id = result['project_id'].encode('utf-8', 'surrogatepass')
+        shortcode = result['shortcode'].encode('utf-8', 'surrogatepass')
+        url = result['url'].encode('utf-8', 'surrogatepass')
+        encoding = result['encoding'].encode('utf-8', 'surrogatepass')
+
+        record = b''.join((
+            RECORD_HEADER.pack(
+                result['id'], _encode_datetime(result['datetime']),
+                len(project_id), len(shortcode), len(url), len(encoding)),
+            project_id, shortcode, url, encoding
+        ))
+
+        self._records.append(record)
+        self._buffer_size += len(record)
+        self.record_count += 1
+
+        if self._buffer_size >= self.block_size:
+            self._write_block()
+
+    def flush(self):
+        '''Write the buffered records as a block and flush the file.'''
+        self._write_block()
+        self.file.flush()
+
+    def close(self):
+        self._write_block()
+        self.file.write(BLOCK_HEADER.pack(0, 0, 0, 0))
+        self.file.flush()
+
+    def _write_block(self):
+        if not self._records:
+            return
+
+        data = b''.join(self._records)
+
+        if self.compression == COMPRESSION_ZLIB:
+            compressed_data = zlib.compress(data, self.compress_level)
+        elif self.compression == COMPRESSION_LZMA:
+            compressed_data = lzma.compress(data)
+        else:
+            compressed_data = data
+
+        self.file.write(BLOCK_HEADER.pack(
+            len(compressed_data), len(data), len(self._records),
+            zlib.crc32(compressed_data)
+        ))
+        self.file.write(compressed_data)
+
+        self._records = []
+        self._buffer_size = 0
+
+
+class WorkingSetReader(object):
+    '''Read results from a working set file.
+
+    Iterating returns the results as dicts and starts from the first
+    block each time. A file that ends without its last block raises
+    :class:`WorkingSetError` unless `allow_truncated` is set, in which
+    case the complete blocks are read and :attr:`truncated` is set.
+    '''
+    def __init__(self, file, allow_truncated=False):
+        self.file = file
+        self.allow_truncated = allow_truncated
+        self.truncated = False
+
+        header = file.read(FILE_HEADER.size)
+
+        if len(header) != FILE_HEADER.size:
+            raise WorkingSetError('File is too short.')
+
+        magic, self.version, self.compression = FILE_HEADER.unpack(header)
+
+        if magic != MAGIC:
+            raise WorkingSetError('Not a working set file.')
+
+        if self.version != VERSION:
+            raise WorkingSetError(
+                'Unsupported version {0}.'.format(self.version))
+
+        if self.compression not in COMPRESSION_NAMES.values():
+            raise WorkingSetError(
+                'Unknown compression {0}.'.format(self.compression))
+
+    def __iter__(self):
+        for data in self.iter_blocks():
+            for result in self._parse_block(data):
+                yield result
+
+    def iter_blocks(self):
+        '''Return the uncompressed data of each block.'''
+        for offset, header, compressed_data in self._iter_raw_blocks():
+            compressed_size, size, record_count, checksum = header
+
+            if zlib.crc32(compressed_data) != checksum:
+                raise WorkingSetError(
+                    'Checksum mismatch in block at {0}.'.format(offset))
+
+            if self.compression == COMPRESSION_ZLIB:
+                data = zlib.decompress(compressed_data)
+            elif self.compression == COMPRESSION_LZMA:
+                data = lzma.decompress(compressed_data)
+            else:
+                data = compressed_data
+
+            if len(data) != size:
+                raise WorkingSetError(
+                    'Size mismatch in block at {0}.'.format(offset))
+
+            yield data
+
+    def iter_block_headers(self):
+        '''Return the offset and header of each block.'''
+        for offset, header, compressed_data in self._iter_raw_blocks():
+            yield offset, header
+
+    def _iter_raw_blocks(self):
+        self.file.seek(FILE_HEADER.size)
+
+        while True:
+            offset = self.file.tell()
+            header = self.file.read(BLOCK_HEADER.size)
+
+            if len(header) != BLOCK_HEADER.size:
+                self._handle_truncated(offset)
+                return
+
+            header = BLOCK_HEADER.unpack(header)
+
+            if not header[2]:
+                return
+
+            compressed_data = self.file.read(header[0])
+
+            if len(compressed_data) != header[0]:
+                self._handle_truncated(offset)
+                return
+
+            yield offset, header, compressed_data
+
+    def _handle_truncated(self, offset):
+        if not self.allow_truncated:
+            raise WorkingSetError(
+                'File is truncated at {0}.'.format(offset))
+
+        self.truncated = True
+
+    @classmethod
+    def _parse_block(cls, data):
+        position = 0
+        header_size = RECORD_HEADER.size
+        unpack_header = RECORD_HEADER.unpack_from
+
+        while position < len(data):
+            (result_id, datetime_value, project_id_size, shortcode_size,
+             url_size, encoding_size) = unpack_header(data, position)
+            shortcode_start = position + header_size + project_id_size
+            url_start = shortcode_start + shortcode_size
+            encoding_start = url_start + url_size
+            end = encoding_start + encoding_size
+
+            yield {
+                'id': result_id,
+                'project_id': data[position + header_size:shortcode_start]
+                .decode('utf-8', 'surrogatepass'),
+                'shortcode': data[shortcode_start:url_start]
+                .decode('utf-8', 'surrogatepass'),
+                'url': data[url_start:encoding_start]
+                .decode('utf-8', 'surrogatepass'),
+                'encoding': data[encoding_start:end]
+                .decode('utf-8', 'surrogatepass'),
+                'datetime': _decode_datetime(datetime_value),
+            }
+
+            position = end
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Inspect and verify a working set file.')
+    arg_parser.add_argument('working_set_file')
+    arg_parser.add_argument('--records', action='store_true',
+                            help='Print each record as JSON')
+    arg_parser.add_argument('--blocks', action='store_true',
+                            help='Print the header of each block')
+    args = arg_parser.parse_args()
+
+    compression_names = dict(
+        (value, name) for name, value in COMPRESSION_NAMES.items())
+
+    with open(args.working_set_file, 'rb') as file:
+        reader = WorkingSetReader(file, allow_truncated=True)
+
+        print('version {0}, {1} compression'.format(
+            reader.version, compression_names[reader.compression]))
+
+        num_blocks = 0
+        num_records = 0
+        size = 0
+        projects = {}
+
+        for data in reader.iter_blocks():
+            num_blocks += 1
+            size += len(data)
+
+            for result in reader._parse_block(data):
+                num_records += 1
+                projects[result['project_id']] = \
+                    projects.get(result['project_id'], 0) + 1
+
+                if args.records:
+                    result = dict(result)
+                    result['datetime'] = result['datetime'].isoformat() \
+                        if result['datetime'] else None
+                    print(json.dumps(result))
+
+        end_offset = file.tell()
+
+        if args.blocks:
+            for offset, header in reader.iter_block_headers():
+                print('block at {0}: {1} bytes compressed, {2} bytes, '
+                      '{3} records'.format(offset, *header[:3]))
+
+        print('{0} records in {1} blocks, {2} bytes uncompressed, '
+              '{3} bytes on disk'.format(
+                  num_records, num_blocks, size, end_offset))
+
+        for project_id, count in sorted(projects.items()):
+            print('{0}: {1} records'.format(project_id, count))
+
+        if reader.truncated:
+            print('The file is truncated after the last complete block.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import datetime
+import io
+import unittest
+
+from terroroftinytown.format.workingset import WorkingSetError, \
+    WorkingSetReader, WorkingSetWriter
+
+
+RESULTS = [
+    {
+        'id': 1,
+        'project_id': 'test',
+        'shortcode': 'a',
+        'url': 'http://example.com/é',
+        'encoding': 'ascii',
+        'datetime': datetime.datetime(2015, 1, 2, 3, 4, 5, 6),
+    },
+    {
+        'id': 2 ** 40,
+        'project_id': 'test2',
+        'shortcode': 'bb',
+        'url': 'http://example.com/\udcff',
+        'encoding': 'latin-1',
+        'datetime': None,
+    },
+]
+
+
+class TestWorkingSet(unittest.TestCase):
+    def write(self, results, **kwargs):
+        file = io.BytesIO()
+
+        with WorkingSetWriter(file, **kwargs) as writer:
+            for result in results:
+                writer.write(result)
+
+        return file.getvalue()
+
+    def test_round_trip(self):
+        for compression in ('none', 'zlib', 'lzma'):
+            data = self.write(RESULTS * 10, compression=compression,
+                              block_size=100)
+            reader = WorkingSetReader(io.BytesIO(data))
+
+            self.assertEqual(RESULTS * 10, list(reader))
+            self.assertGreater(len(list(reader.iter_block_headers())), 0)
+
+    def test_corrupt(self):
+        data = bytearray(self.write(RESULTS, compression='none'))
+        data[-30] ^= 0xff
+
+        with self.assertRaises(WorkingSetError):
+            list(WorkingSetReader(io.BytesIO(bytes(data))))
+
+        with self.assertRaises(WorkingSetError):
+            WorkingSetReader(io.BytesIO(b'not a working set'))
+
+    def test_truncated(self):
+        file = io.BytesIO()
+        writer = WorkingSetWriter(file, block_size=1)
+
+        for result in RESULTS:
+            writer.write(result)
+
+        data = file.getvalue()[:-5]
+
+        with self.assertRaises(WorkingSetError):
+            list(WorkingSetReader(io.BytesIO(data)))
+
+        reader = WorkingSetReader(io.BytesIO(data), allow_truncated=True)
+
+        self.assertEqual(RESULTS[:1], list(reader))
+        self.assertTrue(reader.truncated)
@@ -33,6 +33,8 @@ def main():
     arg_parser.add_argument('--batch-size', type=int)
     arg_parser.add_argument('--min-batch-size', type=int)
     arg_parser.add_argument('--max-batches', type=int, default=1)
+    arg_parser.add_argument('--jobs', type=int, default=1,
+                            help='Number of projects to export at a time')
 
     args = arg_parser.parse_args()
 
@@ -156,6 +158,7 @@ def process_batch(args):
         '--dir-length', '0', '--file-length', '0', '--max-right', '8',
         '--delete', '--zip-filename-infix', '.{}'.format(timestamp),
         '--database-busy-file', database_locked_sentinel_path,
+        '--jobs', str(args.jobs),
         item_export_directory,
         ]
 
@@ -3,6 +3,8 @@ import gzip
 import logging
 import pickle
 
+from terroroftinytown.format.workingset import WorkingSetReader, \
+    is_working_set
 from terroroftinytown.tracker.bootstrap import Bootstrap
 from terroroftinytown.tracker.model import new_session, Result
 from sqlalchemy.sql.expression import insert
@@ -26,40 +28,94 @@ class UndrainBootstrap(Bootstrap):
     def recover(self):
         logger.info('Recovering from %s', self.args.working_set_file)
 
-        with gzip.open(self.args.working_set_file, 'rb') as file, \
-                new_session() as session:
-            query = insert(Result)
-            values = []
-            line_num = 0
+        if is_working_set(self.args.working_set_file):
+            with open(self.args.working_set_file, 'rb') as file:
+                reader = WorkingSetReader(file, allow_truncated=True)
+                self.insert_results(reader)
 
-            while True:
-                doc = pickle.load(file)
+                if reader.truncated:
+                    logger.warning(
+                        'The working set is truncated. Recovered the '
+                        'results up to the last complete block.')
+        else:
+            # Pickled working set from older versions
+            with gzip.open(self.args.working_set_file, 'rb') as file:
+                self.insert_results(self.iter_pickled_results(file))
 
-                if doc == 'eof':
-                    break
+        logger.info('Done!')
 
-                values.append({
-                    'project_id': doc['project_id'],
-                    'shortcode': doc['shortcode'],
-                    'url': doc['url'],
-                    'encoding': doc['encoding'],
-                    'datetime': doc['datetime'],
-                })
+    @classmethod
+    def iter_pickled_results(cls, file):
+        while True:
+            doc = pickle.load(file)
 
-                if line_num % 10000 == 0:
-                    logger.info('Recover progress: %d', line_num)
-                    session.execute(query, values)
-                    session.commit()
-                    values = []
+            if doc == 'eof':
+                break
 
-                line_num += 1
+            yield doc
 
-            logger.info('Finishing up...')
-            session.execute(query, values)
-            session.commit()
+    def insert_results(self, results, size=1000):
+        '''Insert the results that are not in the database.
 
-        logger.info('Done!')
+        Results keep their IDs, so results that were never deleted,
+        for example because the export stopped before deleting them, are
+        skipped instead of duplicated.
+        '''
+        num_results = 0
+        num_inserted = 0
+
+        with new_session() as session:
+            batch = []
+
+            for doc in results:
+                batch.append(doc)
+                num_results += 1
+
+                if len(batch) == size:
+                    num_inserted += self.insert_batch(session, batch)
+                    batch = []
+
+                if num_results % 10000 == 0:
+                    logger.info('Recover progress: %d', num_results)
+
+            logger.info('Finishing up...')
 
+            num_inserted += self.insert_batch(session, batch)
+
+        logger.info('Inserted %d results. Skipped %d results that were '
+                    'not deleted.', num_inserted, num_results - num_inserted)
+
+    @classmethod
+    def insert_batch(cls, session, docs):
+        '''Insert and commit the results whose IDs are not in use.
+
+        Returns the number of inserted results.
+        '''
+        if not docs:
+            return 0
+
+        existing_ids = frozenset(
+            row[0] for row in session.query(Result.id)
+            .filter(Result.id.in_([doc['id'] for doc in docs]))
+        )
+        values = [
+            {
+                'id': doc['id'],
+                'project_id': doc['project_id'],
+                'shortcode': doc['shortcode'],
+                'url': doc['url'],
+                'encoding': doc['encoding'],
+                'datetime': doc['datetime'],
+            }
+            for doc in docs if doc['id'] not in existing_ids
+        ]
+
+        if values:
+            session.execute(insert(Result), values)
+
+        session.commit()
+
+        return len(values)
 
 if __name__ == '__main__':
     UndrainBootstrap().start()
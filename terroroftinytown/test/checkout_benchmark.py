@@ -0,0 +1,81 @@
+'''Benchmark item checkouts with and without the in-memory item pool.'''
+import argparse
+import os
+import tempfile
+import time
+
+from terroroftinytown.client import VERSION
+from terroroftinytown.tracker.database import Database
+from terroroftinytown.tracker.errors import NoItemAvailable
+from terroroftinytown.tracker.model import Budget, Item, ItemPool, Project, \
+    checkout_item, new_session, MIN_CLIENT_VERSION_OVERRIDE
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--items', type=int, default=100000,
+                            help='Number of queued items')
+    arg_parser.add_argument('--checkouts', type=int, default=5000,
+                            help='Number of checkouts per run')
+    arg_parser.add_argument('--database',
+                            help='SQLite path (default: temporary file)')
+    args = arg_parser.parse_args()
+
+    if args.database:
+        path = args.database
+        temp_dir = None
+    else:
+        temp_dir = tempfile.TemporaryDirectory()
+        path = os.path.join(temp_dir.name, 'benchmark.db')
+
+    Database('sqlite:///{0}'.format(path), delete_everything='yes-really!')
+    populate(args.items, args.checkouts)
+
+    for enabled in (False, True):
+        rate = run(enabled, args.checkouts)
+        print('{0:<12} {1:10.1f} checkouts/s'.format(
+            'pool' if enabled else 'query', rate))
+
+    if temp_dir:
+        temp_dir.cleanup()
+
+
+def populate(num_items, num_checkouts):
+    with new_session() as session:
+        project = Project(name='benchmark', enabled=True,
+                          max_num_items=num_items + num_checkouts * 2)
+        session.add(project)
+
+    Item.add_items(
+        'benchmark', [(index * 10, index * 10 + 9)
+                      for index in range(num_items)])
+
+
+def run(pool_enabled, num_checkouts):
+    Item.release_all('benchmark')
+    Budget.calculate_budgets()
+    ItemPool.clear()
+    ItemPool.enabled = pool_enabled
+
+    # Claim the first half of the queue so the unclaimed scan has work to do
+    for index in range(num_checkouts):
+        checkout_item('benchmark', 'warmup{0}'.format(index),
+                      VERSION, MIN_CLIENT_VERSION_OVERRIDE)
+
+    start_time = time.perf_counter()
+
+    for index in range(num_checkouts):
+        try:
+            checkout_item('benchmark', '10.0.{0}.{1}'.format(
+                index // 256, index % 256),
+                VERSION, MIN_CLIENT_VERSION_OVERRIDE)
+        except NoItemAvailable:
+            break
+
+    duration = time.perf_counter() - start_time
+
+    return num_checkouts / duration
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+'''Benchmark ExternalSort against GNUExternalSort.
+
+Sorts the same synthetic export results with both sorters and reports
+the time to input and to sort them. The sorted keys are compared to
+check both sorters agree.
+'''
+import argparse
+import datetime
+import random
+import tempfile
+import time
+
+from terroroftinytown.test.random_result import generate_shortcode, \
+    generate_url
+from terroroftinytown.util.externalsort import ExternalSort, GNUExternalSort
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--rows', type=int, default=1000000,
+                            help='Number of results to sort')
+    arg_parser.add_argument('--max-run-size', type=int,
+                            default=16 * 1024 * 1024,
+                            help='Bytes held in memory by ExternalSort')
+    arg_parser.add_argument('--temp-dir',
+                            help='Directory for the temporary files')
+    args = arg_parser.parse_args()
+
+    random.seed(1)
+    start_datetime = datetime.datetime(2020, 1, 1)
+    results = [
+        (generate_shortcode(),
+         (index, generate_url(), 'ascii',
+          start_datetime + datetime.timedelta(seconds=index)))
+        for index in range(args.rows)
+    ]
+
+    with tempfile.TemporaryDirectory(dir=args.temp_dir) as temp_dir:
+        sorters = (
+            ('GNU sort', GNUExternalSort(temp_dir=temp_dir)),
+            ('ExternalSort', ExternalSort(temp_dir=temp_dir,
+                                          max_run_size=args.max_run_size)),
+        )
+        sorted_keys = []
+
+        print('{0:<14} {1:>9} {2:>9} {3:>12}'.format(
+            'sorter', 'input s', 'sort s', 'rows/s'))
+
+        for name, sorter in sorters:
+            start_time = time.perf_counter()
+            sorter.input_many(results)
+            input_time = time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            keys = [key for key, value in sorter.sort()]
+            sort_time = time.perf_counter() - start_time
+
+            sorted_keys.append(keys)
+
+            print('{0:<14} {1:>9.2f} {2:>9.2f} {3:>12.0f}'.format(
+                name, input_time, sort_time,
+                args.rows / (input_time + sort_time)))
+
+    if sorted_keys[0] != sorted_keys[1]:
+        print('The sorted keys differ!')
+
+
+if __name__ == '__main__':
+    main()
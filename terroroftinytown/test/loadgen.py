@@ -0,0 +1,336 @@
+'''Simulate warrior clients against a tracker to measure its capacity.
+
+Each simulated client loops requesting an item, pretending to scrape it
+and uploading results synthesized like random_result.py does, or
+occasionally reporting an error instead. The throughput, the p50 and
+p99 latency of each endpoint and the mix of responses are reported at
+the end.
+
+The tracker is started with ApplicationBootstrap in a subprocess with a
+temporary SQLite database and a local Redis server. Give --url to test
+a tracker that is already running instead.
+'''
+import argparse
+import collections
+import ipaddress
+import json
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+
+import redis
+import tornado.gen
+import tornado.httpclient
+import tornado.ioloop
+
+from terroroftinytown.client import VERSION
+from terroroftinytown.client.alphabet import int_to_str
+from terroroftinytown.test.random_result import generate_url
+from terroroftinytown.tracker.database import Database
+from terroroftinytown.tracker.model import Project, new_session, \
+    MIN_CLIENT_VERSION_OVERRIDE
+from terroroftinytown.util.jsonutil import NativeStringJSONEncoder
+
+
+CONFIG_TEMPLATE = '''
+[web]
+host: 127.0.0.1
+port: {port}
+cookie_secret: loadgen
+xheaders: true
+processes: {processes}
+
+[database]
+path: {database}
+
+[redis]
+host: {redis_host}
+port: {redis_port}
+db: {redis_db}
+unix:
+prefix: {redis_prefix}
+budget_mode: {budget_mode}
+'''
+
+ENDPOINTS = ('/api/get', '/api/done', '/api/error')
+
+
+class TrackerProcess(object):
+    '''Run the tracker from ApplicationBootstrap in a subprocess.
+
+    The config file is written from :data:`CONFIG_TEMPLATE` into
+    `temp_dir`. The budget is shared in Redis unless `budget_mode` says
+    otherwise or there is a single process. Forked tracker processes
+    are stopped too.
+    '''
+    def __init__(self, temp_dir, port, database, redis_host='localhost',
+                 redis_port=6379, redis_db=15, redis_prefix='loadgen:',
+                 processes=1, budget_mode=None, log_path=os.devnull):
+        self.port = port
+        self.config_path = os.path.join(temp_dir, 'tracker.conf')
+        self.log_path = log_path
+        self.process = None
+
+        with open(self.config_path, 'w') as file:
+            file.write(CONFIG_TEMPLATE.format(
+                port=port, processes=processes, database=database,
+                redis_host=redis_host, redis_port=redis_port,
+                redis_db=redis_db, redis_prefix=redis_prefix,
+                budget_mode=budget_mode or (
+                    'local' if processes == 1 else 'shared'),
+            ))
+
+    def start(self, timeout=30):
+        with open(self.log_path, 'ab') as log_file:
+            self.process = subprocess.Popen(
+                [sys.executable, '-m', 'terroroftinytown.tracker',
+                 self.config_path],
+                stdout=log_file, stderr=subprocess.STDOUT,
+                start_new_session=True)
+
+        deadline = time.monotonic() + timeout
+
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', self.port)).close()
+                return
+            except ConnectionError:
+                if self.process.poll() is not None:
+                    raise Exception('Tracker exited while starting.')
+                if time.monotonic() > deadline:
+                    self.stop()
+                    raise
+                time.sleep(0.1)
+
+    def stop(self):
+        os.killpg(self.process.pid, signal.SIGTERM)
+        self.process.wait()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--clients', type=int, default=50,
+                            help='Number of simulated clients')
+    arg_parser.add_argument('--client-processes', type=int,
+                            default=multiprocessing.cpu_count(),
+                            help='Number of processes running the clients')
+    arg_parser.add_argument('--duration', type=float, default=30,
+                            help='Seconds to run')
+    arg_parser.add_argument('--scrape-time', type=float, default=0.1,
+                            help='Seconds a client spends on an item')
+    arg_parser.add_argument('--retry-delay', type=float, default=0.5,
+                            help='Seconds to wait after a failed request')
+    arg_parser.add_argument('--found-ratio', type=float, default=0.1,
+                            help='Fraction of shortcodes with a result')
+    arg_parser.add_argument('--error-ratio', type=float, default=0.01,
+                            help='Fraction of items reported as errors')
+    arg_parser.add_argument('--projects', type=int, default=2,
+                            help='Number of autoqueue projects')
+    arg_parser.add_argument('--url',
+                            help='URL of a running tracker to test instead')
+    arg_parser.add_argument('--port', type=int, default=8898)
+    arg_parser.add_argument('--processes', type=int, default=1,
+                            help='Number of tracker processes')
+    arg_parser.add_argument('--tracker-log', default=os.devnull,
+                            help='File for the output of the tracker')
+    arg_parser.add_argument('--redis-host', default='localhost')
+    arg_parser.add_argument('--redis-port', type=int, default=6379)
+    arg_parser.add_argument('--redis-db', type=int, default=15)
+    args = arg_parser.parse_args()
+
+    if args.url:
+        stats = run_clients(args.url, args)
+    else:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            database = 'sqlite:///{0}'.format(
+                os.path.join(temp_dir, 'loadgen.db'))
+
+            populate(database, args.projects)
+
+            redis_client = redis.Redis(
+                host=args.redis_host, port=args.redis_port, db=args.redis_db)
+
+            for key in redis_client.scan_iter('loadgen:*'):
+                redis_client.delete(key)
+
+            tracker = TrackerProcess(
+                temp_dir, args.port, database, redis_host=args.redis_host,
+                redis_port=args.redis_port, redis_db=args.redis_db,
+                processes=args.processes, log_path=args.tracker_log)
+            tracker.start()
+
+            try:
+                stats = run_clients(
+                    'http://127.0.0.1:{0}'.format(args.port), args)
+            finally:
+                tracker.stop()
+
+    print_report(stats, args.duration)
+
+
+def populate(database, num_projects):
+    Database(database, delete_everything='yes-really!')
+
+    with new_session() as session:
+        for index in range(num_projects):
+            session.add(Project(
+                name='loadgen{0}'.format(index), enabled=True,
+                autoqueue=True, max_num_items=10 ** 9))
+
+
+def run_clients(url, args):
+    '''Run the clients in client processes and merge their stats.'''
+    num_processes = max(1, min(args.client_processes, args.clients))
+    client_indexes = [
+        list(range(index, args.clients, num_processes))
+        for index in range(num_processes)
+    ]
+    options = {
+        'duration': args.duration,
+        'scrape_time': args.scrape_time,
+        'retry_delay': args.retry_delay,
+        'found_ratio': args.found_ratio,
+        'error_ratio': args.error_ratio,
+    }
+
+    with multiprocessing.Pool(num_processes) as pool:
+        results = pool.starmap(
+            run_client_process,
+            [(url, indexes, options) for indexes in client_indexes]
+        )
+
+    stats = dict(
+        (endpoint, ([], collections.Counter())) for endpoint in ENDPOINTS)
+
+    for result in results:
+        for endpoint, (latencies, outcomes) in result.items():
+            stats[endpoint][0].extend(latencies)
+            stats[endpoint][1].update(outcomes)
+
+    return stats
+
+
+def run_client_process(url, client_indexes, options):
+    '''Run clients concurrently on an IOLoop.
+
+    Returns a dict mapping endpoints to a list of latencies and a
+    Counter of outcomes.
+    '''
+    stats = dict(
+        (endpoint, ([], collections.Counter())) for endpoint in ENDPOINTS)
+    deadline = time.monotonic() + options['duration']
+    http_client = tornado.httpclient.AsyncHTTPClient(
+        max_clients=len(client_indexes))
+
+    @tornado.gen.coroutine
+    def post(endpoint, ip_address, **data):
+        start_time = time.perf_counter()
+        response = yield http_client.fetch(
+            url + endpoint, method='POST', raise_error=False,
+            body=urllib.parse.urlencode(data),
+            headers={'X-Real-Ip': ip_address})
+        latencies, outcomes = stats[endpoint]
+
+        latencies.append(time.perf_counter() - start_time)
+        outcomes['{0} {1}'.format(response.code, response.reason)] += 1
+
+        return response
+
+    @tornado.gen.coroutine
+    def client(client_index):
+        username = 'loadgen{0}'.format(client_index)
+        address_index = 0
+
+        while time.monotonic() < deadline:
+            ip_address = str(ipaddress.IPv6Address(
+                (0xfd << 120) | (client_index << 32) | address_index))
+
+            response = yield post(
+                '/api/get', ip_address, username=username,
+                version=VERSION, client_version=MIN_CLIENT_VERSION_OVERRIDE)
+
+            if response.code != 200:
+                yield tornado.gen.sleep(options['retry_delay'])
+                continue
+
+            item = json.loads(response.body.decode('utf-8'))
+
+            yield tornado.gen.sleep(options['scrape_time'])
+
+            if random.random() < options['error_ratio']:
+                yield post(
+                    '/api/error', ip_address, claim_id=item['id'],
+                    tamper_key=item['tamper_key'], message='Simulated error')
+
+                # The claim is kept until it is released so continue from
+                # another address like a restarted warrior would
+                address_index += 1
+            else:
+                yield post(
+                    '/api/done', ip_address, claim_id=item['id'],
+                    tamper_key=item['tamper_key'],
+                    results=json.dumps(
+                        synthesize_results(item, options['found_ratio']),
+                        cls=NativeStringJSONEncoder))
+
+    @tornado.gen.coroutine
+    def run():
+        yield [client(index) for index in client_indexes]
+
+    tornado.ioloop.IOLoop.current().run_sync(run)
+
+    return stats
+
+
+def synthesize_results(item, found_ratio):
+    alphabet = item['project']['alphabet']
+    results = {}
+
+    for sequence_num in range(item['lower_sequence_num'],
+                              item['upper_sequence_num'] + 1):
+        if random.random() < found_ratio:
+            results[int_to_str(sequence_num, alphabet)] = {
+                'url': generate_url(),
+                'encoding': 'ascii',
+            }
+
+    return results
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+
+    return sorted_values[int(round(fraction * (len(sorted_values) - 1)))]
+
+
+def print_report(stats, duration):
+    print('{0:<12} {1:>9} {2:>9} {3:>9} {4:>9}'.format(
+        'endpoint', 'requests', 'req/s', 'p50 ms', 'p99 ms'))
+
+    for endpoint in ENDPOINTS:
+        latencies = sorted(stats[endpoint][0])
+
+        print('{0:<12} {1:>9} {2:>9.1f} {3:>9.1f} {4:>9.1f}'.format(
+            endpoint, len(latencies), len(latencies) / duration,
+            percentile(latencies, 0.5) * 1000,
+            percentile(latencies, 0.99) * 1000))
+
+    print()
+
+    for endpoint in ENDPOINTS:
+        outcomes = stats[endpoint][1]
+
+        for outcome, count in outcomes.most_common():
+            print('{0:<12} {1:>9} {2}'.format(endpoint, count, outcome))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+'''Load test /api/get with the tracker running as several processes.
+
+Starts the tracker with `budget_mode: shared` for each process count
+given and measures checkouts per second from concurrent clients. Every
+request uses its own IP address so the one claim per IP address per
+project limit never applies.
+
+Needs a Redis server. The default SQLite database serializes all
+writes so the throughput will not scale with it; give a PostgreSQL URL
+with --database to measure the scaling of the tracker itself.
+'''
+import argparse
+import ipaddress
+import multiprocessing
+import os
+import tempfile
+import time
+import urllib.parse
+
+import redis
+import tornado.gen
+import tornado.httpclient
+import tornado.ioloop
+
+from terroroftinytown.client import VERSION
+from terroroftinytown.test.loadgen import TrackerProcess
+from terroroftinytown.tracker.database import Database
+from terroroftinytown.tracker.model import Project, new_session, \
+    MIN_CLIENT_VERSION_OVERRIDE
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--processes', default='1,2,4',
+                            help='Comma separated tracker process counts')
+    arg_parser.add_argument('--clients', type=int,
+                            default=multiprocessing.cpu_count(),
+                            help='Number of client processes')
+    arg_parser.add_argument('--concurrency', type=int, default=16,
+                            help='Requests in flight per client process')
+    arg_parser.add_argument('--duration', type=float, default=10,
+                            help='Seconds per run')
+    arg_parser.add_argument('--database',
+                            help='Database URL (default: temporary SQLite)')
+    arg_parser.add_argument('--port', type=int, default=8899)
+    arg_parser.add_argument('--redis-host', default='localhost')
+    arg_parser.add_argument('--redis-port', type=int, default=6379)
+    arg_parser.add_argument('--redis-db', type=int, default=15)
+    args = arg_parser.parse_args()
+
+    temp_dir = tempfile.TemporaryDirectory()
+    database = args.database or 'sqlite:///{0}'.format(
+        os.path.join(temp_dir.name, 'benchmark.db'))
+    redis_client = redis.Redis(
+        host=args.redis_host, port=args.redis_port, db=args.redis_db)
+    baseline = None
+
+    for processes in [int(value) for value in args.processes.split(',')]:
+        populate(database)
+
+        for key in redis_client.scan_iter('benchmark:*'):
+            redis_client.delete(key)
+
+        tracker = TrackerProcess(
+            temp_dir.name, args.port, database, redis_host=args.redis_host,
+            redis_port=args.redis_port, redis_db=args.redis_db,
+            redis_prefix='benchmark:', processes=processes,
+            budget_mode='shared')
+        tracker.start()
+
+        try:
+            rate = run_clients(args.port, args.clients, args.concurrency,
+                               args.duration)
+        finally:
+            tracker.stop()
+
+        baseline = baseline or rate / processes
+        print('{0:>3} processes {1:10.1f} checkouts/s {2:6.2f}x linear'
+              .format(processes, rate, rate / (baseline * processes)))
+
+    temp_dir.cleanup()
+
+
+def populate(database):
+    Database(database, delete_everything='yes-really!')
+
+    with new_session() as session:
+        session.add(Project(name='benchmark', enabled=True, autoqueue=True,
+                            max_num_items=10 ** 9, num_count_per_item=10))
+
+
+def run_clients(port, num_clients, concurrency, duration):
+    with multiprocessing.Pool(num_clients) as pool:
+        counts = pool.starmap(
+            run_client,
+            [(port, index, concurrency, duration)
+             for index in range(num_clients)]
+        )
+
+    errors = sum(count[1] for count in counts)
+
+    if errors:
+        print('{0} requests failed'.format(errors))
+
+    return sum(count[0] for count in counts) / duration
+
+
+def run_client(port, client_index, concurrency, duration):
+    '''Request items for `duration` seconds. Returns (ok, errors).'''
+    counts = [0, 0]
+    url = 'http://127.0.0.1:{0}/api/get'.format(port)
+    body = urllib.parse.urlencode({
+        'username': 'benchmark{0}'.format(client_index),
+        'version': VERSION,
+        'client_version': MIN_CLIENT_VERSION_OVERRIDE,
+    })
+    deadline = time.monotonic() + duration
+    http_client = tornado.httpclient.AsyncHTTPClient(
+        max_clients=concurrency)
+
+    @tornado.gen.coroutine
+    def worker(worker_index):
+        request_index = 0
+
+        while time.monotonic() < deadline:
+            request_index += 1
+            ip_address = str(ipaddress.IPv6Address(
+                (0xfd << 120) | (client_index << 64) | (worker_index << 32)
+                | request_index))
+            response = yield http_client.fetch(
+                url, method='POST', body=body, raise_error=False,
+                headers={'X-Real-Ip': ip_address})
+
+            counts[0 if response.code == 200 else 1] += 1
+
+    @tornado.gen.coroutine
+    def run():
+        yield [worker(index) for index in range(concurrency)]
+
+    tornado.ioloop.IOLoop.current().run_sync(run)
+
+    return tuple(counts)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+'''Run a throwaway PostgreSQL server for tests.
+
+Set TOTT_TEST_POSTGRES_URL to use an existing database instead. Its
+tables are dropped by the tests.
+'''
+import glob
+import os
+import shutil
+import subprocess
+import tempfile
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+
+def find_program(name):
+    '''Find a PostgreSQL program on PATH or in the usual install places.'''
+    path = shutil.which(name)
+
+    if path:
+        return path
+
+    try:
+        bin_dir = subprocess.check_output(
+            ['pg_config', '--bindir'], universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        bin_dir = None
+
+    candidates = [os.path.join(bin_dir, name)] if bin_dir else []
+    candidates.extend(sorted(
+        glob.glob('/usr/lib/postgresql/*/bin/{0}'.format(name)),
+        reverse=True))
+
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            return candidate
+
+
+class PostgresServer(object):
+    '''A PostgreSQL server in a temporary directory.
+
+    It only listens on a Unix socket in that directory and trusts every
+    local connection.
+    '''
+    def __init__(self):
+        self.temp_dir = None
+        self.url = None
+
+    @classmethod
+    def is_available(cls):
+        return bool(psycopg2 and find_program('initdb')
+                    and find_program('pg_ctl'))
+
+    def start(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        data_dir = os.path.join(self.temp_dir.name, 'data')
+
+        subprocess.check_call(
+            [find_program('initdb'), '--pgdata', data_dir,
+             '--username', 'postgres', '--auth', 'trust',
+             '--encoding', 'UTF8'],
+            stdout=subprocess.DEVNULL
+        )
+        subprocess.check_call(
+            [find_program('pg_ctl'), 'start', '--wait',
+             '--pgdata', data_dir,
+             '--log', os.path.join(self.temp_dir.name, 'postgres.log'),
+             '--options', "-c listen_addresses='' -k {0}".format(
+                 self.temp_dir.name)],
+            stdout=subprocess.DEVNULL
+        )
+
+        self.url = 'postgresql://postgres@/postgres?host={0}'.format(
+            self.temp_dir.name)
+
+    def stop(self):
+        if not self.temp_dir:
+            return
+
+        subprocess.check_call(
+            [find_program('pg_ctl'), 'stop', '--mode', 'immediate',
+             '--pgdata', os.path.join(self.temp_dir.name, 'data')],
+            stdout=subprocess.DEVNULL
+        )
+        self.temp_dir.cleanup()
+        self.temp_dir = None
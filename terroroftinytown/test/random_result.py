@@ -77,11 +77,19 @@ class MockResult(Bootstrap):
             session.execute(insert(Result), items)
 
     def generate_shortcode(self):
-        # todo: non duplicated
-        return hashlib.md5(str(random.random()).encode('ascii')).hexdigest()[:random.randrange(1, 9)]
+        return generate_shortcode()
 
     def generate_url(self):
-        return 'http://' + self.generate_shortcode() + '.com/' + self.generate_shortcode()
+        return generate_url()
+
+
+def generate_shortcode():
+    # todo: non duplicated
+    return hashlib.md5(str(random.random()).encode('ascii')).hexdigest()[:random.randrange(1, 9)]
+
+
+def generate_url():
+    return 'http://' + generate_shortcode() + '.com/' + generate_shortcode()
 
 if __name__ == '__main__':
     MockResult().start()
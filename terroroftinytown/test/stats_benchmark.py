@@ -0,0 +1,148 @@
+'''Benchmark the Redis round trips and latency of Stats.update.
+
+Runs against a spawned redis-server if --redis-server is given, an
+existing server if --port is given, or fakeredis otherwise.
+'''
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import redis
+import redis.connection
+
+from terroroftinytown.tracker.stats import Stats
+
+
+class RoundTripCounter(object):
+    '''Count commands sent to Redis. A pipeline counts as one.'''
+    def __init__(self):
+        self.count = 0
+        self._original = redis.connection.AbstractConnection.send_packed_command
+
+        counter = self
+
+        def send_packed_command(self, *args, **kwargs):
+            counter.count += 1
+            return counter._original(self, *args, **kwargs)
+
+        redis.connection.AbstractConnection.send_packed_command = \
+            send_packed_command
+
+
+class UnbatchedStats(Stats):
+    '''One command per round trip like Stats.update used to do.'''
+    def update(self, stats):
+        key = self.get_key()
+        self.redis.lpush(key, '{}')
+        self.redis.ltrim(key, 0, self.count)
+        self.redis.hincrby(key+':s', stats['username'], stats['scanned'])
+        self.redis.hincrby(key+':f', stats['username'], stats['found'])
+        self.redis.incrby(key+':ts', stats['scanned'])
+        self.redis.incrby(key+':tf', stats['found'])
+        self.redis.hincrby(key+':pf', stats['project'], stats['found'])
+        self.redis.hincrby(key+':ps', stats['project'], stats['scanned'])
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--updates', type=int, default=5000,
+                            help='Number of updates per run')
+    arg_parser.add_argument('--redis-server',
+                            help='Path of a redis-server to spawn')
+    arg_parser.add_argument('--port', type=int,
+                            help='Port of a running Redis server. '
+                                 'The benchmark keys are deleted.')
+    args = arg_parser.parse_args()
+
+    temp_dir = None
+    process = None
+
+    if args.redis_server:
+        temp_dir = tempfile.mkdtemp()
+        socket_path = os.path.join(temp_dir, 'redis.sock')
+        process = subprocess.Popen(
+            [args.redis_server, '--port', '0', '--unixsocket', socket_path,
+             '--save', '', '--appendonly', 'no'],
+            stdout=subprocess.DEVNULL
+        )
+        wait_for_socket(socket_path)
+        connection = redis.Redis(unix_socket_path=socket_path)
+        description = 'redis-server (unix socket)'
+    elif args.port:
+        connection = redis.Redis(port=args.port)
+        description = 'redis-server (port {0})'.format(args.port)
+    else:
+        import fakeredis
+        connection = fakeredis.FakeRedis()
+        description = 'fakeredis (no network latency)'
+
+    counter = RoundTripCounter()
+
+    print(description)
+    print('{0:<12} {1:>12} {2:>12} {3:>12}'.format(
+        'mode', 'updates/s', 'latency us', 'round trips'))
+
+    try:
+        for mode in ('unbatched', 'pipeline', 'script'):
+            if mode == 'unbatched':
+                stats = UnbatchedStats(connection, 'benchmark:')
+            else:
+                stats = Stats(connection, 'benchmark:', update_mode=mode)
+
+            stats.clear()
+            rate, latency, round_trips = run(stats, counter, args.updates)
+            stats.clear()
+
+            print('{0:<12} {1:12.1f} {2:12.1f} {3:12.1f}'.format(
+                mode, rate, latency * 1e6, round_trips))
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+        if temp_dir:
+            shutil.rmtree(temp_dir)
+
+
+def wait_for_socket(path, timeout=10):
+    deadline = time.monotonic() + timeout
+
+    while not os.path.exists(path):
+        if time.monotonic() > deadline:
+            raise Exception('redis-server did not start')
+
+        time.sleep(0.05)
+
+
+def run(stats, counter, num_updates):
+    # Warm up the connection and load the script
+    stats.update(make_stats(0))
+
+    counter.count = 0
+    start_time = time.perf_counter()
+
+    for index in range(num_updates):
+        stats.update(make_stats(index))
+
+    duration = time.perf_counter() - start_time
+
+    return (num_updates / duration, duration / num_updates,
+            counter.count / num_updates)
+
+
+def make_stats(index):
+    return {
+        'project': 'project{0}'.format(index % 10),
+        'username': 'user{0}'.format(index % 1000),
+        'scanned': 50,
+        'found': index % 5,
+        'started': 0,
+        'finished': 1,
+    }
+
+
+if __name__ == '__main__':
+    main()
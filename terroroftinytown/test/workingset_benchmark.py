@@ -0,0 +1,111 @@
+'''Benchmark the working set formats of the exporter.
+
+Writes and reads the same synthetic results as the pickled working set
+of older versions and as the binary working set. The throughput is the
+uncompressed size of the binary records per second.
+'''
+import argparse
+import datetime
+import gzip
+import os
+import pickle
+import random
+import tempfile
+import time
+
+from terroroftinytown.format.workingset import RECORD_HEADER, \
+    WorkingSetReader, WorkingSetWriter
+from terroroftinytown.test.random_result import generate_shortcode, \
+    generate_url
+
+
+def write_pickle(path, results):
+    with gzip.open(path, 'wb', compresslevel=1) as file:
+        for result in results:
+            pickle.dump(result, file)
+
+        pickle.dump('eof', file)
+
+
+def read_pickle(path):
+    count = 0
+
+    with gzip.open(path, 'rb') as file:
+        while pickle.load(file) != 'eof':
+            count += 1
+
+    return count
+
+
+def write_binary(path, results, compression):
+    with open(path, 'wb') as file, \
+            WorkingSetWriter(file, compression=compression) as writer:
+        for result in results:
+            writer.write(result)
+
+
+def read_binary(path):
+    with open(path, 'rb') as file:
+        return sum(1 for result in WorkingSetReader(file))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--rows', type=int, default=500000,
+                            help='Number of results')
+    arg_parser.add_argument('--temp-dir',
+                            help='Directory for the temporary files')
+    args = arg_parser.parse_args()
+
+    random.seed(1)
+    start_datetime = datetime.datetime(2020, 1, 1)
+    results = [
+        {
+            'id': index,
+            'project_id': 'project{0}'.format(index % 10),
+            'shortcode': generate_shortcode(),
+            'url': generate_url(),
+            'encoding': 'ascii',
+            'datetime': start_datetime + datetime.timedelta(seconds=index),
+        }
+        for index in range(args.rows)
+    ]
+    data_size = sum(
+        RECORD_HEADER.size + len(result['project_id']) +
+        len(result['shortcode']) + len(result['url']) +
+        len(result['encoding'])
+        for result in results
+    )
+
+    formats = (
+        ('pickle gzip', write_pickle, read_pickle),
+        ('binary zlib', lambda path, results:
+            write_binary(path, results, 'zlib'), read_binary),
+        ('binary lzma', lambda path, results:
+            write_binary(path, results, 'lzma'), read_binary),
+    )
+
+    print('{0:<12} {1:>10} {2:>10} {3:>12}'.format(
+        'format', 'write MB/s', 'read MB/s', 'file bytes'))
+
+    with tempfile.TemporaryDirectory(dir=args.temp_dir) as temp_dir:
+        for name, write_func, read_func in formats:
+            path = os.path.join(temp_dir, name.replace(' ', '-'))
+
+            start_time = time.perf_counter()
+            write_func(path, results)
+            write_time = time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            count = read_func(path)
+            read_time = time.perf_counter() - start_time
+
+            assert count == args.rows, count
+
+            print('{0:<12} {1:>10.1f} {2:>10.1f} {3:>12}'.format(
+                name, data_size / write_time / 1e6,
+                data_size / read_time / 1e6, os.path.getsize(path)))
+
+
+if __name__ == '__main__':
+    main()
@@ -6,7 +6,7 @@ import tornado.web
 from terroroftinytown.tracker.base import BaseHandler
 from terroroftinytown.tracker.form import BlockUsernameForm, UnblockUsernameForm, \
     DeleteAllErrorReportsForm, AutoDeleteErrorReportsForm, \
-    DeleteOneErrorReportForm
+    DeleteOneErrorReportForm, ProfilerForm
 from terroroftinytown.tracker.model import BlockedUser, ErrorReport, Result,\
     GlobalSetting
 from tornado.web import HTTPError
@@ -47,6 +47,7 @@ class BannedHandler(BaseHandler):
                 username = self.get_argument('username')
                 logger.info(self.user_audit_text('Unblocked "%s"'), username)
                 BlockedUser.unblock_username(username)
+                self.application.ban_list.remove(username)
                 message = 'User unblocked.'
 
         else:
@@ -54,6 +55,7 @@ class BannedHandler(BaseHandler):
                 username = form.username.data
                 logger.info(self.user_audit_text('Blocked "%s"'), username)
                 BlockedUser.block_username(username)
+                self.application.ban_list.add(username)
                 message = 'User blocked.'
 
         self.render(
@@ -139,3 +141,62 @@ class ResultsHandler(BaseHandler):
             next_higher_offset_id=int(results[0]['id'])+int(args['limit']) if results else 0,
             next_lower_offset_id=int(results[-1]['id'])-1 if results else 0,
             **args)
+
+
+class ProfilerHandler(BaseHandler):
+    profile_requests = False
+
+    @tornado.web.authenticated
+    def get(self):
+        self._render(ProfilerForm())
+
+    @tornado.web.authenticated
+    def post(self):
+        form = ProfilerForm(self.request.arguments)
+        profiler = self.application.profiler
+        message = None
+
+        if form.validate():
+            if form.mode.data == 'sample':
+                started = profiler.start_sampling(form.amount.data)
+            else:
+                started = profiler.start_request_profile(form.amount.data)
+
+            if started:
+                logger.info(self.user_audit_text('Started profiler %s %d'),
+                            form.mode.data, form.amount.data)
+                message = 'Profiler started.'
+            else:
+                message = 'The profiler is already running.'
+
+        self._render(form, message=message)
+
+    def _render(self, form, **kwargs):
+        if kwargs.get('message') is None:
+            kwargs.pop('message', None)
+
+        self.render(
+            'admin/overview/profiler.html',
+            form=form,
+            running=self.application.profiler.is_running(),
+            result=self.application.profiler.result,
+            **kwargs
+        )
+
+
+class ProfilerDownloadHandler(BaseHandler):
+    profile_requests = False
+
+    @tornado.web.authenticated
+    def get(self):
+        result = self.application.profiler.result
+
+        if not result:
+            raise HTTPError(404, reason='No profile available')
+
+        self.set_header('Content-Type', result.content_type)
+        self.set_header(
+            'Content-Disposition',
+            'attachment; filename="{0}"'.format(result.filename)
+        )
+        self.write(result.data)
@@ -3,18 +3,23 @@ import json
 import logging
 
 from tornado.web import HTTPError
+import tornado.gen
 import tornado.websocket
 
+from terroroftinytown.tracker import metrics
 from terroroftinytown.tracker.base import BaseHandler
 from terroroftinytown.tracker.errors import (NoItemAvailable, UserIsBanned,
-    InvalidClaim, FullClaim, UpdateClient, NoResourcesAvailable)
+    InvalidClaim, FullClaim, UpdateClient, NoResourcesAvailable, ServerBusy)
 from terroroftinytown.tracker.model import Project
-from terroroftinytown.tracker.stats import Stats, stats_bus
+from terroroftinytown.tracker.stats import Stats, THROUGHPUT_RESOLUTIONS
 from terroroftinytown.util.jsonutil import NativeStringJSONDecoder
 
 
 logger = logging.getLogger(__name__)
 
+MAX_BATCH_CLAIMS = 10
+MAX_BATCH_CHECKINS = 50
+
 
 class ProjectSettingsHandler(BaseHandler):
     def get(self):
@@ -29,23 +34,10 @@ class ProjectSettingsHandler(BaseHandler):
 
 class LiveStatsHandler(tornado.websocket.WebSocketHandler):
     def open(self):
-        global stats_bus
-        self.write_message({
-            'live': Stats.instance.get_live(),
-            'lifetime': Stats.instance.get_lifetime(),
-            'global': Stats.instance.get_global(),
-            'project': Stats.instance.get_project()
-        })
-
-        stats_bus += self.on_stats
-
-    def on_stats(self, **stats):
-        self.write_message({
-            'live_new': stats
-        })
+        self.application.live_stats_broadcaster.add_client(self)
 
     def on_close(self):
-        stats_bus.clear_handlers(self)
+        self.application.live_stats_broadcaster.remove_client(self)
 
 
 class UserStatsHandler(BaseHandler):
@@ -54,7 +46,49 @@ class UserStatsHandler(BaseHandler):
         self.write({'stats': stats})
 
 
+class LeaderboardHandler(BaseHandler):
+    MAX_LIMIT = 1000
+
+    def get(self):
+        offset = max(0, int(self.get_argument('offset', 0)))
+        limit = min(self.MAX_LIMIT, max(1, int(self.get_argument('limit', 100))))
+
+        self.write({
+            'total': Stats.instance.get_leaderboard_size(),
+            'offset': offset,
+            'leaderboard': Stats.instance.get_leaderboard(offset, limit),
+        })
+
+
+class ThroughputHandler(BaseHandler):
+    def get(self):
+        resolution = self.get_argument('resolution', 'minute')
+        count = max(1, int(self.get_argument('count', 60)))
+        project = self.get_argument('project', None)
+
+        if resolution not in THROUGHPUT_RESOLUTIONS:
+            raise HTTPError(400, reason='Unknown resolution')
+
+        interval = THROUGHPUT_RESOLUTIONS[resolution][0]
+
+        self.write({
+            'resolution': resolution,
+            'interval': interval,
+            'project': project,
+            'throughput': Stats.instance.get_throughput(
+                resolution, count, project=project),
+        })
+
+
+class MetricsHandler(BaseHandler):
+    def get(self):
+        self.application.update_metrics()
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.write(metrics.registry.render())
+
+
 class GetHandler(BaseHandler):
+    @tornado.gen.coroutine
     def post(self):
         ip_address = self.request.remote_ip
         version = int(self.get_argument('version'))
@@ -63,11 +97,13 @@ class GetHandler(BaseHandler):
         user_agent = self.request.headers.get('User-Agent')
 
         try:
-            claim = self.application.checkout_item(
-                username, ip_address=ip_address, version=version,
-                client_version=client_version
-            )
+            claims = yield self.checkout(
+                username, ip_address, version, client_version)
+        except ServerBusy:
+            metrics.checkout_outcomes.inc('busy')
+            raise HTTPError(503, reason='The tracker is busy. Try again later.')
         except NoItemAvailable:
+            metrics.checkout_outcomes.inc('no_item_available')
             raise HTTPError(
                 404,
                 reason='No free items available currently. '
@@ -75,11 +111,13 @@ class GetHandler(BaseHandler):
                         'You will be assigned items soon.'
             )
         except UserIsBanned:
+            metrics.checkout_outcomes.inc('banned')
             raise HTTPError(
                 403,
                 reason='You are banned. Please contact an administrator.'
             )
         except FullClaim:
+            metrics.checkout_outcomes.inc('full_claim')
             raise HTTPError(
                 429,
                 reason=(
@@ -90,6 +128,7 @@ class GetHandler(BaseHandler):
                     )
                 )
         except UpdateClient as e:
+            metrics.checkout_outcomes.inc('update_client')
             raise HTTPError(
                 412,
                 reason=(
@@ -104,6 +143,7 @@ class GetHandler(BaseHandler):
                 )
             )
         except NoResourcesAvailable as e:
+            metrics.checkout_outcomes.inc('no_resources_available')
             raise HTTPError(
                 507,
                 reason='The tracker needs an operator for manual maintenance. '
@@ -116,11 +156,42 @@ class GetHandler(BaseHandler):
                 ip_address, repr(username),
                 version, client_version, repr(user_agent)
             )
-            logger.info('Checked out claim %s', claim)
-            self.write(claim)
+            for claim in claims:
+                logger.info('Checked out claim %s', claim)
+
+            metrics.checkout_outcomes.inc('ok', amount=len(claims))
+
+            self.write_claims(claims)
+
+    def checkout(self, username, ip_address, version, client_version):
+        return self.application.checkout_items(
+            username, ip_address=ip_address, version=version,
+            client_version=client_version
+        )
+
+    def write_claims(self, claims):
+        self.write(claims[0])
+
+
+class BatchGetHandler(GetHandler):
+    def checkout(self, username, ip_address, version, client_version):
+        count = int(self.get_argument('count'))
+
+        if count < 1:
+            raise HTTPError(400, reason='Count must be positive.')
+
+        return self.application.checkout_items(
+            username, ip_address=ip_address, version=version,
+            client_version=client_version,
+            max_items=min(count, MAX_BATCH_CLAIMS)
+        )
+
+    def write_claims(self, claims):
+        self.write({'items': claims})
 
 
 class DoneHandler(BaseHandler):
+    @tornado.gen.coroutine
     def post(self):
         claim_id = self.get_argument('claim_id')
         tamper_key = self.get_argument('tamper_key')
@@ -128,7 +199,10 @@ class DoneHandler(BaseHandler):
         results = json.loads(results_str, cls=NativeStringJSONDecoder)
 
         try:
-            stats = self.application.checkin_item(claim_id, tamper_key, results)
+            stats = yield self.application.checkin_item(
+                claim_id, tamper_key, results)
+        except ServerBusy:
+            raise HTTPError(503, reason='The tracker is busy. Try again later.')
         except InvalidClaim:
             raise HTTPError(
                 409,
@@ -145,14 +219,98 @@ class DoneHandler(BaseHandler):
             self.write({'status': 'OK'})
 
 
+def parse_checkins(items):
+    '''Return the ``(claim_id, tamper_key, results)`` tuples of a batch.
+
+    Raises ValueError if the batch is not a list of check ins with
+    results mapping shortcodes to a URL and encoding.
+    '''
+    if not isinstance(items, list):
+        raise ValueError('Items must be a list.')
+
+    checkins = []
+
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError('Each item must be an object.')
+
+        claim_id = item.get('claim_id')
+        tamper_key = item.get('tamper_key')
+        results = item.get('results')
+
+        if isinstance(claim_id, bool) or \
+                not isinstance(claim_id, (int, str)):
+            raise ValueError('Invalid claim_id.')
+
+        if not isinstance(tamper_key, str):
+            raise ValueError('Invalid tamper_key.')
+
+        if not isinstance(results, dict):
+            raise ValueError('Results must be an object.')
+
+        for result in results.values():
+            if not isinstance(result, dict) or \
+                    not isinstance(result.get('url'), str) or \
+                    not isinstance(result.get('encoding'), str):
+                raise ValueError('Each result needs a url and encoding.')
+
+        checkins.append((claim_id, tamper_key, results))
+
+    return checkins
+
+
+class BatchDoneHandler(BaseHandler):
+    @tornado.gen.coroutine
+    def post(self):
+        items_str = self.get_argument('items')
+
+        try:
+            items = json.loads(items_str, cls=NativeStringJSONDecoder)
+            checkins = parse_checkins(items)
+        except ValueError as error:
+            raise HTTPError(400, reason=str(error))
+
+        if not checkins or len(checkins) > MAX_BATCH_CHECKINS:
+            raise HTTPError(
+                400,
+                reason='Between 1 and %d items are allowed.'
+                       % MAX_BATCH_CHECKINS
+            )
+
+        try:
+            outcomes = yield self.application.checkin_items(checkins)
+        except ServerBusy:
+            raise HTTPError(503, reason='The tracker is busy. Try again later.')
+
+        statuses = []
+
+        for (claim_id, tamper_key, results), outcome in zip(checkins, outcomes):
+            if isinstance(outcome, InvalidClaim):
+                logger.info('Invalid claim %s in batch check in.', claim_id)
+                statuses.append({'claim_id': claim_id, 'status': 'invalid'})
+            else:
+                time_diff = outcome['finished'] - outcome['started']
+                logger.info('Checked in claim %s. Len=%d, Time_diff=%d',
+                            claim_id,
+                            len(results),
+                            time_diff
+                )
+                statuses.append({'claim_id': claim_id, 'status': 'OK'})
+
+        self.write({'status': 'OK', 'items': statuses})
+
+
 class ErrorHandler(BaseHandler):
+    @tornado.gen.coroutine
     def post(self):
         claim_id = self.get_argument('claim_id')
         tamper_key = self.get_argument('tamper_key')
         message = self.get_argument('message')
 
         try:
-            self.application.report_error(claim_id, tamper_key, message)
+            yield self.application.report_error(claim_id, tamper_key, message)
+        except ServerBusy:
+            raise HTTPError(503, reason='The tracker is busy. Try again later.')
         except InvalidClaim:
             raise HTTPError(409, reason='Invalid item claimed')
         else:
@@ -175,5 +333,7 @@ class HealthHandler(BaseHandler):
             'http_status_message': self._reason,
             'git_hash': str(status.git_hash),
             'projects': [project.name for project in status.projects],
-            'project_stats': status.project_stats
+            'project_stats': status.project_stats,
+            'deadman_fill_levels': self.application.get_deadman_fill_levels(),
+            'group_commit': self.application.group_committer.get_metrics(),
         })
@@ -0,0 +1,30 @@
+import unittest
+
+from terroroftinytown.tracker.api import parse_checkins
+
+
+class TestAPI(unittest.TestCase):
+    def test_parse_checkins(self):
+        results = {'a': {'url': 'http://example.com', 'encoding': 'ascii'}}
+
+        self.assertEqual(
+            [(1, 'key', results), ('2', 'key', {})],
+            parse_checkins([
+                {'claim_id': 1, 'tamper_key': 'key', 'results': results},
+                {'claim_id': '2', 'tamper_key': 'key', 'results': {}},
+            ])
+        )
+
+        bad_batches = [
+            {'claim_id': 1, 'tamper_key': 'key', 'results': results},
+            ['item'],
+            [{'tamper_key': 'key', 'results': results}],
+            [{'claim_id': 1, 'results': results}],
+            [{'claim_id': 1, 'tamper_key': 'key', 'results': []}],
+            [{'claim_id': 1, 'tamper_key': 'key', 'results': {'a': 'url'}}],
+            [{'claim_id': 1, 'tamper_key': 'key', 'results': {'a': {}}}],
+        ]
+
+        for items in bad_batches:
+            with self.assertRaises(ValueError):
+                parse_checkins(items)
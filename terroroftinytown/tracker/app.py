@@ -1,22 +1,33 @@
 # encoding=utf-8
 import collections;
 import functools
+import logging
 import os.path
 
 from tornado.web import URLSpec as U
+import tornado.ioloop
+import tornado.process
 import tornado.web
 
 from terroroftinytown.client.alphabet import str_to_int, int_to_str
 from terroroftinytown.services.registry import registry
 from terroroftinytown.tracker import account, admin, project, api
-from terroroftinytown.tracker import model
+from terroroftinytown.tracker import metrics, model
+from terroroftinytown.tracker.banlist import BanList
 from terroroftinytown.tracker.base import BaseHandler
-from terroroftinytown.tracker.errors import UserIsBanned
+from terroroftinytown.tracker.broadcast import LiveStatsBroadcaster
+from terroroftinytown.tracker.errors import ServerBusy, UserIsBanned
+from terroroftinytown.tracker.executor import BoundedExecutor
+from terroroftinytown.tracker.groupcommit import GroupCommitter
 from terroroftinytown.tracker.form import CalculatorForm
 from terroroftinytown.tracker.model import GlobalSetting, ErrorReport
+from terroroftinytown.tracker.profiler import Profiler
 from terroroftinytown.tracker.stats import Stats
 from terroroftinytown.tracker.ui import FormUIModule
 
+
+logger = logging.getLogger(__name__)
+
 ProjectStatus = collections.namedtuple(
     '_ProjectStatus',
     ['git_hash', 'projects', 'project_stats'])
@@ -34,6 +45,10 @@ class Application(tornado.web.Application):
             U(r'/admin/banned', admin.BannedHandler, name='admin.banned'),
             U(r'/admin/login', account.LoginHandler, name='admin.login'),
             U(r'/admin/logout', account.LogoutHandler, name='admin.logout'),
+            U(r'/admin/profiler', admin.ProfilerHandler,
+              name='admin.profiler'),
+            U(r'/admin/profiler/download', admin.ProfilerDownloadHandler,
+              name='admin.profiler.download'),
             U(r'/admin/results', admin.ResultsHandler, name='admin.results'),
             U(r'/admin/error_reports', admin.ErrorReportsListHandler,
               name='admin.error_reports'),
@@ -55,10 +70,15 @@ class Application(tornado.web.Application):
             U(r'/project/([a-z0-9_-]*)/settings', project.SettingsHandler, name='project.settings'),
             U(r'/project/([a-z0-9_-]*)/delete', project.DeleteHandler, name='project.delete'),
             U(r'/api/live_stats', api.LiveStatsHandler, name='api.live_stats'),
+            U(r'/api/leaderboard', api.LeaderboardHandler, name='api.leaderboard'),
+            U(r'/api/throughput', api.ThroughputHandler, name='api.throughput'),
+            U(r'/api/metrics', api.MetricsHandler, name='api.metrics'),
             U(r'/api/stats/([A-Za-z0-9_-]+)', api.UserStatsHandler, name='api.user_stats'),
             U(r'/api/project_settings', api.ProjectSettingsHandler, name='api.project_settings'),
             U(r'/api/get', api.GetHandler, name='api.get'),
+            U(r'/api/get_batch', api.BatchGetHandler, name='api.get_batch'),
             U(r'/api/done', api.DoneHandler, name='api.done'),
+            U(r'/api/done_batch', api.BatchDoneHandler, name='api.done_batch'),
             U(r'/api/error', api.ErrorHandler, name='api.error'),
             U(r'/api/health', api.HealthHandler, name='api.health'),
             U(r'/status', StatusHandler, name='index.status'),
@@ -85,14 +105,44 @@ class Application(tornado.web.Application):
             **kwargs
         )
 
+        self.executor = BoundedExecutor(
+            max_workers=self.settings.get('database_workers', 4),
+            max_queue=self.settings.get('database_queue_size', 100),
+        )
+        self.group_committer = GroupCommitter(
+            max_batch_size=self.settings.get('group_commit_size', 50),
+            max_delay=self.settings.get('group_commit_delay', 0.005),
+        )
+        self.ban_list = BanList()
+        # Loaded even during maintenance so banned clients are never let in
+        # while waiting for the first job
+        self.ban_list.refresh()
+        self.profiler = Profiler()
+        self.live_stats_broadcaster = LiveStatsBroadcaster(
+            self.get_live_stats_snapshot)
+        self.live_stats_broadcaster.start()
+
+        if not self.is_maintenance_in_progress():
+            model.Budget.calculate_budgets()
+
+        self._job_future = None
+        self.run_jobs()
+
         def job_task():
-            if self.is_maintenance_in_progress():
+            # The jobs query the database so keep them off the IOLoop
+            if self._job_future and not self._job_future.done():
+                logger.warning('Periodic jobs are still running.')
                 return
 
-            model.Item.release_old(autoqueue_only=True)
-            model.Budget.calculate_budgets()
+            try:
+                self._job_future = self.executor.submit(self.run_jobs)
+            except ServerBusy:
+                logger.warning('Periodic jobs skipped. The tracker is busy.')
+                return
 
-        job_task()
+            # Raise any error on the IOLoop so it gets logged
+            tornado.ioloop.IOLoop.current().add_future(
+                self._job_future, lambda future: future.result())
 
         self._job_timer = tornado.ioloop.PeriodicCallback(
             job_task,
@@ -101,7 +151,8 @@ class Application(tornado.web.Application):
         self._job_timer.start()
 
         def clean_error_reports():
-            if self.is_maintenance_in_progress():
+            if self.is_maintenance_in_progress() \
+                    or not self.is_primary_process():
                 return
 
             enabled = GlobalSetting.get_value(
@@ -118,17 +169,120 @@ class Application(tornado.web.Application):
         )
         self._clean_error_reports_timer.start()
 
-    def checkout_item(self, username, ip_address=None, version=-1, client_version=-1):
-        if model.BlockedUser.is_username_blocked(username, ip_address):
+    def run_jobs(self):
+        '''Run the periodic maintenance jobs.'''
+        self.ban_list.refresh()
+
+        if self.is_maintenance_in_progress():
+            return
+
+        model.ItemPool.check_consistency()
+
+        if self.is_primary_process():
+            self.release_expired_claims()
+            model.Budget.reconcile()
+
+        model.Deadman.reconcile()
+
+    def release_expired_claims(self):
+        '''Release expired claims of autoqueue projects.
+
+        The number of claims and the time taken are recorded in the
+        metrics. Returns a list of ``(project_id, ip_address)``.
+        '''
+        with metrics.autorelease_duration.time():
+            claims = model.Item.release_old(autoqueue_only=True)
+
+        model.Budget.release_claims(claims)
+
+        for project_id, ip_address in claims:
+            metrics.autoreleased_claims.inc(project_id)
+
+        if claims:
+            logger.info('Released %d expired claims.', len(claims))
+
+        return claims
+
+    @classmethod
+    def is_primary_process(cls):
+        '''Return whether this process runs the jobs shared by all processes.
+
+        Only the first of the processes started by
+        :func:`tornado.process.fork_processes` is primary.
+        '''
+        return tornado.process.task_id() in (None, 0)
+
+    def checkout_items(self, username, ip_address=None, version=-1,
+                       client_version=-1, max_items=1):
+        '''Check out items in a database worker.
+
+        Returns a Future resolving to a list of claims.
+        '''
+        return self.executor.submit(
+            self._checkout_items, username, ip_address, version,
+            client_version, max_items
+        )
+
+    def _checkout_items(self, username, ip_address, version, client_version,
+                        max_items):
+        if self.ban_list.is_blocked(username, ip_address):
             raise UserIsBanned()
 
-        return model.checkout_item(username, ip_address, version, client_version)
+        with metrics.database_duration.time('checkout'):
+            return model.checkout_items(
+                username, ip_address, version, client_version, max_items)
 
     def checkin_item(self, item_id, tamper_key, results):
-        return model.checkin_item(item_id, tamper_key, results)
+        '''Check in an item with the group committer. Returns a Future.'''
+        return self.group_committer.submit(item_id, tamper_key, results)
+
+    def checkin_items(self, checkins):
+        '''Check in items in one transaction with the group committer.
+
+        Returns a Future resolving to a list of item stats or
+        :class:`InvalidClaim` instances.
+        '''
+        return self.group_committer.submit_many(checkins)
 
     def report_error(self, item_id, tamper_key, message):
-        model.report_error(item_id, tamper_key, message)
+        '''Save an error report in a database worker. Returns a Future.'''
+        return self.executor.submit(
+            self._report_error, item_id, tamper_key, message)
+
+    def _report_error(self, item_id, tamper_key, message):
+        with metrics.database_duration.time('report_error'):
+            model.report_error(item_id, tamper_key, message)
+
+    def update_metrics(self):
+        '''Set the gauges that are sampled when metrics are read.'''
+        metrics.budget_items.clear()
+        metrics.budget_claims.clear()
+
+        projects = model.Budget.get_projects(with_ip_addresses=False)
+
+        for project_id, info in projects.items():
+            metrics.budget_items.set(info['items'], project_id)
+            metrics.budget_claims.set(info['claims'], project_id)
+
+        for name, value in self.group_committer.get_metrics().items():
+            metrics.group_commit.set(value, name)
+
+        for table, value in model.Deadman.get_fill_levels().items():
+            metrics.deadman_fill_level.set(value, table)
+
+    def get_live_stats_snapshot(self):
+        lifetime = dict(
+            (username, [found, scanned])
+            for username, found, scanned in Stats.instance.get_leaderboard(
+                0, IndexHandler.LEADERBOARD_PAGE_SIZE)
+        )
+
+        return {
+            'live': Stats.instance.get_live(),
+            'lifetime': lifetime,
+            'global': Stats.instance.get_global(),
+            'project': Stats.instance.get_project(),
+        }
 
     def is_maintenance_in_progress(self):
         sentinel_path = self.settings.get('maintenance_sentinel')
@@ -138,6 +292,9 @@ class Application(tornado.web.Application):
     def is_deadman_safety_tripped(self):
         return model.deadman_checks()
 
+    def get_deadman_fill_levels(self):
+        return model.Deadman.get_fill_levels()
+
     def get_project_status(self):
         projects = list([
             model.Project.get_plain(name)
@@ -152,18 +309,18 @@ class Application(tornado.web.Application):
 
 
 class IndexHandler(BaseHandler):
+    LEADERBOARD_PAGE_SIZE = 300
+
     def get(self):
-        lifetime_list = [
-            (username, found, scanned)
-            for username, (found, scanned)
-            in Stats.instance.get_lifetime().items()
-        ]
-        lifetime_list = sorted(lifetime_list, key=lambda item: item[2],
-                               reverse=True)
+        offset = max(0, int(self.get_argument('offset', 0)))
 
         stats = {
             'global': Stats.instance.get_global(),
-            'lifetime': lifetime_list[:300],
+            'lifetime': Stats.instance.get_leaderboard(
+                offset, self.LEADERBOARD_PAGE_SIZE),
+            'lifetime_offset': offset,
+            'lifetime_page_size': self.LEADERBOARD_PAGE_SIZE,
+            'lifetime_total': Stats.instance.get_leaderboard_size(),
             'live': Stats.instance.get_live(),
         }
 
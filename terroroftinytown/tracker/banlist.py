@@ -0,0 +1,82 @@
+# encoding=utf-8
+'''In-memory copy of blocked usernames and IP addresses.'''
+import ipaddress
+import threading
+
+from terroroftinytown.tracker.model import BlockedUser
+
+
+class BanList(object):
+    '''Answer whether a client is blocked without querying the database.
+
+    Entries are the same strings as stored in :class:`BlockedUser`.
+    Every entry is matched exactly against the username and IP address.
+    Entries in CIDR notation, such as ``192.0.2.0/24``, also match any
+    IP address in the range. Ranges are grouped by prefix length so a
+    lookup costs one set membership test per distinct prefix length.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = (frozenset(), {})
+
+    def refresh(self):
+        '''Reload the entries from the database.'''
+        self.load(BlockedUser.all_blocked_usernames())
+
+    def load(self, entries):
+        with self._lock:
+            self._set_entries(frozenset(entries))
+
+    def add(self, entry):
+        with self._lock:
+            self._set_entries(self._state[0] | {entry})
+
+    def remove(self, entry):
+        with self._lock:
+            self._set_entries(self._state[0] - {entry})
+
+    def _set_entries(self, entries):
+        networks = {}
+
+        for entry in entries:
+            if '/' not in entry:
+                continue
+
+            try:
+                network = ipaddress.ip_network(entry, strict=False)
+            except ValueError:
+                continue
+
+            key = (network.version, network.prefixlen)
+            networks.setdefault(key, set()).add(
+                int(network.network_address) >> self._host_bits(*key))
+
+        # Replaced in one assignment so lookups from other threads do not
+        # need to hold the lock.
+        self._state = (entries, networks)
+
+    @classmethod
+    def _host_bits(cls, version, prefix_length):
+        return (32 if version == 4 else 128) - prefix_length
+
+    def is_blocked(self, username, ip_address=None):
+        entries, networks = self._state
+
+        if username in entries or ip_address in entries:
+            return True
+
+        if ip_address and networks:
+            try:
+                address = ipaddress.ip_address(ip_address)
+            except ValueError:
+                return False
+
+            address_int = int(address)
+
+            for (version, prefix_length), prefixes in networks.items():
+                if version == address.version and \
+                        address_int >> self._host_bits(version, prefix_length) \
+                        in prefixes:
+                    return True
+
+        return False
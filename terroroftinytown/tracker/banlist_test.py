@@ -0,0 +1,47 @@
+import unittest
+
+from terroroftinytown.tracker.banlist import BanList
+from terroroftinytown.tracker.database import Database
+from terroroftinytown.tracker.model import BlockedUser
+
+
+class TestBanList(unittest.TestCase):
+    def test_exact(self):
+        ban_list = BanList()
+        ban_list.load(['baduser', '192.0.2.1'])
+
+        self.assertTrue(ban_list.is_blocked('baduser', '198.51.100.1'))
+        self.assertTrue(ban_list.is_blocked('user', '192.0.2.1'))
+        self.assertFalse(ban_list.is_blocked('user', '192.0.2.2'))
+
+        ban_list.remove('baduser')
+        ban_list.add('user')
+
+        self.assertFalse(ban_list.is_blocked('baduser', '198.51.100.1'))
+        self.assertTrue(ban_list.is_blocked('user', '198.51.100.1'))
+
+    def test_network(self):
+        ban_list = BanList()
+        ban_list.load(['192.0.2.0/24', '10.0.0.0/8', '2001:db8::/32',
+                       'not/a network'])
+
+        self.assertTrue(ban_list.is_blocked('user', '192.0.2.200'))
+        self.assertTrue(ban_list.is_blocked('user', '10.1.2.3'))
+        self.assertTrue(ban_list.is_blocked('user', '2001:db8::1'))
+        self.assertFalse(ban_list.is_blocked('user', '192.0.3.1'))
+        self.assertFalse(ban_list.is_blocked('user', '2001:db9::1'))
+        self.assertFalse(ban_list.is_blocked('user', 'garbage'))
+        self.assertFalse(ban_list.is_blocked('user'))
+
+        ban_list.remove('10.0.0.0/8')
+
+        self.assertFalse(ban_list.is_blocked('user', '10.1.2.3'))
+
+    def test_refresh(self):
+        Database('sqlite://')
+        BlockedUser.block_username('192.0.2.0/24')
+
+        ban_list = BanList()
+        ban_list.refresh()
+
+        self.assertTrue(ban_list.is_blocked('user', '192.0.2.1'))
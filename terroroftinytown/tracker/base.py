@@ -1,6 +1,9 @@
 # encoding=utf-8
+import time
+
 import tornado.web
 
+from terroroftinytown.tracker import metrics
 from terroroftinytown.tracker.model import User
 
 
@@ -9,6 +12,8 @@ ACCOUNT_TOKEN_COOKIE_NAME = 'tottt'
 
 
 class BaseHandler(tornado.web.RequestHandler):
+    profile_requests = True
+
     def get_current_user(self):
         username_raw = self.get_secure_cookie(ACCOUNT_COOKIE_NAME)
         token = self.get_secure_cookie(ACCOUNT_TOKEN_COOKIE_NAME)
@@ -20,9 +25,27 @@ class BaseHandler(tornado.web.RequestHandler):
                 return username
 
     def prepare(self):
+        self._start_time = time.perf_counter()
+
         if self.application.is_maintenance_in_progress():
             self._show_maintenance_page()
 
+    def on_finish(self):
+        if self.profile_requests:
+            self.application.profiler.on_request_finished()
+
+        start_time = getattr(self, '_start_time', None)
+
+        if start_time is None:
+            return
+
+        handler_name = type(self).__name__
+        method = self.request.method
+
+        metrics.request_duration.observe(
+            time.perf_counter() - start_time, handler_name, method)
+        metrics.requests_total.inc(handler_name, method, self.get_status())
+
     def _show_maintenance_page(self):
         self.set_status(512, 'Export is in progress. We\'ll be back soon!')
         self.render('maintenance.html')
@@ -7,11 +7,15 @@ import signal
 import redis
 import tornado.httpserver
 import tornado.ioloop
+import tornado.netutil
+import tornado.process
 
 from terroroftinytown.tracker.app import Application
 from terroroftinytown.tracker.database import Database
 from terroroftinytown.tracker.logs import GzipTimedRotatingFileHandler, \
     LogFilter
+from terroroftinytown.tracker.model import Budget, ItemPool, User
+from terroroftinytown.tracker.sharedbudget import SharedBudget
 from terroroftinytown.tracker.stats import Stats
 
 
@@ -42,6 +46,12 @@ class Bootstrap:
     def setup_database(self):
         self.database = Database(
             path=self.config['database']['path'],
+            pool_size=self.config.getint(
+                'database', 'pool_size', fallback=5),
+            max_overflow=self.config.getint(
+                'database', 'max_overflow', fallback=10),
+            item_pool=self.config.get(
+                'database', 'item_pool', fallback='auto'),
         )
 
     def setup_redis(self):
@@ -62,9 +72,24 @@ class Bootstrap:
         self.stats = Stats(
             self.redis,
             self.config.get('redis', 'prefix', fallback=''),
-            self.config.getint('redis', 'max_stats', fallback=30)
+            self.config.getint('redis', 'max_stats', fallback=30),
+            update_mode=self.config.get(
+                'redis', 'stats_update_mode', fallback='pipeline'),
         )
 
+    def setup_budget(self):
+        budget_mode = self.config.get('redis', 'budget_mode', fallback='local')
+
+        if budget_mode == 'shared':
+            Budget.shared = SharedBudget(
+                self.redis, self.config.get('redis', 'prefix', fallback=''))
+            # Processes would otherwise race for the same pooled items
+            ItemPool.shuffle = True
+            # Password changes would not reach the other processes
+            User.cache_tokens = False
+        elif budget_mode != 'local':
+            raise ValueError('Unknown budget mode {0}'.format(budget_mode))
+
     def setup_logging(self):
         log_path = self.config.get('logging', 'path', fallback=None)
 
@@ -90,8 +115,10 @@ class Bootstrap:
 class ApplicationBootstrap(Bootstrap):
     def start(self):
         super().start()
+        self.setup_processes()
         self.setup_redis()
         self.setup_stats()
+        self.setup_budget()
         self.setup_application()
         self.setup_logging()
         self.setup_signal_handlers()
@@ -104,8 +131,40 @@ class ApplicationBootstrap(Bootstrap):
             debug=self.args.debug,
             cookie_secret=self.config['web']['cookie_secret'],
             maintenance_sentinel=self.config['web'].get('maintenance_sentinel_file'),
+            database_workers=self.config.getint(
+                'database', 'worker_pool_size', fallback=4),
+            database_queue_size=self.config.getint(
+                'database', 'worker_queue_size', fallback=100),
+            group_commit_size=self.config.getint(
+                'database', 'group_commit_size', fallback=50),
+            group_commit_delay=self.config.getfloat(
+                'database', 'group_commit_delay_ms', fallback=5) / 1000,
         )
 
+    def setup_processes(self):
+        '''Bind the listening sockets and fork the worker processes.
+
+        Forking happens before anything else starts threads or opens
+        connections. The database schema was set up in the parent so
+        its pooled connections are discarded in the children.
+        '''
+        host = self.config['web'].get('host', 'localhost')
+        port = int(self.config['web']['port'])
+        processes = self.config.getint('web', 'processes', fallback=1)
+
+        self.sockets = tornado.netutil.bind_sockets(port, address=host)
+
+        if processes == 1:
+            return
+
+        if self.config.get('redis', 'budget_mode', fallback='local') \
+                != 'shared':
+            raise ValueError(
+                'Multiple processes require budget_mode shared.')
+
+        tornado.process.fork_processes(processes)
+        self.database.engine.dispose()
+
     def boot(self):
         host = self.config['web'].get('host', 'localhost')
         port = int(self.config['web']['port'])
@@ -119,7 +178,7 @@ class ApplicationBootstrap(Bootstrap):
         self.server = tornado.httpserver.HTTPServer(
             self.application, xheaders=xheaders
         )
-        self.server.listen(port, address=host)
+        self.server.add_sockets(self.sockets)
         tornado.ioloop.IOLoop.instance().start()
 
     def setup_signal_handlers(self):
@@ -134,4 +193,6 @@ class ApplicationBootstrap(Bootstrap):
     def stop(self):
         io_loop = tornado.ioloop.IOLoop.instance()
         self.server.stop()
+        self.application.group_committer.stop()
+        self.application.live_stats_broadcaster.stop()
         io_loop.call_later(1, io_loop.stop)
@@ -0,0 +1,126 @@
+# encoding=utf-8
+'''Live stats fan-out to websocket clients.'''
+import json
+import logging
+import threading
+
+import tornado.ioloop
+import tornado.websocket
+
+from terroroftinytown.tracker.stats import stats_bus
+
+
+logger = logging.getLogger(__name__)
+
+
+class LiveStatsBroadcaster(object):
+    '''Send live stats to websocket clients in batches.
+
+    Item stats fired on :data:`stats_bus` are gathered and sent every
+    `interval` seconds as one message serialized once for all clients.
+    A batch contains the most recent `max_live` items and the found and
+    scanned totals added since the previous batch, so its size does not
+    grow with the check in rate.
+
+    A client whose previous message is still being written is skipped.
+    Once it catches up, it is sent a fresh snapshot from
+    `get_snapshot` instead of the batches it missed.
+    '''
+    def __init__(self, get_snapshot, interval=0.25, max_live=30):
+        self.get_snapshot = get_snapshot
+        self.interval = interval
+        self.max_live = max_live
+
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._lagging = set()
+        self._timer = None
+        self._reset_batch()
+
+    def _reset_batch(self):
+        self._live = []
+        self._global = [0, 0]
+        self._projects = {}
+        self._users = {}
+
+    def start(self):
+        global stats_bus
+        stats_bus += self.on_stats
+
+        self._timer = tornado.ioloop.PeriodicCallback(
+            self.flush, self.interval * 1000)
+        self._timer.start()
+
+    def stop(self):
+        stats_bus.clear_handlers(self)
+
+        if self._timer:
+            self._timer.stop()
+
+    def on_stats(self, **stats):
+        # Stats are fired from the database worker threads
+        found = stats['found']
+        scanned = stats['scanned']
+
+        with self._lock:
+            self._live.append(stats)
+
+            if len(self._live) > self.max_live:
+                del self._live[0]
+
+            self._global[0] += found
+            self._global[1] += scanned
+
+            for totals, key in ((self._projects, stats['project']),
+                                (self._users, stats['username'])):
+                counts = totals.setdefault(key, [0, 0])
+                counts[0] += found
+                counts[1] += scanned
+
+    def add_client(self, client):
+        '''Send a snapshot to the new client and include it in batches.'''
+        self._write(client, json.dumps(self.get_snapshot()))
+
+    def remove_client(self, client):
+        self._clients.pop(client, None)
+        self._lagging.discard(client)
+
+    def flush(self):
+        with self._lock:
+            if not self._live:
+                batch_message = None
+            else:
+                batch_message = json.dumps({'batch': {
+                    'live': self._live,
+                    'global': self._global,
+                    'project': self._projects,
+                    'lifetime': self._users,
+                }})
+                self._reset_batch()
+
+        snapshot_message = None
+
+        for client, future in list(self._clients.items()):
+            if future and not future.done():
+                if batch_message:
+                    self._lagging.add(client)
+                continue
+
+            if client in self._lagging:
+                if snapshot_message is None:
+                    snapshot_message = json.dumps(self.get_snapshot())
+
+                self._lagging.discard(client)
+                message = snapshot_message
+            elif batch_message:
+                message = batch_message
+            else:
+                continue
+
+            self._write(client, message)
+
+    def _write(self, client, message):
+        try:
+            self._clients[client] = client.write_message(message)
+        except tornado.websocket.WebSocketClosedError:
+            self.remove_client(client)
@@ -0,0 +1,96 @@
+import concurrent.futures
+import json
+import unittest
+
+import tornado.websocket
+
+from terroroftinytown.tracker.broadcast import LiveStatsBroadcaster
+
+
+class MockClient(object):
+    def __init__(self):
+        self.messages = []
+        self.future = None
+        self.closed = False
+
+    def write_message(self, message):
+        if self.closed:
+            raise tornado.websocket.WebSocketClosedError()
+
+        self.messages.append(json.loads(message))
+        self.future = concurrent.futures.Future()
+
+        return self.future
+
+
+def make_stats(username, found):
+    return {'project': 'test', 'username': username, 'found': found,
+            'scanned': 10, 'started': 0, 'finished': 0}
+
+
+class TestLiveStatsBroadcaster(unittest.TestCase):
+    def test_batch(self):
+        broadcaster = LiveStatsBroadcaster(
+            lambda: {'snapshot': True}, max_live=2)
+        client = MockClient()
+
+        broadcaster.add_client(client)
+        client.future.set_result(None)
+
+        for index in range(3):
+            broadcaster.on_stats(**make_stats('user{0}'.format(index % 2), 1))
+
+        broadcaster.flush()
+
+        self.assertEqual({'snapshot': True}, client.messages[0])
+
+        batch = client.messages[1]['batch']
+
+        self.assertEqual(['user1', 'user0'],
+                         [item['username'] for item in batch['live']])
+        self.assertEqual([3, 30], batch['global'])
+        self.assertEqual({'test': [3, 30]}, batch['project'])
+        self.assertEqual({'user0': [2, 20], 'user1': [1, 10]},
+                         batch['lifetime'])
+
+        broadcaster.flush()
+
+        self.assertEqual(2, len(client.messages))
+
+    def test_slow_client(self):
+        broadcaster = LiveStatsBroadcaster(lambda: {'snapshot': True})
+        slow_client = MockClient()
+        client = MockClient()
+
+        broadcaster.add_client(slow_client)
+        broadcaster.add_client(client)
+        client.future.set_result(None)
+
+        broadcaster.on_stats(**make_stats('user', 1))
+        broadcaster.flush()
+        client.future.set_result(None)
+
+        broadcaster.on_stats(**make_stats('user', 1))
+        broadcaster.flush()
+
+        self.assertEqual(3, len(client.messages))
+        self.assertEqual(1, len(slow_client.messages))
+
+        slow_client.future.set_result(None)
+        broadcaster.flush()
+
+        self.assertEqual({'snapshot': True}, slow_client.messages[1])
+        self.assertEqual(3, len(client.messages))
+
+    def test_closed_client(self):
+        broadcaster = LiveStatsBroadcaster(lambda: {})
+        client = MockClient()
+
+        broadcaster.add_client(client)
+        client.future.set_result(None)
+        client.closed = True
+
+        broadcaster.on_stats(**make_stats('user', 1))
+        broadcaster.flush()
+
+        self.assertEqual({}, broadcaster._clients)
@@ -1,27 +1,160 @@
 # encoding=utf-8
+import logging
+
 import sqlalchemy
 from sqlalchemy.engine import create_engine
-from sqlalchemy.pool import SingletonThreadPool
+from sqlalchemy.engine.reflection import Inspector
+from sqlalchemy.pool import QueuePool, SingletonThreadPool
+from sqlalchemy.sql.expression import text
+
+from terroroftinytown.tracker.model import Session, Base, GlobalSetting, \
+    ItemPool
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_index_names(connection, table_name):
+    '''Return the names of the indexes on a table.
+
+    The inspector skips expression indexes on SQLite and PostgreSQL so
+    their catalogs are queried instead.
+    '''
+    if connection.dialect.name == 'sqlite':
+        query = text(
+            "SELECT name FROM sqlite_master "
+            "WHERE type = 'index' AND tbl_name = :table_name")
+    elif connection.dialect.name == 'postgresql':
+        query = text(
+            'SELECT indexname FROM pg_indexes WHERE tablename = :table_name')
+    else:
+        inspector = Inspector.from_engine(connection)
+
+        return frozenset(
+            index['name'] for index in inspector.get_indexes(table_name))
+
+    return frozenset(
+        row[0] for row in connection.execute(query, table_name=table_name))
+
+
+def has_byte_order_collation(connection):
+    '''Return whether strings are compared by their bytes.
+
+    SQLite compares strings with memcmp() unless told otherwise.
+    PostgreSQL only does so when the database uses the C collation.
+    '''
+    if connection.dialect.name == 'sqlite':
+        return True
+    elif connection.dialect.name == 'postgresql':
+        collation = connection.execute(text(
+            'SELECT datcollate FROM pg_database '
+            'WHERE datname = current_database()')).scalar()
+
+        return collation in ('C', 'POSIX', 'C.UTF-8', 'C.utf8')
+
+    return False
+
+
+def get_model_index(name):
+    '''Return the index with the name declared on the models.'''
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name == name:
+                return index
+
+    raise KeyError(name)
+
+
+def create_indexes(*index_names):
+    '''Return a migration that creates the named indexes of the models.
+
+    Indexes that already exist, such as on a table that create_all()
+    made, are skipped.
+    '''
+    def migration(connection):
+        for name in index_names:
+            index = get_model_index(name)
 
-from terroroftinytown.tracker.model import Session, Base
+            if name not in get_index_names(connection, index.table.name):
+                logger.info('Creating index %s.', name)
+                index.create(connection)
+
+    return migration
+
+
+# Schema migrations as (version, description, function) in order.
+# The function is called with a connection inside a transaction.
+# New tables and the indexes on them are handled by create_all().
+MIGRATIONS = [
+    (1, 'Add indexes for hot queries', create_indexes(
+        'ix_items_project_id_username',
+        'ix_items_project_id_datetime_claimed',
+        'ix_items_ip_address_project_id',
+        'ix_results_datetime',
+        'ix_error_reports_item_id',
+    )),
+    (2, 'Add an index to export results in order', create_indexes(
+        'ix_results_export_order',
+    )),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
 
 
 class Database(object):
-    def __init__(self, path, delete_everything=False):
-        if path.startswith('sqlite:'):
+    '''Set up the engine and the schema.
+
+    Connections are pooled with at most `pool_size` idle connections
+    plus `max_overflow` more under load. An in-memory SQLite database
+    instead uses a connection per thread since each connection would be
+    a separate database.
+
+    `item_pool` is ``on``, ``off`` or ``auto``. Auto turns the in-memory
+    item pool off on PostgreSQL, where several trackers may share the
+    database and claim items with ``FOR UPDATE SKIP LOCKED`` instead.
+    '''
+    def __init__(self, path, delete_everything=False, pool_size=5,
+                 max_overflow=10, item_pool='auto'):
+        url = sqlalchemy.engine.url.make_url(path)
+
+        if url.drivername.startswith('sqlite') \
+                and url.database in (None, '', ':memory:'):
             self.engine = create_engine(path, poolclass=SingletonThreadPool)
+        elif url.drivername.startswith('sqlite'):
+            # Pooled connections are used by whichever thread checks them out
+            self.engine = create_engine(
+                path, poolclass=QueuePool, pool_size=pool_size,
+                max_overflow=max_overflow,
+                connect_args={'check_same_thread': False})
+        else:
+            self.engine = create_engine(
+                path, pool_size=pool_size, max_overflow=max_overflow)
+
+        if url.drivername.startswith('sqlite'):
             sqlalchemy.event.listen(
                 self.engine, 'connect', self._apply_pragmas_callback)
-        else:
-            self.engine = create_engine(path)
 
         Session.configure(bind=self.engine)
 
+        if item_pool == 'auto':
+            ItemPool.enabled = self.engine.dialect.name != 'postgresql'
+        elif item_pool in ('on', 'off'):
+            ItemPool.enabled = item_pool == 'on'
+        else:
+            raise ValueError('Unknown item pool mode {0}'.format(item_pool))
+
         if delete_everything == 'yes-really!':
             self._delete_everything()
 
+        is_new = not self.engine.has_table(GlobalSetting.__tablename__)
+
         Base.metadata.create_all(self.engine)
 
+        if is_new:
+            GlobalSetting.set_value(
+                GlobalSetting.SCHEMA_VERSION, SCHEMA_VERSION)
+        else:
+            self.migrate()
+
     @classmethod
     def _apply_pragmas_callback(cls, connection, record):
         connection.execute('PRAGMA journal_mode=WAL')
@@ -29,3 +162,23 @@ class Database(object):
 
     def _delete_everything(self):
         Base.metadata.drop_all(self.engine)
+
+    def get_schema_version(self):
+        return GlobalSetting.get_value(GlobalSetting.SCHEMA_VERSION) or 0
+
+    def migrate(self):
+        '''Apply the migrations newer than the stored schema version.'''
+        version = self.get_schema_version()
+
+        for migration_version, description, function in MIGRATIONS:
+            if migration_version <= version:
+                continue
+
+            logger.info('Migrating schema to version %d: %s',
+                        migration_version, description)
+
+            with self.engine.begin() as connection:
+                function(connection)
+
+            GlobalSetting.set_value(
+                GlobalSetting.SCHEMA_VERSION, migration_version)
@@ -0,0 +1,122 @@
+import datetime
+import os.path
+import tempfile
+import unittest
+
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.sql.expression import exists, select
+from sqlalchemy.sql.functions import func
+
+from terroroftinytown.tracker.database import Database, SCHEMA_VERSION, \
+    get_index_names, has_byte_order_collation
+from terroroftinytown.tracker.model import ErrorReport, GlobalSetting, Item, \
+    Result, new_session
+
+
+class TestDatabase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = 'sqlite:///' + os.path.join(self.temp_dir.name, 'test.db')
+        self.database = Database(self.path)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def get_query_plan(self, query):
+        compiled = query.compile(
+            dialect=sqlite.dialect(), compile_kwargs={'literal_binds': True})
+
+        with self.database.engine.connect() as connection:
+            rows = connection.execute('EXPLAIN QUERY PLAN {0}'.format(compiled))
+
+            return ' '.join(row[-1] for row in rows)
+
+    def assert_uses_index(self, index_name, query):
+        plan = self.get_query_plan(query)
+
+        self.assertIn(index_name, plan)
+
+    def test_new_database_version(self):
+        self.assertEqual(SCHEMA_VERSION, self.database.get_schema_version())
+
+    def test_byte_order_collation(self):
+        with self.database.engine.connect() as connection:
+            self.assertTrue(has_byte_order_collation(connection))
+
+    def test_migrate_indexes(self):
+        with self.database.engine.begin() as connection:
+            connection.execute('DROP INDEX ix_items_project_id_username')
+            connection.execute('DROP INDEX ix_results_datetime')
+            connection.execute('DROP INDEX ix_results_export_order')
+
+        GlobalSetting.set_value(GlobalSetting.SCHEMA_VERSION, 0)
+
+        self.database = Database(self.path)
+
+        self.assertEqual(SCHEMA_VERSION, self.database.get_schema_version())
+        self.assert_uses_index(
+            'ix_items_project_id_username',
+            select([Item.id]).where(Item.project_id == 'test')
+            .where(Item.username.is_(None))
+        )
+        self.assert_uses_index(
+            'ix_results_export_order',
+            select([Result.id]).where(Result.project_id == 'test')
+            .order_by(func.length(Result.shortcode), Result.shortcode)
+        )
+
+    def test_migration_indexes(self):
+        with self.database.engine.begin() as connection:
+            connection.execute('DROP INDEX ix_results_datetime')
+            connection.execute('DROP INDEX ix_results_export_order')
+
+        GlobalSetting.set_value(GlobalSetting.SCHEMA_VERSION, 1)
+
+        self.database = Database(self.path)
+
+        with self.database.engine.connect() as connection:
+            index_names = get_index_names(connection, 'results')
+
+        self.assertIn('ix_results_export_order', index_names)
+        self.assertNotIn('ix_results_datetime', index_names)
+
+    def test_query_plans(self):
+        date = datetime.datetime(2000, 1, 1)
+
+        with new_session() as session:
+            self.assert_uses_index(
+                'ix_items_project_id_username',
+                session.query(Item).filter_by(username=None)
+                .filter_by(project_id='test').limit(1).statement
+            )
+            self.assert_uses_index(
+                'ix_items_project_id_datetime_claimed',
+                session.query(Item.id).filter(
+                    Item.datetime_claimed <= date,
+                    Item.project_id == 'test').statement
+            )
+            self.assert_uses_index(
+                'ix_items_ip_address_project_id',
+                session.query(Item.project_id, Item.ip_address)
+                .filter(Item.ip_address.isnot(None)).distinct().statement
+            )
+            self.assert_uses_index(
+                'ix_results_export_order',
+                session.query(Result.id)
+                .filter(Result.project_id == 'test')
+                .filter(func.length(Result.shortcode) == 2)
+                .filter(Result.shortcode > 'ab')
+                .order_by(Result.shortcode, Result.id).statement
+            )
+            self.assert_uses_index(
+                'ix_results_datetime',
+                session.query(Result.id).filter(Result.datetime > date)
+                .statement
+            )
+
+        subquery = select([ErrorReport.id]) \
+            .where(ErrorReport.item_id == Item.id).limit(1)
+        self.assert_uses_index(
+            'ix_error_reports_item_id',
+            select([Item.id]).where(exists(subquery))
+        )
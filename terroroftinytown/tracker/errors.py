@@ -31,4 +31,8 @@ class UpdateClient(TrackerError):
 
 
 class NoResourcesAvailable(TrackerError):
-    pass
\ No newline at end of file
+    pass
+
+
+class ServerBusy(TrackerError):
+    pass
@@ -0,0 +1,39 @@
+# encoding=utf-8
+'''Run blocking database calls outside of the IOLoop.'''
+import concurrent.futures
+import threading
+
+from terroroftinytown.tracker.errors import ServerBusy
+
+
+class BoundedExecutor(object):
+    '''Thread pool with a limit on the number of waiting calls.
+
+    Once `max_workers` calls are running and `max_queue` calls are
+    waiting, :meth:`submit` raises :class:`ServerBusy` instead of
+    queueing the call without bound.
+    '''
+    def __init__(self, max_workers=4, max_queue=100):
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+        self._semaphore = threading.BoundedSemaphore(max_workers + max_queue)
+
+    def submit(self, func, *args, **kwargs):
+        '''Schedule the function call and return a Future.'''
+        if not self._semaphore.acquire(blocking=False):
+            raise ServerBusy()
+
+        try:
+            future = self._executor.submit(func, *args, **kwargs)
+        except:
+            self._semaphore.release()
+            raise
+
+        future.add_done_callback(self._release)
+
+        return future
+
+    def _release(self, future):
+        self._semaphore.release()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
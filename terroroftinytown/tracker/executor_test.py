@@ -0,0 +1,32 @@
+import threading
+import unittest
+
+from terroroftinytown.tracker.errors import ServerBusy
+from terroroftinytown.tracker.executor import BoundedExecutor
+
+
+class TestBoundedExecutor(unittest.TestCase):
+    def test_submit(self):
+        executor = BoundedExecutor(max_workers=2, max_queue=2)
+
+        future = executor.submit(lambda a, b: a + b, 1, b=2)
+
+        self.assertEqual(3, future.result())
+        executor.shutdown()
+
+    def test_bounded_queue(self):
+        executor = BoundedExecutor(max_workers=1, max_queue=1)
+        event = threading.Event()
+
+        future_1 = executor.submit(event.wait)
+        future_2 = executor.submit(event.wait)
+
+        with self.assertRaises(ServerBusy):
+            executor.submit(event.wait)
+
+        event.set()
+        future_1.result()
+        future_2.result()
+
+        executor.submit(event.wait).result()
+        executor.shutdown()
@@ -1,22 +1,27 @@
 # encoding=utf-8
 
+import array
 import collections
-import gzip
 import logging
 import lzma
+import multiprocessing
 import os
-import pickle
 import shutil
+import time
 import zipfile
 
-from sqlalchemy.sql.expression import bindparam, delete
+from sqlalchemy.sql.expression import and_, or_
+from sqlalchemy.sql.functions import func
 
 from terroroftinytown.format import registry
 from terroroftinytown.format.projectsettings import ProjectSettingsWriter
 from terroroftinytown.format.urlformat import quote
+from terroroftinytown.format.workingset import WorkingSetReader, \
+    WorkingSetWriter
 from terroroftinytown.tracker.bootstrap import Bootstrap
+from terroroftinytown.tracker.database import has_byte_order_collation
 from terroroftinytown.tracker.model import Project, Result, new_session
-from terroroftinytown.util.externalsort import GNUExternalSort
+from terroroftinytown.util.externalsort import ExternalSort, SortMemory
 
 logger = logging.getLogger(__name__)
 
@@ -62,9 +67,13 @@ class Exporter:
         self.fp = None
         self.writer = None
         self.project_result_sorters = {}
+        self.projects = collections.OrderedDict()
+        self.jobs = self.settings.get('jobs') or 1
+        self.sort_memory = \
+            (self.settings.get('sort_memory') or 64) * 1024 * 1024
 
         self.working_set_filename = os.path.join(output_dir,
-                                                 'current_working_set.pickle.gz')
+                                                 'current_working_set.tottws')
 
     def setup_format(self, format):
         self.format = registry[format]
@@ -74,6 +83,9 @@ class Exporter:
             os.makedirs(self.output_dir)
 
     def dump(self):
+        if self.settings.get('stream'):
+            self.check_stream_order()
+
         self.make_output_dir()
 
         database_busy_file = self.settings.get('database_busy_file')
@@ -82,28 +94,229 @@ class Exporter:
             with open(database_busy_file, 'w'):
                 pass
 
-        self._drain_to_working_set()
+        if self.settings.get('stream'):
+            self._stream_projects()
+        else:
+            self._drain_to_working_set()
 
         if database_busy_file:
             os.remove(database_busy_file)
 
+        if self.settings.get('stream'):
+            return
+
         self._feed_input_sorters()
 
+        for project_id in self.project_result_sorters:
+            self.projects[project_id] = Project.get_plain(project_id)
+
+        if self.jobs > 1 and len(self.projects) > 1:
+            self._export_projects_in_pool()
+        else:
+            for project_id in self.projects:
+                self.export_project(project_id)
+
+        os.remove(self.working_set_filename)
+
+    def export_project(self, project_id):
+        '''Write, and zip if enabled, the files of a project.
+
+        Returns the timestamp of the last result written so far.
+        '''
+        project = self.projects[project_id]
+
+        if self.settings['include_settings']:
+            self.dump_project_settings(project)
+
+        self.dump_project(project, self.project_result_sorters[project_id])
+
+        if self.settings['zip']:
+            self.zip_project(project)
+
+        return self.last_date
+
+    def _export_projects_in_pool(self):
+        '''Export the projects in forked worker processes.
+
+        The workers inherit the sorters. Projects are handed out and
+        logged as done in the same order as a serial export. The pool is
+        terminated on the first failure.
+        '''
+        global _pool_exporter
+        _pool_exporter = self
+        num_workers = min(self.jobs, len(self.projects))
+
+        logger.info('Exporting %d projects with %d workers.',
+                    len(self.projects), num_workers)
+
+        try:
+            with multiprocessing.get_context('fork').Pool(num_workers) \
+                    as pool:
+                results = pool.imap(_export_project, self.projects)
+
+                for index, (project_id, last_date) in enumerate(
+                        zip(self.projects, results), 1):
+                    logger.info('Exported project %s (%d/%d).', project_id,
+                                index, len(self.projects))
+
+                    if last_date and \
+                            (not self.last_date or last_date > self.last_date):
+                        self.last_date = last_date
+        except Exception:
+            logger.exception('Export worker failed. Stopping the export.')
+            raise
+        finally:
+            _pool_exporter = None
+
+    @classmethod
+    def check_stream_order(cls):
+        '''Check the database orders shortcodes like the sorted export.
+
+        Otherwise shortcodes of the same file could be read apart and
+        the file would be written twice.
+        '''
         with new_session() as session:
-            for project_id, sorter in self.project_result_sorters.items():
-                project = session.query(Project).filter_by(name=project_id).first()
+            if not has_byte_order_collation(session.connection()):
+                raise ValueError(
+                    'Streaming needs a database that compares strings by '
+                    'their bytes, such as SQLite or PostgreSQL with the C '
+                    'collation.')
+
+    def _stream_projects(self, size=1000):
+        '''Export each project as it is read from the database.
+
+        The rows are read in export order from ix_results_export_order
+        so there is no working set to sort. With --delete, the rows are
+        also written to the working set as a journal for
+        undrain_recovery, and the rows of each project are deleted as
+        soon as its files are written.
+        '''
+        logger.info('Streaming projects from the database.')
 
-                if self.settings['include_settings']:
-                    self.dump_project_settings(project)
+        assert not os.path.exists(self.working_set_filename)
 
-                self.dump_project(project, sorter)
+        with new_session() as session:
+            query = session.query(Result)
 
-                if self.settings['zip']:
-                    self.zip_project(project)
+            if self.after:
+                query = query.filter(Result.datetime > self.after)
 
-        os.remove(self.working_set_filename)
+            upper_id = self._get_upper_id(query)
+
+            if upper_id is None:
+                logger.info('No results to export.')
+                return
+
+            query = query.filter(Result.id <= upper_id)
+            project_ids = [
+                row[0] for row in
+                query.with_entities(Result.project_id).distinct()
+                .order_by(Result.project_id)
+            ]
 
-    def _drain_to_working_set(self, size=1000):
+            if self.settings['delete']:
+                journal_file = open(self.working_set_filename, 'wb')
+                journal = WorkingSetWriter(journal_file)
+                delete_ranges = self._can_delete_ranges(session)
+            else:
+                journal = None
+
+            for project_id in project_ids:
+                project_query = query.filter(Result.project_id == project_id)
+                stream = ResultStream(
+                    project_query, page_size=size, journal=journal,
+                    keep_ids=journal is not None and not delete_ranges)
+                self.projects[project_id] = Project.get_plain(project_id)
+                self.project_result_sorters[project_id] = stream
+                self.projects_count += 1
+
+                self.export_project(project_id)
+
+                self.items_count += stream.rows
+
+                if journal:
+                    # The journal has to be written before the rows are
+                    # deleted
+                    journal.flush()
+
+                    if delete_ranges:
+                        self._delete_results(session, project_query)
+                    else:
+                        num_deleted = self._delete_ids(
+                            session, project_query, stream.ids)
+                        session.commit()
+                        logger.info('Deleted %d results of %s.',
+                                    num_deleted, project_id)
+
+            if journal:
+                journal.close()
+                journal_file.close()
+                os.remove(self.working_set_filename)
+
+    def _get_upper_id(self, query):
+        '''Return the ID of the last result to export.'''
+        if self.max_items:
+            upper_id = query.with_entities(Result.id).order_by(Result.id) \
+                .offset(self.max_items - 1).limit(1).scalar()
+
+            if upper_id is not None:
+                logger.info('Limited to %d items.', self.max_items)
+                return upper_id
+
+        return query.with_entities(func.max(Result.id)).scalar()
+
+    @classmethod
+    def _can_delete_ranges(cls, session):
+        '''Return whether a range of exported IDs holds only exported rows.
+
+        SQLite has one writer at a time and gives a new result a higher ID
+        than any existing one, so results committed while exporting fall
+        outside the exported ranges. Other databases may commit a result
+        with a lower ID after a higher one was read, so only the exported
+        IDs may be deleted.
+        '''
+        return session.bind.dialect.name == 'sqlite'
+
+    def _delete_ids(self, session, query, ids, size=1000):
+        '''Delete the results matched by the query with the given IDs.'''
+        num_deleted = 0
+
+        for index in range(0, len(ids), size):
+            num_deleted += query \
+                .filter(Result.id.in_(list(ids[index:index + size]))) \
+                .delete(synchronize_session=False)
+
+        return num_deleted
+
+    def _delete_results(self, session, query, size=100000):
+        '''Delete the results matched by the query in ranges of IDs.'''
+        lower_id, upper_id = query.with_entities(
+            func.min(Result.id), func.max(Result.id)).one()
+
+        if lower_id is None:
+            return
+
+        for start_id in range(lower_id, upper_id + 1, size):
+            num_deleted = query \
+                .filter(Result.id >= start_id) \
+                .filter(Result.id < start_id + size) \
+                .delete(synchronize_session=False)
+            session.commit()
+
+            logger.info('Deleted %d results before ID %d.', num_deleted,
+                        start_id + size)
+
+    def _drain_to_working_set(self, size=1000, checkpoint_rows=100000,
+                              checkpoint_interval=30):
+        '''Copy the results to the working set.
+
+        With --delete, the rows copied since the last checkpoint are
+        deleted at each checkpoint, as one range of IDs where
+        :meth:`_can_delete_ranges` allows and by their IDs otherwise. A
+        checkpoint happens every `checkpoint_rows` rows or
+        `checkpoint_interval` seconds, whichever is first, so the
+        database write lock is only held briefly.
+        '''
         logger.info('Draining to working set %s', self.working_set_filename)
 
         assert not os.path.exists(self.working_set_filename)
@@ -114,78 +327,102 @@ class Exporter:
             if self.after:
                 query = query.filter(Result.datetime > self.after)
 
-            with gzip.open(self.working_set_filename, 'wb', compresslevel=1) as work_file:
+            delete_ranges = self._can_delete_ranges(session)
+            # IDs copied since the last checkpoint when ranges can't be
+            # deleted
+            drained_ids = array.array('q')
+
+            with open(self.working_set_filename, 'wb') as file, \
+                    WorkingSetWriter(file) as work_file:
                 last_id = -1
+                checkpoint_id = last_id
+                checkpoint_num_results = 0
+                checkpoint_time = time.monotonic()
                 num_results = 0
                 running = True
 
+                def checkpoint():
+                    # The working set has to be written before the rows
+                    # are deleted
+                    work_file.flush()
+
+                    if self.settings['delete'] and last_id > checkpoint_id:
+                        if delete_ranges:
+                            num_deleted = query \
+                                .filter(Result.id > checkpoint_id) \
+                                .filter(Result.id <= last_id) \
+                                .delete(synchronize_session=False)
+                        else:
+                            num_deleted = self._delete_ids(
+                                session, query, drained_ids)
+                            del drained_ids[:]
+
+                        logger.info('Deleted %d results up to ID %d.',
+                                    num_deleted, last_id)
+
+                    session.commit()
+
                 while running:
                     # Optimized for SQLite scrolling window
-                    rows = query.filter(Result.id > last_id).limit(size).all()
+                    rows = query.filter(Result.id > last_id) \
+                        .order_by(Result.id).limit(size).all()
 
                     if not rows:
                         break
 
-                    delete_ids = []
-
                     for result in rows:
-                        pickle.dump({
+                        work_file.write({
                             'id': result.id,
                             'project_id': result.project_id,
                             'shortcode': result.shortcode,
                             'url': result.url,
                             'encoding': result.encoding,
                             'datetime': result.datetime,
-                        }, work_file)
+                        })
 
                         num_results += 1
                         self.items_count += 1
+                        last_id = result.id
 
-                        delete_ids.append(result.id)
+                        if self.settings['delete'] and not delete_ranges:
+                            drained_ids.append(result.id)
 
                         if num_results % 10000 == 0:
                             logger.info('Drain progress: %d', num_results)
 
-                        if num_results % 100000 == 0:
-                            # Risky, but need to do this since WAL
-                            # performance is low on large transactions
-                            logger.info("Checkpoint. (Don't delete stray files if program crashes!)")
-                            work_file.flush()
-                            session.commit()
-
                         if self.max_items and num_results >= self.max_items:
                             logger.info('Reached max items %d.', self.max_items)
                             running = False
                             break
 
-                    if self.settings['delete']:
-                        delete_query = delete(Result).where(
-                            Result.id == bindparam('id')
-                        )
-                        session.execute(
-                            delete_query,
-                            [{'id': result_id} for result_id in delete_ids]
-                        )
+                    if num_results - checkpoint_num_results >= \
+                            checkpoint_rows or \
+                            time.monotonic() - checkpoint_time >= \
+                            checkpoint_interval:
+                        logger.info("Checkpoint. (Don't delete stray files if program crashes!)")
+                        checkpoint()
+                        checkpoint_id = last_id
+                        checkpoint_num_results = num_results
+                        checkpoint_time = time.monotonic()
 
-                pickle.dump('eof', work_file)
+                checkpoint()
 
     def _feed_input_sorters(self):
         num_results = 0
+        # One budget for all the projects so memory does not grow with
+        # the number of projects
+        memory = SortMemory(self.sort_memory)
 
-        with gzip.open(self.working_set_filename, 'rb') as work_file:
-            while True:
-                result = pickle.load(work_file)
-
-                if result == 'eof':
-                    break
-
+        with open(self.working_set_filename, 'rb') as work_file:
+            for result in WorkingSetReader(work_file):
                 if result['project_id'] not in self.project_result_sorters:
                     self.project_result_sorters[result['project_id']] = \
-                        GNUExternalSort(temp_dir=self.output_dir,
-                                        temp_prefix='tott-{0}-'.format(
-                                            result['project_id']
-                                            )
-                                        )
+                        ExternalSort(temp_dir=self.output_dir,
+                                     temp_prefix='tott-{0}-'.format(
+                                         result['project_id']
+                                         ),
+                                     memory=memory
+                                     )
                     self.projects_count += 1
 
                 sorter = self.project_result_sorters[result['project_id']]
@@ -211,7 +448,8 @@ class Exporter:
 
         for i, (key, value) in enumerate(sorter.sort()):
             if i % 10000 == 0:
-                logger.info('Format progress: %d/%d', i, sorter.rows)
+                logger.info('Format progress %s: %d/%d', project.name, i,
+                            sorter.rows)
 
             id_, url, encoding, datetime_ = value
             result = ResultContainer(id_, key, url, encoding, datetime_)
@@ -349,6 +587,92 @@ class Exporter:
         return dirs, shortcode[:code_length - underscores], shortcode[code_length - underscores:]
 
 
+class ResultStream(object):
+    '''Read the results of a project in export order.
+
+    It stands in for a sorter in :meth:`Exporter.dump_project`. The rows
+    are ordered by the length of the shortcode, then the shortcode, and
+    are read in pages of `page_size` with a keyset. Each row is also
+    written to `journal` if given. With `keep_ids`, the IDs of the rows
+    read are kept in :attr:`ids`.
+    '''
+    def __init__(self, query, page_size=1000, journal=None, keep_ids=False):
+        self._query = query.with_entities(
+            Result.id, Result.project_id, Result.shortcode, Result.url,
+            Result.encoding, Result.datetime)
+        self._page_size = page_size
+        self._journal = journal
+        self.rows = query.count()
+        self.ids = array.array('q') if keep_ids else None
+
+    def sort(self):
+        for row in self._iter_rows():
+            if self.ids is not None:
+                self.ids.append(row.id)
+
+            if self._journal:
+                self._journal.write({
+                    'id': row.id,
+                    'project_id': row.project_id,
+                    'shortcode': row.shortcode,
+                    'url': row.url,
+                    'encoding': row.encoding,
+                    'datetime': row.datetime,
+                })
+
+            yield row.shortcode, (row.id, row.url, row.encoding,
+                                  row.datetime)
+
+    def _iter_rows(self):
+        shortcode_length = func.length(Result.shortcode)
+        last_row = None
+        # Whether the last page may have ended within a shortcode length.
+        # Paging within one length lets the index seek to the last
+        # shortcode instead of scanning the length from its start.
+        within_length = False
+
+        while True:
+            if last_row is None:
+                page = self._query.order_by(
+                    shortcode_length, Result.shortcode, Result.id)
+            elif within_length:
+                page = self._query \
+                    .filter(shortcode_length == len(last_row.shortcode)) \
+                    .filter(or_(
+                        Result.shortcode > last_row.shortcode,
+                        and_(Result.shortcode == last_row.shortcode,
+                             Result.id > last_row.id)
+                    )) \
+                    .order_by(Result.shortcode, Result.id)
+            else:
+                page = self._query \
+                    .filter(shortcode_length > len(last_row.shortcode)) \
+                    .order_by(shortcode_length, Result.shortcode, Result.id)
+
+            rows = page.limit(self._page_size).all()
+
+            for row in rows:
+                yield row
+
+            if rows:
+                last_row = rows[-1]
+
+            if len(rows) == self._page_size:
+                within_length = True
+            elif within_length:
+                within_length = False
+            else:
+                break
+
+
+# Exporter inherited by the forked workers of Exporter._export_projects_in_pool
+_pool_exporter = None
+
+
+def _export_project(project_id):
+    return _pool_exporter.export_project(project_id)
+
+
 class ExporterBootstrap(Bootstrap):
     def start(self, args=None):
         super().start(args=args)
@@ -401,6 +725,17 @@ class ExporterBootstrap(Bootstrap):
             '--database-busy-file',
             help='A sentinel file to indicate the database is likely busy and locked'
         )
+        self.arg_parser.add_argument(
+            '--stream', action='store_true',
+            help='Write each project straight from the database instead '
+                 'of sorting a working set. Projects are written one at a '
+                 'time. Needs SQLite or PostgreSQL with the C collation.')
+        self.arg_parser.add_argument(
+            '--jobs', type=int, default=1, metavar='N',
+            help='Format and compress N projects at a time.')
+        self.arg_parser.add_argument(
+            '--sort-memory', type=int, default=64, metavar='MIB',
+            help='Memory for sorting results, shared by all projects.')
         self.arg_parser.add_argument(
             'output_dir', help='Output directory (will be created)')
 
@@ -2,12 +2,16 @@
 import functools
 import lzma
 import os.path
+import tempfile
 import time
 import unittest
 import zipfile
 
+from terroroftinytown.format.workingset import WorkingSetReader
+from terroroftinytown.release.undrain_recovery import UndrainBootstrap
 from terroroftinytown.test.random_result import MockResult, MockProject
 from terroroftinytown.tracker.export import ExporterBootstrap, Exporter
+from terroroftinytown.tracker.model import Result, new_session
 
 
 class TestExport(unittest.TestCase):
@@ -75,6 +79,157 @@ class TestExport(unittest.TestCase):
 
         self.assertEqual(100000, count)
 
+    def setup_results(self, num_projects, num_results):
+        config_path = os.path.join(os.path.dirname(__file__), 'tracker_unittest.conf')
+
+        project_boot = MockProject(delete_everything='yes-really!')
+        project_boot.start(
+            args=[config_path, '--count', str(num_projects)],
+            )
+
+        shortcode_boot = MockResult()
+        shortcode_boot.start(
+            args=[config_path, '--count', str(num_results),
+                  '--projects', str(num_projects)],
+            )
+
+        return config_path
+
+    def export_files(self, config_path, export_dir, *args):
+        '''Export and return the decompressed files and the last date.'''
+        boot = ExporterBootstrap()
+        boot.start(args=[config_path, '--include-settings'] + list(args) +
+                   [export_dir])
+
+        files = {}
+
+        for root, dirs, filenames in os.walk(export_dir):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+
+                with lzma.open(path) as file:
+                    files[os.path.relpath(path, export_dir)] = [
+                        line for line in file
+                        if not line.startswith(b'#TIMESTAMP')
+                    ]
+
+        return files, boot.exporter.last_date
+
+    def test_jobs(self):
+        config_path = self.setup_results(5, 5000)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            files, last_date = self.export_files(
+                config_path, os.path.join(temp_dir, '1'))
+            parallel_files, parallel_last_date = self.export_files(
+                config_path, os.path.join(temp_dir, '3'), '--jobs', '3')
+
+        self.assertEqual(5, len([
+            name for name in files if name.endswith('.meta.json.xz')
+        ]))
+        self.assertEqual(files, parallel_files)
+        self.assertEqual(last_date, parallel_last_date)
+
+    def test_stream(self):
+        config_path = self.setup_results(3, 5000)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            files, last_date = self.export_files(
+                config_path, os.path.join(temp_dir, 'sorted'))
+            stream_dir = os.path.join(temp_dir, 'stream')
+            stream_files, stream_last_date = self.export_files(
+                config_path, stream_dir, '--stream', '--delete')
+
+            exporter = Exporter(stream_dir, settings={
+                'after': None, 'max_items': None, 'delete': True,
+                'dir_length': 2, 'max_right': 4, 'file_length': 2,
+            })
+
+            self.assertNotIn(
+                os.path.basename(exporter.working_set_filename),
+                os.listdir(stream_dir))
+
+        # Duplicate shortcodes are ordered by ID instead of by the
+        # pickled value so only compare the shortcode order
+        self.assertEqual(
+            dict((name, sorted(lines)) for name, lines in files.items()),
+            dict((name, sorted(lines)) for name, lines in stream_files.items())
+        )
+        self.assertEqual(
+            dict((name, [line.split(b'|')[0] for line in lines])
+                 for name, lines in files.items()),
+            dict((name, [line.split(b'|')[0] for line in lines])
+                 for name, lines in stream_files.items())
+        )
+        self.assertEqual(last_date, stream_last_date)
+        self.assertFalse(Result.has_results())
+
+    def test_drain_checkpoints(self):
+        for exporter_class in (Exporter, IDDeleteExporter):
+            with self.subTest(exporter_class=exporter_class):
+                self.setup_results(2, 3000)
+                result_ids = set(
+                    result['id'] for result in Result.get_results(limit=3000))
+
+                with tempfile.TemporaryDirectory() as temp_dir:
+                    exporter = exporter_class(temp_dir, settings={
+                        'after': None, 'max_items': 2500, 'delete': True,
+                        'dir_length': 2, 'max_right': 4, 'file_length': 2,
+                    })
+                    exporter._drain_to_working_set(
+                        size=100, checkpoint_rows=1000)
+
+                    with open(exporter.working_set_filename, 'rb') as file:
+                        results = list(WorkingSetReader(file))
+
+                drained_ids = set(result['id'] for result in results)
+
+                self.assertEqual(2500, len(drained_ids))
+                self.assertEqual(
+                    result_ids - drained_ids,
+                    set(result['id'] for result
+                        in Result.get_results(limit=3000))
+                )
+
+    def test_stream_delete_ids(self):
+        self.setup_results(2, 2000)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            exporter = IDDeleteExporter(temp_dir, settings={
+                'after': None, 'max_items': None, 'delete': True,
+                'stream': True, 'include_settings': False, 'zip': False,
+                'dir_length': 2, 'max_right': 4, 'file_length': 2,
+            })
+            exporter.dump()
+
+        self.assertEqual(2000, exporter.items_count)
+        self.assertFalse(Result.has_results())
+
+    def test_undrain_recovery(self):
+        config_path = self.setup_results(2, 3000)
+        results = list(Result.get_results(limit=3000))
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            exporter = Exporter(temp_dir, settings={
+                'after': None, 'max_items': None, 'delete': False,
+                'dir_length': 2, 'max_right': 4, 'file_length': 2,
+            })
+            exporter._drain_to_working_set()
+
+            # The export stopped after deleting only some of the results
+            with new_session() as session:
+                session.query(Result).filter(Result.id % 3 == 0) \
+                    .delete(synchronize_session=False)
+
+            UndrainBootstrap().start(
+                args=[config_path, exporter.working_set_filename])
+
+        self.assertEqual(
+            sorted(results, key=lambda result: result['id']),
+            sorted(Result.get_results(limit=4000),
+                   key=lambda result: result['id'])
+        )
+
     def test_split_shortcode(self):
         split = functools.partial(
             Exporter.split_shortcode,
@@ -216,3 +371,10 @@ class TestExport(unittest.TestCase):
             ([], 'abcdefghijk', ''),
             split('abcdefghijk')
         )
+
+
+class IDDeleteExporter(Exporter):
+    '''Exporter that deletes by IDs as on databases other than SQLite.'''
+    @classmethod
+    def _can_delete_ranges(cls, session):
+        return False
@@ -140,6 +140,23 @@ class DeleteOneErrorReportForm(Form):
     pass
 
 
+class ProfilerForm(Form):
+    mode = RadioField(
+        'Mode:',
+        [validators.InputRequired()],
+        choices=[
+            ('sample', 'Sample IOLoop stacks for seconds'),
+            ('requests', 'cProfile the next number of requests'),
+        ],
+        default='sample'
+    )
+    amount = IntegerField(
+        'Seconds or requests:',
+        [validators.InputRequired(), validators.NumberRange(min=1, max=600)],
+        default=10
+    )
+
+
 class DeleteAllErrorReportsForm(Form):
     pass
 
@@ -0,0 +1,204 @@
+# encoding=utf-8
+'''Group commit for item check ins.'''
+import collections
+import concurrent.futures
+import logging
+import queue
+import threading
+import time
+
+from terroroftinytown.tracker import metrics, model
+from terroroftinytown.tracker.errors import ServerBusy
+
+
+logger = logging.getLogger(__name__)
+
+PendingCheckin = collections.namedtuple(
+    'PendingCheckin', ['future', 'submit_time', 'checkins', 'many'])
+CommitRecord = collections.namedtuple(
+    'CommitRecord', ['timestamp', 'batch_size', 'total_wait', 'max_wait'])
+
+
+class GroupCommitter(object):
+    '''Gather check ins arriving close together into one transaction.
+
+    A batch is committed when `max_batch_size` check ins are waiting or
+    `max_delay` seconds have passed since the first one arrived. Every
+    caller receives its own Future resolving to the item stats or
+    raising :class:`InvalidClaim`. If the transaction of a batch fails,
+    each caller is retried in its own transaction. Failures to update
+    the counters afterwards are only logged.
+    '''
+    def __init__(self, max_batch_size=50, max_delay=0.005, max_queue=1000,
+                 metrics_window=60):
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.metrics_window = metrics_window
+
+        self._queue = queue.Queue(max_queue)
+        self._records = collections.deque()
+        self._records_lock = threading.Lock()
+        self._total_commits = 0
+        self._total_items = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, item_id, tamper_key, results):
+        '''Queue a check in. Returns a Future.'''
+        return self._put([(item_id, tamper_key, results)], many=False)
+
+    def submit_many(self, checkins):
+        '''Queue check ins that are committed in the same transaction.
+
+        Returns a Future resolving to a list of item stats or
+        :class:`InvalidClaim` instances.
+        '''
+        return self._put(list(checkins), many=True)
+
+    def _put(self, checkins, many):
+        future = concurrent.futures.Future()
+
+        try:
+            self._queue.put_nowait(PendingCheckin(
+                future, time.monotonic(), checkins, many
+            ))
+        except queue.Full:
+            raise ServerBusy()
+
+        return future
+
+    def stop(self):
+        '''Commit the remaining check ins and stop the thread.'''
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        running = True
+
+        while running:
+            request = self._queue.get()
+
+            if request is None:
+                break
+
+            batch = [request]
+            batch_size = len(request.checkins)
+            deadline = time.monotonic() + self.max_delay
+
+            while batch_size < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+
+                try:
+                    if timeout > 0:
+                        request = self._queue.get(timeout=timeout)
+                    else:
+                        request = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+                if request is None:
+                    running = False
+                    break
+
+                batch.append(request)
+                batch_size += len(request.checkins)
+
+            self._commit(batch)
+
+    def _commit(self, batch):
+        start_time = time.monotonic()
+        checkins = []
+        waits = []
+
+        for pending in batch:
+            checkins.extend(pending.checkins)
+            waits.extend(
+                [start_time - pending.submit_time] * len(pending.checkins))
+
+        try:
+            with metrics.database_duration.time('checkin'):
+                saved_checkins = model.save_checkins(checkins)
+        except Exception as error:
+            if len(batch) == 1:
+                logger.exception('Check in of %d items failed.',
+                                 len(checkins))
+                batch[0].future.set_exception(error)
+                return
+
+            # The transaction was rolled back. Retry each caller in its
+            # own transaction so only the bad check in fails.
+            logger.exception('Group commit of %d items failed. Retrying '
+                             'each caller separately.', len(checkins))
+
+            for pending in batch:
+                self._commit([pending])
+
+            return
+
+        self._record(start_time, len(checkins), waits)
+
+        # The check ins are saved whatever happens to the counters
+        try:
+            model.record_checkins(saved_checkins)
+        except Exception:
+            logger.exception('Updating the counters of %d checked in items '
+                             'failed.', len(checkins))
+
+        outcomes = saved_checkins.outcomes
+
+        for pending in batch:
+            pending_outcomes = outcomes[:len(pending.checkins)]
+            outcomes = outcomes[len(pending.checkins):]
+
+            if pending.many:
+                pending.future.set_result(pending_outcomes)
+            elif isinstance(pending_outcomes[0], Exception):
+                pending.future.set_exception(pending_outcomes[0])
+            else:
+                pending.future.set_result(pending_outcomes[0])
+
+    def _record(self, timestamp, batch_size, waits):
+        with self._records_lock:
+            self._total_commits += 1
+            self._total_items += batch_size
+            self._records.append(
+                CommitRecord(timestamp, batch_size, sum(waits),
+                             max(waits, default=0))
+            )
+            self._expire_records()
+
+    def _expire_records(self):
+        min_time = time.monotonic() - self.metrics_window
+
+        while self._records and self._records[0].timestamp < min_time:
+            self._records.popleft()
+
+    def get_metrics(self):
+        '''Return commit rate, batch size and added latency.
+
+        Rates and averages cover the last `metrics_window` seconds.
+        Latency is the time a check in waited before its batch started.
+        '''
+        with self._records_lock:
+            self._expire_records()
+            records = list(self._records)
+            total_commits = self._total_commits
+            total_items = self._total_items
+
+        num_items = sum(record.batch_size for record in records)
+
+        return {
+            'total_commits': total_commits,
+            'total_items': total_items,
+            'queue_size': self._queue.qsize(),
+            'commits_per_second': len(records) / self.metrics_window,
+            'mean_batch_size':
+                num_items / len(records) if records else 0,
+            'max_batch_size':
+                max((record.batch_size for record in records), default=0),
+            'mean_added_latency':
+                sum(record.total_wait for record in records) / num_items
+                if num_items else 0,
+            'max_added_latency':
+                max((record.max_wait for record in records), default=0),
+        }
@@ -0,0 +1,140 @@
+import os.path
+import tempfile
+import unittest
+
+from terroroftinytown.client import VERSION
+from terroroftinytown.tracker.database import Database
+from terroroftinytown.tracker.errors import InvalidClaim
+from terroroftinytown.tracker.groupcommit import GroupCommitter
+from terroroftinytown.tracker.model import Budget, Item, Project, Result, \
+    checkout_item, new_session, MIN_CLIENT_VERSION_OVERRIDE
+from terroroftinytown.tracker.stats import Stats
+
+
+class TestGroupCommitter(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        Database('sqlite:///' + os.path.join(self.temp_dir.name, 'test.db'))
+
+        with new_session() as session:
+            session.add(Project(name='test', enabled=True))
+
+        Item.add_items('test', [(0, 9), (10, 19), (20, 29)])
+        Budget.calculate_budgets()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_group_commit(self):
+        committer = GroupCommitter(max_batch_size=10, max_delay=0.5)
+        claims = [
+            checkout_item('user', ip_address, VERSION,
+                          MIN_CLIENT_VERSION_OVERRIDE)
+            for ip_address in ('1.1.1.1', '2.2.2.2')
+        ]
+        results = {'a': {'url': 'http://example.com', 'encoding': 'ascii'}}
+
+        futures = [
+            committer.submit(claim['id'], claim['tamper_key'], results)
+            for claim in claims
+        ]
+        futures.append(committer.submit(claims[0]['id'], 'bad', results))
+
+        self.assertEqual(10, futures[0].result()['scanned'])
+        self.assertEqual(1, futures[1].result()['found'])
+
+        with self.assertRaises(InvalidClaim):
+            futures[2].result()
+
+        committer.stop()
+
+        metrics = committer.get_metrics()
+
+        self.assertEqual(1, metrics['total_commits'])
+        self.assertEqual(3, metrics['total_items'])
+        self.assertEqual(3, metrics['max_batch_size'])
+        self.assertEqual(0, Budget.projects['test']['claims'])
+        self.assertEqual(1, Budget.projects['test']['items'])
+
+        with new_session() as session:
+            self.assertEqual(2, session.query(Result).count())
+
+    def test_submit_many(self):
+        committer = GroupCommitter(max_batch_size=10, max_delay=0.5)
+        claim = checkout_item('user', '1.1.1.1', VERSION,
+                              MIN_CLIENT_VERSION_OVERRIDE)
+        results = {'a': {'url': 'http://example.com', 'encoding': 'ascii'}}
+
+        future = committer.submit_many([
+            (claim['id'], claim['tamper_key'], results),
+            (claim['id'], 'bad', results),
+        ])
+        outcomes = future.result()
+
+        self.assertEqual(10, outcomes[0]['scanned'])
+        self.assertIsInstance(outcomes[1], InvalidClaim)
+
+        committer.stop()
+
+        self.assertEqual(2, committer.get_metrics()['max_batch_size'])
+
+    def test_malformed_checkin(self):
+        committer = GroupCommitter(max_batch_size=10, max_delay=0.5)
+        claims = [
+            checkout_item('user', ip_address, VERSION,
+                          MIN_CLIENT_VERSION_OVERRIDE)
+            for ip_address in ('1.1.1.1', '2.2.2.2')
+        ]
+        results = {'a': {'url': 'http://example.com', 'encoding': 'ascii'}}
+
+        bad_future = committer.submit(
+            claims[0]['id'], claims[0]['tamper_key'], {'a': {}})
+        future = committer.submit(
+            claims[1]['id'], claims[1]['tamper_key'], results)
+
+        with self.assertRaises(KeyError):
+            bad_future.result()
+
+        self.assertEqual(1, future.result()['found'])
+
+        committer.stop()
+
+        self.assertEqual(1, committer.get_metrics()['total_commits'])
+
+        with new_session() as session:
+            self.assertEqual(1, session.query(Result).count())
+            self.assertEqual(2, session.query(Item).count())
+
+    def test_counters_failure(self):
+        committer = GroupCommitter(max_batch_size=10, max_delay=0.5)
+        claims = [
+            checkout_item('user', ip_address, VERSION,
+                          MIN_CLIENT_VERSION_OVERRIDE)
+            for ip_address in ('1.1.1.1', '2.2.2.2')
+        ]
+        results = {'a': {'url': 'http://example.com', 'encoding': 'ascii'}}
+
+        # Live stats fail after the check ins are committed
+        Stats.instance = BrokenStats()
+
+        try:
+            futures = [
+                committer.submit(claim['id'], claim['tamper_key'], results)
+                for claim in claims
+            ]
+
+            self.assertEqual(
+                [1, 1], [future.result()['found'] for future in futures])
+        finally:
+            Stats.instance = None
+            committer.stop()
+
+        self.assertEqual(1, committer.get_metrics()['total_commits'])
+
+        with new_session() as session:
+            self.assertEqual(2, session.query(Result).count())
+
+
+class BrokenStats(object):
+    def update(self, stats):
+        raise ConnectionError('Redis is down')
@@ -0,0 +1,210 @@
+# encoding=utf-8
+'''Metrics in the Prometheus text exposition format.'''
+import bisect
+import contextlib
+import functools
+import threading
+import time
+
+
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+
+    if not pairs:
+        return ''
+
+    return '{' + ','.join(
+        '{0}="{1}"'.format(name, _escape(value)) for name, value in pairs
+    ) + '}'
+
+
+class Metric(object):
+    metric_type = None
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def clear(self):
+        with self._lock:
+            self._values = {}
+
+    def render(self):
+        lines = [
+            '# HELP {0} {1}'.format(self.name, self.help_text),
+            '# TYPE {0} {1}'.format(self.name, self.metric_type),
+        ]
+
+        with self._lock:
+            values = sorted(self._values.items())
+
+        for label_values, value in values:
+            lines.extend(self._render_value(label_values, value))
+
+        return lines
+
+    def _render_value(self, label_values, value):
+        yield '{0}{1} {2}'.format(
+            self.name, _format_labels(self.label_names, label_values), value)
+
+
+class Counter(Metric):
+    metric_type = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = \
+                self._values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    metric_type = 'gauge'
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Histogram(Metric):
+    '''Histogram with fixed buckets.
+
+    Observing a value costs a binary search and a few additions.
+    '''
+    metric_type = 'histogram'
+
+    def __init__(self, name, help_text, label_names=(),
+                 buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            counts = self._values.get(label_values)
+
+            if counts is None:
+                # Bucket counts, then sum and count
+                counts = self._values[label_values] = \
+                    [0] * (len(self.buckets) + 1) + [0]
+
+            if index < len(self.buckets):
+                counts[index] += 1
+
+            counts[-2] += value
+            counts[-1] += 1
+
+    @contextlib.contextmanager
+    def time(self, *label_values):
+        start_time = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, *label_values)
+
+    def _render_value(self, label_values, counts):
+        cumulative = 0
+
+        for bucket, count in zip(self.buckets, counts):
+            cumulative += count
+            yield '{0}_bucket{1} {2}'.format(
+                self.name,
+                _format_labels(self.label_names, label_values,
+                               [('le', bucket)]),
+                cumulative
+            )
+
+        labels = _format_labels(self.label_names, label_values)
+
+        yield '{0}_bucket{1} {2}'.format(
+            self.name,
+            _format_labels(self.label_names, label_values, [('le', '+Inf')]),
+            counts[-1]
+        )
+        yield '{0}_sum{1} {2}'.format(self.name, labels, counts[-2])
+        yield '{0}_count{1} {2}'.format(self.name, labels, counts[-1])
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self):
+        lines = []
+
+        for metric in self._metrics:
+            lines.extend(metric.render())
+
+        return '\n'.join(lines) + '\n'
+
+
+def timed(histogram, *label_values):
+    '''Decorator that observes the duration of each call.'''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with histogram.time(*label_values):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+registry = Registry()
+
+request_duration = registry.histogram(
+    'tracker_request_duration_seconds', 'Time to handle a request.',
+    ['handler', 'method'])
+requests_total = registry.counter(
+    'tracker_requests_total', 'Requests handled.',
+    ['handler', 'method', 'code'])
+checkout_outcomes = registry.counter(
+    'tracker_checkout_outcomes_total', 'Outcomes of item checkouts.',
+    ['outcome'])
+database_duration = registry.histogram(
+    'tracker_database_duration_seconds',
+    'Time spent on database work for a request.', ['operation'])
+redis_duration = registry.histogram(
+    'tracker_redis_duration_seconds', 'Time spent in Redis by Stats calls.',
+    ['call'])
+autorelease_duration = registry.histogram(
+    'tracker_autorelease_duration_seconds',
+    'Time to release expired claims.')
+autoreleased_claims = registry.counter(
+    'tracker_autoreleased_claims_total', 'Expired claims released.',
+    ['project'])
+budget_items = registry.gauge(
+    'tracker_budget_items', 'Items counted by the budget.', ['project'])
+budget_claims = registry.gauge(
+    'tracker_budget_claims', 'Claims counted by the budget.', ['project'])
+group_commit = registry.gauge(
+    'tracker_group_commit', 'Group commit statistics.', ['statistic'])
+deadman_fill_level = registry.gauge(
+    'tracker_deadman_fill_level',
+    'Fraction of the deadman limit reached.', ['table'])
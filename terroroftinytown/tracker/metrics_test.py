@@ -0,0 +1,45 @@
+import unittest
+
+from terroroftinytown.tracker.metrics import Registry
+
+
+class TestMetrics(unittest.TestCase):
+    def test_render(self):
+        registry = Registry()
+        counter = registry.counter('test_total', 'Things.', ['kind'])
+        gauge = registry.gauge('test_level', 'Level.')
+        histogram = registry.histogram(
+            'test_seconds', 'Duration.', ['name'], buckets=(0.1, 1))
+
+        counter.inc('a"b')
+        counter.inc('a"b', amount=2)
+        gauge.set(5)
+        histogram.observe(0.05, 'x')
+        histogram.observe(0.5, 'x')
+        histogram.observe(5, 'x')
+
+        self.assertEqual(
+            '# HELP test_total Things.\n'
+            '# TYPE test_total counter\n'
+            'test_total{kind="a\\"b"} 3\n'
+            '# HELP test_level Level.\n'
+            '# TYPE test_level gauge\n'
+            'test_level 5\n'
+            '# HELP test_seconds Duration.\n'
+            '# TYPE test_seconds histogram\n'
+            'test_seconds_bucket{name="x",le="0.1"} 1\n'
+            'test_seconds_bucket{name="x",le="1"} 2\n'
+            'test_seconds_bucket{name="x",le="+Inf"} 3\n'
+            'test_seconds_sum{name="x"} 5.55\n'
+            'test_seconds_count{name="x"} 3\n',
+            registry.render()
+        )
+
+    def test_time(self):
+        registry = Registry()
+        histogram = registry.histogram('test_seconds', 'Duration.')
+
+        with histogram.time():
+            pass
+
+        self.assertIn('test_seconds_count 1', registry.render())
@@ -1,21 +1,24 @@
 # encoding=utf-8
 import base64
 import calendar
+import collections
 import contextlib
 import datetime
 import hmac
 import json
+import logging
 import os
 import random
 import subprocess
+import threading
 
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from sqlalchemy.orm.session import make_transient
 from sqlalchemy.orm.util import object_state
-from sqlalchemy.sql.expression import insert, select, delete, exists
+from sqlalchemy.sql.expression import insert, select, delete, exists, update
 from sqlalchemy.sql.functions import func
-from sqlalchemy.sql.schema import Column, ForeignKey
+from sqlalchemy.sql.schema import Column, ForeignKey, Index
 from sqlalchemy.sql.sqltypes import String, LargeBinary, Float, Boolean, Integer, \
     DateTime
 from sqlalchemy.sql.type_api import TypeDecorator
@@ -25,6 +28,7 @@ from terroroftinytown.client.alphabet import str_to_int, int_to_str
 from terroroftinytown.tracker.errors import NoItemAvailable, FullClaim, UpdateClient, \
     InvalidClaim, NoResourcesAvailable
 from terroroftinytown.tracker.stats import Stats
+from terroroftinytown.util.cache import TTLCache
 
 
 # These overrides for major api changes
@@ -33,9 +37,14 @@ MIN_CLIENT_VERSION_OVERRIDE = 7  # for terrofoftinytown-client-grab/pipeline.py
 DEADMAN_MAX_ERROR_REPORTS = 4000
 DEADMAN_MAX_RESULTS = 40000000
 
+logger = logging.getLogger(__name__)
+
 Base = declarative_base()
 Session = sessionmaker()
 
+SavedCheckins = collections.namedtuple(
+    'SavedCheckins', ['outcomes', 'claims', 'num_results'])
+
 
 @contextlib.contextmanager
 def new_session():
@@ -70,6 +79,7 @@ class GlobalSetting(Base):
     value = Column(JsonType)
 
     AUTO_DELETE_ERROR_REPORTS = 'auto_delete_error_reports'
+    SCHEMA_VERSION = 'schema_version'
 
     @classmethod
     def set_value(cls, key, value):
@@ -99,6 +109,12 @@ class User(Base):
     salt = Column(LargeBinary, nullable=False)
     hash = Column(LargeBinary, nullable=False)
 
+    # Validated session tokens by username. Only the process serving a
+    # password change or deletion clears its cache, so it is disabled
+    # when several processes share the database.
+    token_cache = TTLCache(max_size=100, ttl=300)
+    cache_tokens = True
+
     def set_password(self, password):
         self.salt = new_salt()
         self.hash = make_hash(password, self.salt)
@@ -157,11 +173,15 @@ class User(Base):
             user = session.query(User).filter_by(username=username).first()
             user.set_password(password)
 
+        cls.token_cache.pop(username)
+
     @classmethod
     def delete_user(cls, username):
         with new_session() as session:
             session.query(User).filter_by(username=username).delete()
 
+        cls.token_cache.pop(username)
+
     @classmethod
     def get_user_token(cls, username):
         with new_session() as session:
@@ -170,13 +190,25 @@ class User(Base):
 
     @classmethod
     def check_account_session(cls, username, token):
+        if cls.cache_tokens:
+            cached_token = cls.token_cache.get(username)
+
+            if cached_token and compare_digest(cached_token, token):
+                return True
+
         with new_session() as session:
             user = session.query(User).filter_by(username=username).first()
 
             if not user:
                 return
 
-            return user.check_token(token)
+            if user.check_token(token):
+                if cls.cache_tokens:
+                    cls.token_cache.set(username, token)
+
+                return True
+
+            return False
 
 
 class Project(Base):
@@ -261,6 +293,16 @@ class Project(Base):
 
 class Item(Base):
     __tablename__ = 'items'
+    __table_args__ = (
+        # Checkout of an unclaimed item
+        Index('ix_items_project_id_username', 'project_id', 'username'),
+        # Release of expired claims
+        Index('ix_items_project_id_datetime_claimed',
+              'project_id', 'datetime_claimed'),
+        # Claimed IP addresses for the budget
+        Index('ix_items_ip_address_project_id', 'ip_address', 'project_id'),
+    )
+
     id = Column(Integer, primary_key=True)
 
     project_id = Column(Integer, ForeignKey('projects.name'), nullable=False)
@@ -285,11 +327,65 @@ class Item(Base):
         return ans
 
     @classmethod
-    def get_items(cls, project_id):
+    def get_items(cls, project_id, offset_id=0, limit=100, claimed=None):
+        '''Return a page of the items of a project ordered by ID.
+
+        Only items with an ID greater than `offset_id` are returned. Set
+        `claimed` to True or False to return only claimed or unclaimed
+        items.
+        '''
+        with new_session() as session:
+            rows = session.query(
+                Item.id, Item.lower_sequence_num, Item.upper_sequence_num,
+                Item.datetime_claimed, Item.username, Item.ip_address,
+                Project.alphabet
+                ) \
+                .join(Project) \
+                .filter(Item.project_id == project_id) \
+                .filter(Item.id > offset_id)
+
+            if claimed is True:
+                rows = rows.filter(Item.datetime_claimed.isnot(None))
+            elif claimed is False:
+                rows = rows.filter(Item.datetime_claimed.is_(None))
+
+            rows = rows.order_by(Item.id).limit(limit)
+
+            return [{
+                'id': row.id,
+                'lower_sequence_num': row.lower_sequence_num,
+                'upper_sequence_num': row.upper_sequence_num,
+                'lower_shortcode': int_to_str(
+                    row.lower_sequence_num, row.alphabet),
+                'upper_shortcode': int_to_str(
+                    row.upper_sequence_num, row.alphabet),
+                'datetime_claimed': calendar.timegm(
+                    row.datetime_claimed.utctimetuple())
+                    if row.datetime_claimed else None,
+                'username': row.username,
+                'ip_address': row.ip_address,
+            } for row in rows]
+
+    @classmethod
+    def get_summary(cls, project_id):
+        '''Return the number of items and claims of a project.
+
+        The oldest claim time is included as ``oldest_claim``.
+        '''
         with new_session() as session:
-            rows = session.query(Item).filter_by(project_id=project_id).order_by(Item.datetime_claimed)
+            items, claims, oldest_claim = session.query(
+                func.count(Item.id), func.count(Item.datetime_claimed),
+                func.min(Item.datetime_claimed)
+                ) \
+                .filter(Item.project_id == project_id) \
+                .one()
 
-            return list([item.to_dict(with_shortcode=True) for item in rows])
+            return {
+                'items': items,
+                'claims': claims,
+                'queued': items - claims,
+                'oldest_claim': oldest_claim,
+            }
 
     @classmethod
     def add_items(cls, project_id, sequence_list):
@@ -308,19 +404,32 @@ class Item(Base):
 
     @classmethod
     def delete(cls, item_id):
+        '''Delete an item. Returns ``(project_id, ip_address)`` or None.'''
         with new_session() as session:
+            row = session.query(Item.project_id, Item.ip_address) \
+                .filter_by(id=item_id).first()
             session.query(Item).filter_by(id=item_id).delete()
 
+            if row:
+                return tuple(row)
+
     @classmethod
     def release(cls, item_id):
+        '''Release a claim. Returns ``(project_id, ip_address)`` or None.'''
         with new_session() as session:
             item = session.query(Item).filter_by(id=item_id).first()
+            claim = (item.project_id, item.ip_address)
+            was_claimed = item.ip_address is not None
             item.datetime_claimed = None
             item.ip_address = None
             item.username = None
 
+            if was_claimed:
+                return claim
+
     @classmethod
     def release_all(cls, project_id=None, old_date=None):
+        '''Release claims. Returns a list of ``(project_id, ip_address)``.'''
         with new_session() as session:
             query = session.query(Item)
 
@@ -330,19 +439,39 @@ class Item(Base):
             if old_date:
                 query = query.filter(Item.datetime_claimed <= old_date)
 
-            query.update({
-                'datetime_claimed': None,
-                'ip_address': None,
-                'username': None,
-            })
+            return cls._release_query(query)
+
+    @classmethod
+    def _release_query(cls, query):
+        claims = [
+            tuple(row) for row in
+            query.filter(Item.ip_address.isnot(None))
+            .with_entities(Item.project_id, Item.ip_address)
+        ]
+
+        query.update({
+            'datetime_claimed': None,
+            'ip_address': None,
+            'username': None,
+        }, synchronize_session=False)
+
+        return claims
 
     @classmethod
     def release_old(cls, project_id=None, autoqueue_only=False):
-        with new_session() as session:
-            # we could probably write this in one query
-            # but it would be non-portable across SQL dialects
+        '''Release expired claims.
+
+        Claims are released with one UPDATE for each distinct autorelease
+        time rather than one for each project.
+        Returns a list of ``(project_id, ip_address)``.
+        '''
+        claims = []
+        now = datetime.datetime.utcnow()
 
-            projects = session.query(Project) \
+        with new_session() as session:
+            # Datetime arithmetic is not portable across SQL dialects so
+            # the cutoff is computed here for each autorelease time
+            projects = session.query(Project.name) \
                 .filter(Project.autorelease_time > 0)
 
             if project_id:
@@ -351,20 +480,39 @@ class Item(Base):
             if autoqueue_only:
                 projects = projects.filter_by(autoqueue=True)
 
-            for project in projects:
-                min_time = datetime.datetime.utcnow() - datetime.timedelta(seconds=project.autorelease_time)
+            autorelease_times = [
+                row[0] for row in
+                projects.with_entities(Project.autorelease_time).distinct()
+            ]
+
+            for autorelease_time in autorelease_times:
+                min_time = now - datetime.timedelta(seconds=autorelease_time)
+                project_names = projects \
+                    .filter(Project.autorelease_time == autorelease_time)
                 query = session.query(Item) \
-                    .filter(Item.datetime_claimed <= min_time, Item.project == project)
-                query.update({
-                    'datetime_claimed': None,
-                    'ip_address': None,
-                    'username': None,
-                })
+                    .filter(Item.datetime_claimed <= min_time) \
+                    .filter(Item.project_id.in_(project_names.subquery()))
+                claims.extend(cls._release_query(query))
+
+        return claims
 
     @classmethod
     def delete_all(cls, project_id):
+        '''Delete the items of a project.
+
+        Returns the number of items deleted and the IP addresses of the
+        claimed ones.
+        '''
         with new_session() as session:
-            session.query(Item).filter_by(project_id=project_id).delete()
+            query = session.query(Item).filter_by(project_id=project_id)
+            ip_addresses = [
+                row[0] for row in
+                query.filter(Item.ip_address.isnot(None))
+                .with_entities(Item.ip_address)
+            ]
+            num_items = query.delete()
+
+            return num_items, ip_addresses
 
 
 class BlockedUser(Base):
@@ -415,7 +563,7 @@ class Result(Base):
     shortcode = Column(String, nullable=False)
     url = Column(String, nullable=False)
     encoding = Column(String, nullable=False)
-    datetime = Column(DateTime)
+    datetime = Column(DateTime, index=True)
 
     @classmethod
     def has_results(cls):
@@ -463,13 +611,19 @@ class Result(Base):
                 yield ans
 
 
+# Streaming export of a project in the order of the exported files
+Index('ix_results_export_order', Result.project_id,
+      func.length(Result.shortcode), Result.shortcode, Result.id)
+
+
 class ErrorReport(Base):
     '''Error report.'''
     __tablename__ = 'error_reports'
 
     id = Column(Integer, primary_key=True)
 
-    item_id = Column(Integer, ForeignKey('items.id'), nullable=False)
+    item_id = Column(Integer, ForeignKey('items.id'), nullable=False,
+                     index=True)
     item = relationship('Item')
 
     message = Column(String, nullable=False)
@@ -509,13 +663,17 @@ class ErrorReport(Base):
     @classmethod
     def delete_all(cls):
         with new_session() as session:
-            session.query(ErrorReport.id).delete()
+            num_deleted = session.query(ErrorReport.id).delete()
+
+        Deadman.add(error_reports=-num_deleted)
 
     @classmethod
     def delete_one(cls, report_id):
         with new_session() as session:
             query = delete(ErrorReport).where(ErrorReport.id == report_id)
-            session.execute(query)
+            num_deleted = session.execute(query).rowcount
+
+        Deadman.add(error_reports=-num_deleted)
 
     @classmethod
     def delete_orphaned(cls):
@@ -525,64 +683,252 @@ class ErrorReport(Base):
                 .limit(1)
 
             query = delete(ErrorReport).where(~exists(subquery))
-            session.execute(query)
+            num_deleted = session.execute(query).rowcount
+
+        Deadman.add(error_reports=-num_deleted)
 
 
 class Budget(object):
     '''Budget calculator to help manage available items.
 
-    Warning: This class assumes the application is single instance.
+    By default the counters are kept in :attr:`projects` which assumes
+    the application is single instance. The counters may be modified
+    from database worker threads so modifications must hold :attr:`lock`.
+
+    Once :attr:`shared` is set to a :class:`SharedBudget`, the counters
+    are kept in Redis instead so several tracker processes can share
+    them, and :attr:`projects` is unused.
     '''
 
     projects = {}
+    lock = threading.RLock()
+    shared = None
 
     @classmethod
     def calculate_budgets(cls):
-        cls.projects = {}
-
-        with new_session() as session:
-            query = session.query(
-                Project.name, Project.max_num_items,
-                Project.min_client_version, Project.min_version,
-                Project.max_num_items
-            ).filter_by(enabled=True)
-
-            for row in query:
-                (name, max_num_items, min_client_version, min_version,
-                 max_num_items) = row
-
-                cls.projects[name] = {
-                    'max_num_items': max_num_items,
-                    'min_client_version': min_client_version,
-                    'min_version': min_version,
-                    'items': 0,
-                    'claims': 0,
-                    'ip_addresses': set(),
-                }
+        # The aggregates scan the items table so checkouts and check ins
+        # are only held up while the counters are swapped
+        with new_session() as session:
+            projects = cls._load_budgets(session)
+
+        with cls.lock:
+            cls._set_projects(projects)
 
-            query = session.query(Item.project_id, Item.ip_address)
+    @classmethod
+    def get_projects(cls, with_ip_addresses=True):
+        '''Return a copy of the counters of each enabled project.
+
+        Without `with_ip_addresses`, the sets of IP addresses are empty.
+        '''
+        if cls.shared:
+            return cls.shared.get_projects(with_ip_addresses)
+
+        with cls.lock:
+            return dict(
+                (project_id, dict(
+                    project_info,
+                    ip_addresses=set(project_info['ip_addresses'])
+                    if with_ip_addresses else set()))
+                for project_id, project_info in cls.projects.items()
+            )
 
-            for row in query:
-                project_id, ip_address = row
+    @classmethod
+    def _set_projects(cls, projects):
+        if cls.shared:
+            cls.shared.set_projects(projects)
+        else:
+            cls.projects = projects
 
-                if project_id not in cls.projects:
+    @classmethod
+    def _load_budgets(cls, session, project_id=None):
+        projects = {}
+
+        query = session.query(
+            Project.name, Project.max_num_items,
+            Project.min_client_version, Project.min_version,
+        ).filter_by(enabled=True)
+
+        if project_id:
+            query = query.filter_by(name=project_id)
+
+        for row in query:
+            name, max_num_items, min_client_version, min_version = row
+
+            projects[name] = {
+                'max_num_items': max_num_items,
+                'min_client_version': min_client_version,
+                'min_version': min_version,
+                'items': 0,
+                'claims': 0,
+                'ip_addresses': set(),
+            }
+
+        query = session.query(
+            Item.project_id, func.count(Item.id), func.count(Item.ip_address)
+        ).group_by(Item.project_id)
+
+        if project_id:
+            query = query.filter_by(project_id=project_id)
+
+        for name, num_items, num_claims in query:
+            if name in projects:
+                projects[name]['items'] = num_items
+                projects[name]['claims'] = num_claims
+
+        query = session.query(Item.project_id, Item.ip_address) \
+            .filter(Item.ip_address.isnot(None)).distinct()
+
+        if project_id:
+            query = query.filter_by(project_id=project_id)
+
+        for name, ip_address in query:
+            if name in projects:
+                projects[name]['ip_addresses'].add(ip_address)
+
+        return projects
+
+    @classmethod
+    def reconcile(cls):
+        '''Compare the counters with the database and correct them.
+
+        Returns a dict of the projects that drifted, mapping to a dict of
+        ``(counter value, database value)`` tuples. The database is read
+        without holding :attr:`lock`, so requests in flight while this
+        runs may show up as small transient drift.
+        '''
+        drift = {}
+
+        with new_session() as session:
+            projects = cls._load_budgets(session)
+
+        with cls.lock:
+            old_projects = cls.get_projects()
+
+            for name in set(projects) | set(old_projects):
+                old_info = old_projects.get(name)
+                new_info = projects.get(name)
+
+                if not old_info or not new_info:
+                    drift[name] = {'enabled': (bool(old_info), bool(new_info))}
                     continue
 
+                project_drift = dict(
+                    (key, (old_info[key], new_info[key]))
+                    for key in ('items', 'claims', 'max_num_items',
+                                'min_version', 'min_client_version')
+                    if old_info[key] != new_info[key]
+                )
+
+                if old_info['ip_addresses'] != new_info['ip_addresses']:
+                    project_drift['ip_addresses'] = (
+                        len(old_info['ip_addresses']),
+                        len(new_info['ip_addresses'])
+                    )
+
+                if project_drift:
+                    drift[name] = project_drift
+
+            cls._set_projects(projects)
+
+        for name, project_drift in sorted(drift.items()):
+            logger.warning(
+                'Budget drift for project %s: %s', name,
+                ', '.join(
+                    '%s %s != %s' % (key, value[0], value[1])
+                    for key, value in sorted(project_drift.items())
+                )
+            )
+
+        return drift
+
+    @classmethod
+    def update_project(cls, project_id):
+        '''Reload the settings of a project that was changed or deleted.'''
+        with cls.lock, new_session() as session:
+            project = session.query(Project).get(project_id)
+
+            if cls.shared:
+                if not project or not project.enabled:
+                    cls.shared.remove_project(project_id)
+                elif not cls.shared.update_settings(
+                        project_id, project.max_num_items,
+                        project.min_version, project.min_client_version):
+                    cls.shared.set_projects(
+                        cls._load_budgets(session, project_id),
+                        replace=False)
+            elif not project or not project.enabled:
+                cls.projects.pop(project_id, None)
+            elif project_id not in cls.projects:
+                cls.projects.update(cls._load_budgets(session, project_id))
+            else:
                 project_info = cls.projects[project_id]
+                project_info['max_num_items'] = project.max_num_items
+                project_info['min_client_version'] = project.min_client_version
+                project_info['min_version'] = project.min_version
 
-                project_info['items'] += 1
+    @classmethod
+    def _adjust(cls, changes):
+        '''Apply changes to the counters of projects that are enabled.
+
+        `changes` is an iterable of ``(project_id, claims, items,
+        ip_action, ip_address)`` tuples. `claims` and `items` are added
+        to the counters and `ip_action` is ``add``, ``remove`` or None.
+        '''
+        if cls.shared:
+            cls.shared.adjust(list(changes))
+            return
 
-                if ip_address:
+        with cls.lock:
+            for project_id, claims, items, ip_action, ip_address in changes:
+                if project_id not in cls.projects:
+                    continue
+
+                project_info = cls.projects[project_id]
+                project_info['claims'] += claims
+                project_info['items'] += items
+
+                if ip_action == 'add':
                     project_info['ip_addresses'].add(ip_address)
-                    project_info['claims'] += 1
+                elif ip_action == 'remove':
+                    project_info['ip_addresses'].discard(ip_address)
+
+    @classmethod
+    def add_items(cls, project_id, num_items):
+        cls._adjust([(project_id, 0, num_items, None, None)])
 
     @classmethod
-    def get_available_project(cls, ip_address, version, client_version):
-        project_names = list(cls.projects.keys())
+    def remove_items(cls, project_id, num_items, ip_addresses=()):
+        '''Count deleted items. `ip_addresses` are of the claimed ones.'''
+        cls._adjust(
+            [(project_id, 0, -num_items, None, None)] +
+            [(project_id, -1, 0, 'remove', ip_address)
+             for ip_address in ip_addresses]
+        )
+
+    @classmethod
+    def release_claims(cls, claims):
+        '''Count released claims given as ``(project_id, ip_address)``.'''
+        cls._adjust(
+            (project_id, -1, 0, 'remove', ip_address)
+            for project_id, ip_address in claims
+        )
+
+    @classmethod
+    def get_available_project(cls, ip_address, version, client_version,
+                              exclude_projects=()):
+        if cls.shared:
+            projects = cls.shared.get_projects()
+        else:
+            projects = cls.projects
+
+        project_names = list(projects.keys())
         random.shuffle(project_names)
 
         for project_id in project_names:
-            project_info = cls.projects[project_id]
+            if project_id in exclude_projects:
+                continue
+
+            project_info = projects[project_id]
 
             if ip_address not in project_info['ip_addresses'] and \
                     version >= project_info['min_version'] and \
@@ -595,51 +941,311 @@ class Budget(object):
 
     @classmethod
     def is_client_outdated(cls, version, client_version):
-        if not cls.projects:
+        projects = cls.get_projects(with_ip_addresses=False)
+
+        if not projects:
             return
 
         max_version = max(project['min_version']
-                          for project in cls.projects.values())
+                          for project in projects.values())
         max_client_version = max(project['min_client_version']
-                                 for project in cls.projects.values())
+                                 for project in projects.values())
 
         if version < max_version or client_version < max_client_version:
             return max_version, max_client_version
 
     @classmethod
     def is_claims_full(cls, ip_address):
-        return cls.projects and all(ip_address in project['ip_addresses']
-                                    for project in cls.projects.values())
+        if cls.shared:
+            return cls.shared.is_claims_full(ip_address)
+
+        with cls.lock:
+            return cls.projects and all(
+                ip_address in project['ip_addresses']
+                for project in cls.projects.values())
+
+    @classmethod
+    def reserve(cls, ip_address, version, client_version,
+                exclude_projects=()):
+        '''Pick an available project and count the claim in one step.
+
+        Returns the same tuple as :meth:`get_available_project`. The claim
+        is counted with `new_item` as computed by :func:`is_new_item`.
+        If the claim cannot be made, call :meth:`cancel_check_out`.
+        '''
+        if cls.shared:
+            return cls.shared.reserve(
+                ip_address, version, client_version,
+                random.getrandbits(31), exclude_projects=exclude_projects)
+
+        with cls.lock:
+            available = cls.get_available_project(
+                ip_address, version, client_version,
+                exclude_projects=exclude_projects)
+
+            if available:
+                project_id, num_claims, num_items, max_num_items = available
+                cls.check_out(
+                    project_id, ip_address,
+                    new_item=is_new_item(num_claims, num_items, max_num_items)
+                )
+
+            return available
 
     @classmethod
     def check_out(cls, project_id, ip_address, new_item=False):
         assert project_id
         assert ip_address
 
-        project_info = cls.projects[project_id]
+        if cls.shared:
+            cls.shared.adjust(
+                [(project_id, 1, int(new_item), 'add', ip_address)])
+            return
+
+        with cls.lock:
+            project_info = cls.projects[project_id]
 
-        project_info['claims'] += 1
+            project_info['claims'] += 1
 
-        if new_item:
-            project_info['items'] += 1
+            if new_item:
+                project_info['items'] += 1
 
-        project_info['ip_addresses'].add(ip_address)
+            project_info['ip_addresses'].add(ip_address)
+
+    @classmethod
+    def cancel_check_out(cls, project_id, ip_address, new_item=False):
+        assert project_id
+        assert ip_address
+
+        cls._adjust(
+            [(project_id, -1, -int(new_item), 'remove', ip_address)])
 
     @classmethod
     def check_in(cls, project_id, ip_address):
         assert project_id
         assert ip_address
 
-        if project_id not in cls.projects:
-            # Project was recently disabled but the job hasn't come back
-            # yet. Should be safe to ignore.
+        cls.check_in_many([(project_id, ip_address)])
+
+    @classmethod
+    def check_in_many(cls, claims):
+        '''Count checked in claims given as ``(project_id, ip_address)``.'''
+        # A project that was recently disabled but the job hasn't come back
+        # yet is ignored. Should be safe.
+        cls._adjust(
+            (project_id, -1, -1, 'remove', ip_address)
+            for project_id, ip_address in claims
+        )
+
+
+class Deadman(object):
+    '''Row counters for the deadman checks.
+
+    The counters are adjusted as results and error reports are inserted
+    and deleted so a check does not need to query the database.
+    :meth:`reconcile` reloads them to pick up changes made by other
+    processes such as the exporter.
+
+    Warning: This class assumes the application is single instance.
+    '''
+
+    counts = None
+    lock = threading.Lock()
+
+    @classmethod
+    def reconcile(cls):
+        with new_session() as session:
+            num_error_reports = session.query(
+                func.count(ErrorReport.id)).scalar()
+
+        # The results table is too large to count so use the ID range
+        num_results = Result.get_count()
+
+        with cls.lock:
+            if cls.counts and (cls.counts['results'] != num_results or
+                    cls.counts['error_reports'] != num_error_reports):
+                logger.info(
+                    'Deadman counters changed from %s to results=%d '
+                    'error_reports=%d', cls.counts, num_results,
+                    num_error_reports
+                )
+
+            cls.counts = {
+                'results': num_results,
+                'error_reports': num_error_reports,
+            }
+
+    @classmethod
+    def get_counts(cls):
+        if cls.counts is None:
+            cls.reconcile()
+
+        return cls.counts
+
+    @classmethod
+    def add(cls, results=0, error_reports=0):
+        '''Adjust the counters. Use negative values for deleted rows.'''
+        if cls.counts is None:
             return
 
-        project_info = cls.projects[project_id]
+        with cls.lock:
+            cls.counts = {
+                'results': cls.counts['results'] + results,
+                'error_reports': cls.counts['error_reports'] + error_reports,
+            }
+
+    @classmethod
+    def get_fill_levels(cls):
+        '''Return the counters as a fraction of the deadman limits.'''
+        counts = cls.get_counts()
+
+        return {
+            'results': counts['results'] / DEADMAN_MAX_RESULTS,
+            'error_reports':
+                counts['error_reports'] / DEADMAN_MAX_ERROR_REPORTS,
+        }
+
+
+class ItemPool(object):
+    '''In-memory pool of unclaimed items for each project.
+
+    The pool is filled in bulk from the database so a checkout only needs
+    a conditional UPDATE on the primary key instead of scanning the items
+    table for an unclaimed row. An entry that was deleted or claimed
+    behind the pool's back simply fails the UPDATE and is skipped.
+
+    Each process has its own pool. When several processes share the
+    items table, :attr:`shuffle` makes them less likely to try the same
+    items.
+    '''
+
+    enabled = True
+    shuffle = False
+    refill_size = 1000
+    projects = {}
+    lock = threading.Lock()
+    # Projects being refilled. Checkouts of other projects do not wait
+    # for the refill query.
+    refilling = set()
+    refilled = threading.Condition(lock)
+
+    @classmethod
+    def claim(cls, session, project_id, username, ip_address):
+        '''Claim an unclaimed item of the project.
+
+        Returns the item as a dict (as :meth:`Item.to_dict`) or None.
+        The caller is responsible for committing the session.
+        '''
+        refilled = False
+
+        while True:
+            with cls.lock:
+                while project_id in cls.refilling:
+                    cls.refilled.wait()
+
+                entries = cls.projects.get(project_id)
+
+                if entries:
+                    entry = entries.popleft()
+                elif refilled:
+                    return
+                else:
+                    entry = None
+                    cls.refilling.add(project_id)
+
+            if not entry:
+                try:
+                    cls.refill(session, project_id)
+                finally:
+                    with cls.lock:
+                        cls.refilling.discard(project_id)
+                        cls.refilled.notify_all()
+
+                refilled = True
+                continue
+
+            claim = _claim_item_id(session, project_id, *entry,
+                                   username=username, ip_address=ip_address)
+
+            if claim:
+                return claim
+
+            logger.debug('Pooled item %s is no longer available.', entry[0])
+
+    @classmethod
+    def refill(cls, session, project_id):
+        '''Replace the pooled items of the project from the database.
+
+        The query runs without holding :attr:`lock`.
+        '''
+        rows = session.query(
+            Item.id, Item.lower_sequence_num, Item.upper_sequence_num
+            ) \
+            .filter_by(username=None, project_id=project_id) \
+            .order_by(Item.id) \
+            .limit(cls.refill_size)
+
+        entries = [tuple(row) for row in rows]
+
+        if cls.shuffle:
+            random.shuffle(entries)
+
+        with cls.lock:
+            cls.projects[project_id] = collections.deque(entries)
+
+        logger.debug('Refilled item pool for %s with %d items.',
+                     project_id, len(entries))
+
+    @classmethod
+    def clear(cls, project_id=None):
+        with cls.lock:
+            if project_id:
+                cls.projects.pop(project_id, None)
+            else:
+                cls.projects = {}
+
+    @classmethod
+    def check_consistency(cls, chunk_size=500):
+        '''Check the pooled items against the items table.
+
+        Entries that are no longer unclaimed are dropped from the pool.
+        Returns a dict of project names to lists of dropped item IDs.
+        '''
+        stale = {}
+
+        with new_session() as session:
+            for project_id in list(cls.projects.keys()):
+                with cls.lock:
+                    item_ids = [entry[0] for entry
+                                in cls.projects.get(project_id, ())]
+
+                valid_ids = set()
+
+                for index in range(0, len(item_ids), chunk_size):
+                    rows = session.query(Item.id) \
+                        .filter(Item.id.in_(item_ids[index:index + chunk_size])) \
+                        .filter_by(username=None, project_id=project_id)
+
+                    valid_ids.update(row[0] for row in rows)
+
+                stale_ids = [item_id for item_id in item_ids
+                             if item_id not in valid_ids]
+
+                if stale_ids:
+                    logger.warning(
+                        'Item pool for %s had %d stale items.',
+                        project_id, len(stale_ids))
+                    stale[project_id] = stale_ids
+
+                    stale_id_set = frozenset(stale_ids)
 
-        project_info['claims'] -= 1
-        project_info['items'] -= 1
-        project_info['ip_addresses'].remove(ip_address)
+                    with cls.lock:
+                        entries = cls.projects.get(project_id, ())
+                        cls.projects[project_id] = collections.deque(
+                            entry for entry in entries
+                            if entry[0] not in stale_id_set)
+
+        return stale
 
 
 def make_hash(plaintext, salt):
@@ -658,15 +1264,32 @@ def new_tamper_key():
     return base64.b16encode(os.urandom(16)).decode('ascii')
 
 def deadman_checks():
-    if ErrorReport.get_count() > DEADMAN_MAX_ERROR_REPORTS:
+    counts = Deadman.get_counts()
+
+    if counts['error_reports'] > DEADMAN_MAX_ERROR_REPORTS:
         return '<div class="alert btn-danger">Too many error reports! Figure out what went wrong.</div>'
 
-    if Result.get_count() > DEADMAN_MAX_RESULTS:
+    if counts['results'] > DEADMAN_MAX_RESULTS:
         return '<div class="alert btn-danger">Too many results! Run the export script.</div>'
 
     return ''
 
+def is_new_item(num_claims, num_items, max_num_items):
+    '''Return whether a checkout should generate a new item.'''
+    return num_claims >= num_items and num_items < max_num_items
+
+
 def checkout_item(username, ip_address, version=-1, client_version=-1):
+    return checkout_items(username, ip_address, version, client_version)[0]
+
+
+def checkout_items(username, ip_address, version=-1, client_version=-1,
+                   max_items=1):
+    '''Check out up to `max_items` items in one transaction.
+
+    Each item is from a different project since only one claim per IP
+    address per project is allowed. Returns a list of item dicts.
+    '''
     assert version is not None
     assert client_version is not None
 
@@ -675,135 +1298,272 @@ def checkout_item(username, ip_address, version=-1, client_version=-1):
     if deadman_checks():
         raise NoResourcesAvailable()
 
-    available = Budget.get_available_project(
-        ip_address, version, client_version
-    )
-
-    if available:
-        project_id, num_claims, num_items, max_num_items = available
+    claims = []
+    reservations = []
+    exclude_projects = set()
 
+    try:
         with new_session() as session:
-            if num_claims >= num_items and num_items < max_num_items:
-                project = session.query(Project).get(project_id)
+            while len(claims) < max_items:
+                available = Budget.reserve(
+                    ip_address, version, client_version,
+                    exclude_projects=exclude_projects
+                )
 
-                if project.autoqueue:
-                    item_count = project.num_count_per_item
-                    upper_sequence_num = project.lower_sequence_num + item_count - 1
+                if not available:
+                    break
 
-                    item = Item(
-                        project=project,
-                        lower_sequence_num=project.lower_sequence_num,
-                        upper_sequence_num=upper_sequence_num,
-                    )
-                    new_item = True
+                project_id, num_claims, num_items, max_num_items = available
+                new_item = is_new_item(num_claims, num_items, max_num_items)
+                exclude_projects.add(project_id)
 
-                    project.lower_sequence_num = upper_sequence_num + 1
+                try:
+                    claim = _claim_item(
+                        session, project_id, username, ip_address, new_item)
+                except NoItemAvailable:
+                    Budget.cancel_check_out(
+                        project_id, ip_address, new_item=new_item)
+                    continue
 
-                    session.add(item)
-                else:
-                    item = None
-                    new_item = None
+                reservations.append((project_id, new_item))
+                claims.append(claim)
+    except:
+        for project_id, new_item in reservations:
+            Budget.cancel_check_out(project_id, ip_address, new_item=new_item)
+        raise
 
-            else:
-                item = session.query(Item) \
-                    .filter_by(username=None) \
-                    .filter_by(project_id=project_id) \
-                    .first()
-                new_item = False
+    if claims:
+        return claims
+    elif exclude_projects:
+        raise NoItemAvailable()
+    elif Budget.is_claims_full(ip_address):
+        raise FullClaim()
+    else:
+        outdated = Budget.is_client_outdated(version, client_version)
 
-            if item:
-                item.datetime_claimed = datetime.datetime.utcnow()
-                item.tamper_key = new_tamper_key()
-                item.username = username
-                item.ip_address = ip_address
+        if outdated:
+            current_version, current_client_version = outdated
 
-                # Item should be committed now to generate ID for
-                # newly generated items
-                session.commit()
+            raise UpdateClient(
+                version=version,
+                client_version=client_version,
+                current_version=current_version,
+                current_client_version=current_client_version
+            )
+        else:
+            raise NoItemAvailable()
+
+
+def _claim_item(session, project_id, username, ip_address, new_item):
+    if new_item:
+        # Advance the sequence number in one statement so concurrent
+        # checkouts never generate overlapping items
+        query = update(Project) \
+            .where(Project.name == project_id) \
+            .where(Project.autoqueue.is_(True)) \
+            .values(lower_sequence_num=Project.lower_sequence_num +
+                    Project.num_count_per_item)
+
+        if session.execute(query).rowcount == 1:
+            project = session.query(Project) \
+                .populate_existing() \
+                .get(project_id)
+
+            item = Item(
+                project=project,
+                lower_sequence_num=project.lower_sequence_num -
+                project.num_count_per_item,
+                upper_sequence_num=project.lower_sequence_num - 1,
+            )
+
+            session.add(item)
+        else:
+            item = None
 
-                Budget.check_out(project_id, ip_address, new_item=new_item)
+    elif ItemPool.enabled:
+        claim = ItemPool.claim(session, project_id, username, ip_address)
 
-                return item.to_dict()
+        if not claim:
+            raise NoItemAvailable()
 
-            else:
+        return claim
+
+    else:
+        while True:
+            # SKIP LOCKED lets concurrent trackers on PostgreSQL pick
+            # different items instead of waiting for each other. It is
+            # not rendered on SQLite.
+            row = session.query(
+                Item.id, Item.lower_sequence_num, Item.upper_sequence_num
+                ) \
+                .filter_by(username=None) \
+                .filter_by(project_id=project_id) \
+                .with_for_update(skip_locked=True) \
+                .first()
+
+            if not row:
                 raise NoItemAvailable()
 
+            item_id, lower_sequence_num, upper_sequence_num = row
+            claim = _claim_item_id(
+                session, project_id, item_id, lower_sequence_num,
+                upper_sequence_num, username, ip_address)
+
+            if claim:
+                return claim
+
+    if item:
+        item.datetime_claimed = datetime.datetime.utcnow()
+        item.tamper_key = new_tamper_key()
+        item.username = username
+        item.ip_address = ip_address
+
+        # Item should be flushed now to generate ID for
+        # newly generated items
+        session.flush()
+
+        return item.to_dict()
+
     else:
-        if Budget.is_claims_full(ip_address):
-            raise FullClaim()
-        else:
-            outdated = Budget.is_client_outdated(version, client_version)
+        raise NoItemAvailable()
 
-            if outdated:
-                current_version, current_client_version = outdated
 
-                raise UpdateClient(
-                    version=version,
-                    client_version=client_version,
-                    current_version=current_version,
-                    current_client_version=current_client_version
-                )
-            else:
-                raise NoItemAvailable()
+def _claim_item_id(session, project_id, item_id, lower_sequence_num,
+                   upper_sequence_num, username, ip_address):
+    '''Claim the item if it is still unclaimed.
+
+    The UPDATE only matches an unclaimed row so an item is never handed
+    out twice, whichever database and isolation level is used. Returns
+    the item as a dict (as :meth:`Item.to_dict`) or None.
+    '''
+    datetime_claimed = datetime.datetime.utcnow()
+    tamper_key = new_tamper_key()
+
+    query = update(Item) \
+        .where(Item.id == item_id) \
+        .where(Item.username.is_(None)) \
+        .values(
+            datetime_claimed=datetime_claimed,
+            tamper_key=tamper_key,
+            username=username,
+            ip_address=ip_address,
+        )
+    result = session.execute(query)
+
+    if result.rowcount != 1:
+        return
+
+    project = session.query(Project).get(project_id)
+
+    return {
+        'id': item_id,
+        'project_id': project_id,
+        'project': project.to_dict(),
+        'lower_sequence_num': lower_sequence_num,
+        'upper_sequence_num': upper_sequence_num,
+        'datetime_claimed': calendar.timegm(
+            datetime_claimed.utctimetuple()),
+        'tamper_key': tamper_key,
+        'username': username,
+        'ip_address': ip_address,
+    }
 
 
 def checkin_item(item_id, tamper_key, results):
-    item_stat = {
-        'project': '',
-        'username': '',
-        'scanned': 0,
-        'found': len(results)
-    }
+    outcome = checkin_items([(item_id, tamper_key, results)])[0]
 
-    with new_session() as session:
-        row = session.query(
-            Item.project_id, Item.username, Item.upper_sequence_num,
-            Item.lower_sequence_num, Item.ip_address, Item.datetime_claimed
-            ) \
-            .filter_by(id=item_id, tamper_key=tamper_key).first()
+    if isinstance(outcome, InvalidClaim):
+        raise outcome
 
-        if not row:
-            raise InvalidClaim()
+    return outcome
+
+
+def checkin_items(checkins):
+    '''Check in several items in one transaction.
 
-        (project_id, username, upper_sequence_num, lower_sequence_num,
-         ip_address, datetime_claimed) = row
+    `checkins` is a list of ``(item_id, tamper_key, results)`` tuples.
+    Returns a list with, for each check in, the item stats dict or an
+    :class:`InvalidClaim` instance.
+    '''
+    saved_checkins = save_checkins(checkins)
+
+    record_checkins(saved_checkins)
 
-        item_stat['project'] = project_id
-        item_stat['username'] = username
-        item_stat['scanned'] = upper_sequence_num - lower_sequence_num + 1
-        item_stat['started'] = datetime_claimed.replace(
-            tzinfo=datetime.timezone.utc).timestamp()
+    return saved_checkins.outcomes
 
-        query_args = []
 
-        # tz instead of utcnow() for Unix timestamp in UTC instead of local
-        time = datetime.datetime.now(datetime.timezone.utc)
+def save_checkins(checkins):
+    '''Save check ins in one transaction without updating the counters.
 
-        item_stat['finished'] = time.timestamp()
+    Returns a :class:`SavedCheckins` for :func:`record_checkins`.
+    '''
+    outcomes = []
+    claims = []
+    query_args = []
 
-        for shortcode in results.keys():
-            url = results[shortcode]['url']
-            encoding = results[shortcode]['encoding']
-            query_args.append({
-                'project_id': project_id,
-                'shortcode': shortcode,
-                'url': url,
-                'encoding': encoding,
-                'datetime': time
-            })
+    # tz instead of utcnow() for Unix timestamp in UTC instead of local
+    time = datetime.datetime.now(datetime.timezone.utc)
+
+    with new_session() as session:
+        for item_id, tamper_key, results in checkins:
+            row = session.query(
+                Item.project_id, Item.username, Item.upper_sequence_num,
+                Item.lower_sequence_num, Item.ip_address, Item.datetime_claimed
+                ) \
+                .filter_by(id=item_id, tamper_key=tamper_key) \
+                .filter(Item.datetime_claimed.isnot(None)) \
+                .first()
+
+            if not row:
+                outcomes.append(InvalidClaim())
+                continue
+
+            (project_id, username, upper_sequence_num, lower_sequence_num,
+             ip_address, datetime_claimed) = row
+
+            item_stat = {
+                'project': project_id,
+                'username': username,
+                'scanned': upper_sequence_num - lower_sequence_num + 1,
+                'found': len(results),
+                'started': datetime_claimed.replace(
+                    tzinfo=datetime.timezone.utc).timestamp(),
+                'finished': time.timestamp(),
+            }
+
+            for shortcode in results.keys():
+                url = results[shortcode]['url']
+                encoding = results[shortcode]['encoding']
+                query_args.append({
+                    'project_id': project_id,
+                    'shortcode': shortcode,
+                    'url': url,
+                    'encoding': encoding,
+                    'datetime': time
+                })
+
+            session.execute(delete(Item).where(Item.id == item_id))
+
+            outcomes.append(item_stat)
+            claims.append((project_id, ip_address))
 
         if len(query_args) > 0:
             query = insert(Result)
             session.execute(query, query_args)
 
-        session.execute(delete(Item).where(Item.id == item_id))
+    return SavedCheckins(outcomes, claims, len(query_args))
 
-        Budget.check_in(project_id, ip_address)
 
-    if Stats.instance:
-        Stats.instance.update(item_stat)
+def record_checkins(saved_checkins):
+    '''Update the counters and live stats of committed check ins.'''
+    Deadman.add(results=saved_checkins.num_results)
 
-    return item_stat
+    Budget.check_in_many(saved_checkins.claims)
+
+    if Stats.instance:
+        for outcome in saved_checkins.outcomes:
+            if not isinstance(outcome, InvalidClaim):
+                Stats.instance.update(outcome)
 
 
 def report_error(item_id, tamper_key, message):
@@ -816,6 +1576,8 @@ def report_error(item_id, tamper_key, message):
         error_report = ErrorReport(item_id=item_id, message=message)
         session.add(error_report)
 
+    Deadman.add(error_reports=1)
+
 
 def check_min_version_overrides(version, client_version):
     if version < MIN_VERSION_OVERRIDE or client_version < MIN_CLIENT_VERSION_OVERRIDE:
@@ -0,0 +1,350 @@
+import concurrent.futures
+import datetime
+import os.path
+import tempfile
+import unittest
+
+from terroroftinytown.client import VERSION
+from terroroftinytown.tracker.database import Database
+from terroroftinytown.tracker.errors import FullClaim, NoItemAvailable
+from terroroftinytown.tracker.model import Budget, Deadman, ErrorReport, \
+    Item, ItemPool, Project, Result, User, checkin_item, checkout_item, \
+    checkout_items, new_session, report_error, DEADMAN_MAX_ERROR_REPORTS, \
+    MIN_CLIENT_VERSION_OVERRIDE
+
+
+class TestModel(unittest.TestCase):
+    database_url = 'sqlite://'
+
+    def setUp(self):
+        Database(self.database_url, delete_everything='yes-really!',
+                 item_pool='on')
+
+        with new_session() as session:
+            session.add(Project(name='test', enabled=True))
+
+        Item.add_items('test', [(0, 9), (10, 19), (20, 29)])
+        Budget.calculate_budgets()
+        ItemPool.clear()
+
+    def checkout(self, ip_address):
+        return checkout_item('user', ip_address, VERSION,
+                             MIN_CLIENT_VERSION_OVERRIDE)
+
+    def test_item_pool_checkout(self):
+        claim = self.checkout('1.1.1.1')
+
+        self.assertEqual(0, claim['lower_sequence_num'])
+        self.assertEqual('test', claim['project']['name'])
+        self.assertEqual(2, len(ItemPool.projects['test']))
+
+        with new_session() as session:
+            item = session.query(Item).get(claim['id'])
+            self.assertEqual(item.to_dict(), claim)
+
+    def test_item_pool_skips_stale(self):
+        self.checkout('1.1.1.1')
+        Item.delete(ItemPool.projects['test'][0][0])
+
+        claim = self.checkout('2.2.2.2')
+
+        self.assertEqual(20, claim['lower_sequence_num'])
+
+        with self.assertRaises(NoItemAvailable):
+            self.checkout('3.3.3.3')
+
+    def test_item_pool_consistency(self):
+        self.checkout('1.1.1.1')
+        stale_id = ItemPool.projects['test'][0][0]
+        Item.delete(stale_id)
+
+        self.assertEqual({'test': [stale_id]}, ItemPool.check_consistency())
+        self.assertEqual(1, len(ItemPool.projects['test']))
+        self.assertEqual({}, ItemPool.check_consistency())
+
+    def test_item_pool_refill_per_project(self):
+        with new_session() as session:
+            session.add(Project(name='test2', enabled=True))
+
+        Item.add_items('test2', [(0, 9)])
+
+        # Checkouts of other projects do not wait for a refill
+        with ItemPool.lock:
+            ItemPool.refilling.add('test')
+
+        try:
+            with new_session() as session:
+                claim = ItemPool.claim(session, 'test2', 'user', '1.1.1.1')
+        finally:
+            with ItemPool.lock:
+                ItemPool.refilling.discard('test')
+                ItemPool.refilled.notify_all()
+
+        self.assertEqual('test2', claim['project']['name'])
+        self.assertNotIn('test', ItemPool.projects)
+
+    def test_checkout_items(self):
+        with new_session() as session:
+            session.add(Project(name='test2', enabled=True))
+
+        Item.add_items('test2', [(0, 9)])
+        Budget.calculate_budgets()
+
+        claims = checkout_items('user', '1.1.1.1', VERSION,
+                                MIN_CLIENT_VERSION_OVERRIDE, max_items=5)
+
+        self.assertEqual(
+            ['test', 'test2'],
+            sorted(claim['project']['name'] for claim in claims)
+        )
+        self.assertEqual(1, Budget.projects['test']['claims'])
+        self.assertEqual(1, Budget.projects['test2']['claims'])
+
+        claims = checkout_items('user', '2.2.2.2', VERSION,
+                                MIN_CLIENT_VERSION_OVERRIDE, max_items=5)
+
+        self.assertEqual(['test'], [claim['project']['name'] for claim in claims])
+
+        with self.assertRaises(FullClaim):
+            checkout_items('user', '1.1.1.1', VERSION,
+                           MIN_CLIENT_VERSION_OVERRIDE, max_items=5)
+
+    def test_budget_incremental(self):
+        self.checkout('1.1.1.1')
+        claim = self.checkout('2.2.2.2')
+
+        Item.add_items('test', [(30, 39)])
+        Budget.add_items('test', 1)
+        Budget.release_claims([Item.release(claim['id'])])
+        Budget.remove_items('test', *Item.delete_all('test'))
+
+        self.assertEqual(0, Budget.projects['test']['items'])
+        self.assertEqual(0, Budget.projects['test']['claims'])
+        self.assertEqual(set(), Budget.projects['test']['ip_addresses'])
+        self.assertEqual({}, Budget.reconcile())
+
+    def test_budget_reconcile(self):
+        self.checkout('1.1.1.1')
+        Item.release_all('test')
+
+        drift = Budget.reconcile()
+
+        self.assertEqual({'claims': (1, 0), 'ip_addresses': (1, 0)},
+                         drift['test'])
+        self.assertEqual(0, Budget.projects['test']['claims'])
+        self.assertEqual(3, Budget.projects['test']['items'])
+        self.assertEqual({}, Budget.reconcile())
+
+    def test_budget_load_without_lock(self):
+        LockProbeBudget.lock_free = []
+        LockProbeBudget.calculate_budgets()
+        self.assertEqual([True], LockProbeBudget.lock_free)
+
+        LockProbeBudget.reconcile()
+        self.assertEqual([True, True], LockProbeBudget.lock_free)
+        self.assertEqual(3, LockProbeBudget.projects['test']['items'])
+
+    def test_release_old(self):
+        with new_session() as session:
+            session.add(Project(name='test2', enabled=True,
+                                autorelease_time=60))
+            session.add(Project(name='test3', enabled=True,
+                                autorelease_time=60))
+            session.query(Project).get('test').autorelease_time = 3600
+
+        Item.add_items('test2', [(0, 9)])
+        Item.add_items('test3', [(0, 9)])
+        Budget.calculate_budgets()
+
+        claims = checkout_items('user', '1.1.1.1', VERSION,
+                                MIN_CLIENT_VERSION_OVERRIDE, max_items=3)
+        self.checkout('2.2.2.2')
+
+        claim_ages = {'test': 7200, 'test2': 120, 'test3': 30}
+
+        with new_session() as session:
+            for claim in claims:
+                item = session.query(Item).get(claim['id'])
+                item.datetime_claimed = datetime.datetime.utcnow() - \
+                    datetime.timedelta(seconds=claim_ages[claim['project_id']])
+
+        expected = [('test', '1.1.1.1'), ('test2', '1.1.1.1')]
+
+        released = Item.release_old()
+
+        self.assertEqual(expected, sorted(released))
+        self.assertEqual([], Item.release_old())
+
+        Budget.release_claims(released)
+
+        self.assertEqual({}, Budget.reconcile())
+
+    def test_get_items(self):
+        claim = self.checkout('1.1.1.1')
+
+        items = Item.get_items('test', limit=2)
+
+        self.assertEqual([1, 2], [item['id'] for item in items])
+        self.assertEqual('0', items[0]['lower_shortcode'])
+        self.assertEqual('1.1.1.1', items[0]['ip_address'])
+
+        items = Item.get_items('test', offset_id=items[-1]['id'], limit=2)
+
+        self.assertEqual([3], [item['id'] for item in items])
+        self.assertEqual(
+            [claim['id']],
+            [item['id'] for item in Item.get_items('test', claimed=True)])
+        self.assertEqual(
+            2, len(Item.get_items('test', claimed=False)))
+
+        summary = Item.get_summary('test')
+
+        self.assertEqual(3, summary['items'])
+        self.assertEqual(1, summary['claims'])
+        self.assertEqual(2, summary['queued'])
+        self.assertIsInstance(summary['oldest_claim'], datetime.datetime)
+
+    def test_deadman_counters(self):
+        Deadman.reconcile()
+        claim = self.checkout('1.1.1.1')
+
+        report_error(claim['id'], claim['tamper_key'], 'message')
+        checkin_item(claim['id'], claim['tamper_key'], {
+            'a': {'url': 'http://example.com', 'encoding': 'ascii'},
+            'b': {'url': 'http://example.com', 'encoding': 'ascii'},
+        })
+
+        self.assertEqual({'results': 2, 'error_reports': 1},
+                         Deadman.get_counts())
+        self.assertEqual(1 / DEADMAN_MAX_ERROR_REPORTS,
+                         Deadman.get_fill_levels()['error_reports'])
+
+        ErrorReport.delete_orphaned()
+
+        self.assertEqual(0, Deadman.get_counts()['error_reports'])
+
+        Deadman.add(results=5)
+        Deadman.reconcile()
+
+        self.assertEqual(
+            {'results': Result.get_count(), 'error_reports': 0},
+            Deadman.get_counts()
+        )
+
+    def test_session_token_cache(self):
+        User.save_new_user('admin', 'password')
+        token = User.get_user_token('admin')
+
+        self.assertTrue(User.check_account_session('admin', token))
+        self.assertEqual(token, User.token_cache.get('admin'))
+        self.assertFalse(User.check_account_session('admin', b'bad'))
+
+        User.update_password('admin', 'password2')
+
+        self.assertFalse(User.check_account_session('admin', token))
+
+        token = User.get_user_token('admin')
+
+        self.assertTrue(User.check_account_session('admin', token))
+
+        User.delete_user('admin')
+
+        self.assertFalse(User.check_account_session('admin', token))
+
+    def test_session_token_no_cache(self):
+        User.save_new_user('admin', 'password')
+        token = User.get_user_token('admin')
+        User.cache_tokens = False
+
+        try:
+            self.assertTrue(User.check_account_session('admin', token))
+
+            # Deleted by another process which cannot clear this cache
+            with new_session() as session:
+                session.query(User).filter_by(username='admin').delete()
+
+            self.assertFalse(User.check_account_session('admin', token))
+        finally:
+            User.cache_tokens = True
+
+
+class LockProbeBudget(Budget):
+    '''Budget recording whether another thread can take the lock while
+    the counters are loaded.'''
+    projects = {}
+    lock_free = []
+
+    @classmethod
+    def _load_budgets(cls, session, project_id=None):
+        def try_lock():
+            if cls.lock.acquire(blocking=False):
+                cls.lock.release()
+                return True
+
+            return False
+
+        with concurrent.futures.ThreadPoolExecutor(1) as pool:
+            cls.lock_free.append(pool.submit(try_lock).result())
+
+        return super()._load_budgets(session, project_id)
+
+
+class TestConcurrentClaims(unittest.TestCase):
+    num_workers = 8
+    num_claims = 64
+    item_pool = 'off'
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.database_url = 'sqlite:///' + os.path.join(
+            self.temp_dir.name, 'test.db')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        ItemPool.enabled = True
+
+    def setup_database(self):
+        Database(self.database_url, delete_everything='yes-really!',
+                 pool_size=self.num_workers, item_pool=self.item_pool)
+        ItemPool.clear()
+
+    def checkout_concurrently(self):
+        with concurrent.futures.ThreadPoolExecutor(self.num_workers) as pool:
+            return list(pool.map(
+                lambda index: checkout_item(
+                    'user', '10.0.0.{0}'.format(index), VERSION,
+                    MIN_CLIENT_VERSION_OVERRIDE),
+                range(self.num_claims)
+            ))
+
+    def test_queued_items(self):
+        self.setup_database()
+
+        with new_session() as session:
+            session.add(Project(name='test', enabled=True,
+                                max_num_items=self.num_claims))
+
+        Item.add_items('test', [(index * 10, index * 10 + 9)
+                                for index in range(self.num_claims)])
+        Budget.calculate_budgets()
+
+        claims = self.checkout_concurrently()
+
+        self.assertEqual(self.num_claims,
+                         len(set(claim['id'] for claim in claims)))
+
+    def test_autoqueue_items(self):
+        self.setup_database()
+
+        with new_session() as session:
+            session.add(Project(name='test', enabled=True, autoqueue=True,
+                                max_num_items=self.num_claims))
+
+        Budget.calculate_budgets()
+
+        claims = self.checkout_concurrently()
+        lower_sequence_nums = sorted(
+            claim['lower_sequence_num'] for claim in claims)
+
+        self.assertEqual(
+            list(range(0, self.num_claims * 50, 50)), lower_sequence_nums)
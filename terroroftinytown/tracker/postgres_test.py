@@ -0,0 +1,59 @@
+import os
+import unittest
+
+from terroroftinytown.test.postgres import PostgresServer, psycopg2
+from terroroftinytown.tracker import model_test
+from terroroftinytown.tracker.model import ItemPool
+
+
+server = None
+database_url = os.environ.get('TOTT_TEST_POSTGRES_URL')
+
+
+def setUpModule():
+    global server, database_url
+
+    if database_url:
+        if not psycopg2:
+            raise unittest.SkipTest('psycopg2 is not installed')
+    elif PostgresServer.is_available():
+        server = PostgresServer()
+        server.start()
+        database_url = server.url
+    else:
+        raise unittest.SkipTest('PostgreSQL is not available')
+
+
+def tearDownModule():
+    if server:
+        server.stop()
+
+
+class TestModelPostgres(model_test.TestModel):
+    def setUp(self):
+        self.database_url = database_url
+        super().setUp()
+
+
+class TestConcurrentClaimsPostgres(model_test.TestConcurrentClaims):
+    def setUp(self):
+        super().setUp()
+        self.database_url = database_url
+
+
+class TestDefaultClaimsPostgres(model_test.TestConcurrentClaims):
+    # Claims use SKIP LOCKED without configuring the item pool
+    item_pool = 'auto'
+
+    def setUp(self):
+        super().setUp()
+        self.database_url = database_url
+
+    def checkout_concurrently(self):
+        self.assertFalse(ItemPool.enabled)
+
+        claims = super().checkout_concurrently()
+
+        self.assertEqual({}, ItemPool.projects)
+
+        return claims
@@ -0,0 +1,137 @@
+# encoding=utf-8
+'''On demand profiling of the IOLoop thread.'''
+import cProfile
+import collections
+import logging
+import marshal
+import sys
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+ProfileResult = collections.namedtuple(
+    'ProfileResult', ['filename', 'content_type', 'data', 'description'])
+
+
+class Profiler(object):
+    '''Profile the IOLoop thread while an operator asks for it.
+
+    Two modes are available. Sampling records the stack of the IOLoop
+    thread at a fixed interval for some seconds, in the collapsed stack
+    format used by flame graph tools. Request profiling runs cProfile on
+    the IOLoop thread until a number of requests have finished and
+    produces a pstats file. Work done in database worker threads is not
+    included in either.
+
+    Nothing runs while idle apart from the check in
+    :meth:`on_request_finished`.
+    '''
+    def __init__(self):
+        self.result = None
+        self._lock = threading.Lock()
+        self._sampler_thread = None
+        self._profile = None
+        self._remaining_requests = 0
+
+    def is_running(self):
+        return bool(self._sampler_thread or self._profile)
+
+    def start_sampling(self, duration, interval=0.005):
+        '''Sample the stacks of the calling thread for `duration` seconds.'''
+        with self._lock:
+            if self.is_running():
+                return False
+
+            self._sampler_thread = threading.Thread(
+                target=self._sample,
+                args=(threading.get_ident(), duration, interval),
+                daemon=True
+            )
+            self._sampler_thread.start()
+
+        logger.info('Sampling stacks for %s seconds.', duration)
+
+        return True
+
+    def start_request_profile(self, num_requests):
+        '''Profile until `num_requests` more requests have finished.'''
+        with self._lock:
+            if self.is_running():
+                return False
+
+            self._remaining_requests = num_requests
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+        logger.info('Profiling the next %d requests.', num_requests)
+
+        return True
+
+    def on_request_finished(self):
+        if not self._profile:
+            return
+
+        self._remaining_requests -= 1
+
+        if self._remaining_requests <= 0:
+            self._finish_request_profile()
+
+    def _finish_request_profile(self):
+        with self._lock:
+            profile = self._profile
+            profile.disable()
+            profile.create_stats()
+            self._profile = None
+
+            self.result = ProfileResult(
+                'tracker.pstats', 'application/octet-stream',
+                marshal.dumps(profile.stats),
+                'cProfile of requests finished at {0}'.format(time.ctime())
+            )
+
+        logger.info('Request profile finished.')
+
+    def _sample(self, thread_id, duration, interval):
+        stacks = collections.Counter()
+        num_samples = 0
+        deadline = time.monotonic() + duration
+
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+
+            if frame is None:
+                break
+
+            stacks[self._collapse_stack(frame)] += 1
+            num_samples += 1
+            del frame
+
+            time.sleep(interval)
+
+        data = ''.join(
+            '{0} {1}\n'.format(stack, count)
+            for stack, count in stacks.most_common()
+        ).encode('utf-8')
+
+        with self._lock:
+            self.result = ProfileResult(
+                'tracker-stacks.txt', 'text/plain; charset=utf-8', data,
+                '{0} stack samples finished at {1}'.format(
+                    num_samples, time.ctime())
+            )
+            self._sampler_thread = None
+
+        logger.info('Stack sampling finished.')
+
+    @classmethod
+    def _collapse_stack(cls, frame):
+        names = []
+
+        while frame is not None:
+            code = frame.f_code
+            names.append('{0}:{1}'.format(code.co_filename, code.co_name))
+            frame = frame.f_back
+
+        return ';'.join(reversed(names))
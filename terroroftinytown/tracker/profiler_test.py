@@ -0,0 +1,52 @@
+import marshal
+import time
+import unittest
+
+from terroroftinytown.tracker.profiler import Profiler
+
+
+class TestProfiler(unittest.TestCase):
+    def test_sampling(self):
+        profiler = Profiler()
+
+        self.assertTrue(profiler.start_sampling(0.2, interval=0.001))
+        sampler_thread = profiler._sampler_thread
+        self.assertFalse(profiler.start_sampling(0.2))
+        self.assertTrue(profiler.is_running())
+
+        deadline = time.monotonic() + 0.3
+        while time.monotonic() < deadline:
+            sum(range(1000))
+
+        sampler_thread.join()
+
+        self.assertFalse(profiler.is_running())
+        self.assertEqual('tracker-stacks.txt', profiler.result.filename)
+
+        lines = profiler.result.data.decode('utf-8').splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit() for line in lines))
+        self.assertTrue(any('test_sampling' in line for line in lines))
+
+    def test_request_profile(self):
+        profiler = Profiler()
+
+        profiler.on_request_finished()
+        self.assertIsNone(profiler.result)
+
+        self.assertTrue(profiler.start_request_profile(2))
+        self.assertFalse(profiler.start_request_profile(2))
+
+        sum(range(1000))
+        profiler.on_request_finished()
+        self.assertTrue(profiler.is_running())
+        profiler.on_request_finished()
+
+        self.assertFalse(profiler.is_running())
+        self.assertEqual('tracker.pstats', profiler.result.filename)
+
+        stats = marshal.loads(profiler.result.data)
+        self.assertTrue(
+            any(func_name == 'on_request_finished'
+                for dummy, dummy, func_name in stats)
+        )
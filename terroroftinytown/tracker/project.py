@@ -27,7 +27,7 @@ class AllProjectsHandler(BaseHandler):
             'admin/project/all.html',
             projects=projects,
             add_project_form=add_project_form,
-            project_budgets=Budget.projects,
+            project_budgets=Budget.get_projects(with_ip_addresses=False),
             project_stats=Stats.instance.get_project(),
         )
 
@@ -60,7 +60,7 @@ class AllProjectsHandler(BaseHandler):
             add_project_form=add_project_form,
             projects=Project.all_project_infos(),
             message=message,
-            project_budgets=Budget.projects,
+            project_budgets=Budget.get_projects(with_ip_addresses=False),
         )
 
 
@@ -124,7 +124,7 @@ class QueueHandler(BaseHandler):
         else:
             message = 'Error: unrecognized action argument.'
 
-        Budget.calculate_budgets()
+        Budget.update_project(project_id)
 
         self.render(
             'admin/project/queue_settings.html',
@@ -151,21 +151,22 @@ class QueueHandler(BaseHandler):
 
 
 class ClaimsHandler(BaseHandler):
+    ITEMS_PAGE_SIZE = 100
+    STATUS_FILTERS = {'claimed': True, 'queued': False}
+
     @tornado.web.authenticated
     def get(self, project_id):
         delete_form = ConfirmForm()
         manual_add_form = AddItemsForm()
         release_form = ReleaseClaimForm()
         item_action_form = ItemActionForm()
-        items = Item.get_items(project_id)
 
-        self.render(
-            'admin/project/claims.html', project_id=project_id,
+        self._render(
+            project_id,
             delete_form=delete_form,
             manual_add_form=manual_add_form,
             release_form=release_form,
             item_action_form=item_action_form,
-            items=items,
         )
 
     @tornado.web.authenticated
@@ -174,7 +175,6 @@ class ClaimsHandler(BaseHandler):
         manual_add_form = AddItemsForm(self.request.arguments)
         release_form = ReleaseClaimForm(self.request.arguments)
         item_action_form = ItemActionForm(self.request.arguments)
-        items = Item.get_items(project_id)
         action = self.get_argument('action')
 
         if action == 'manual_add' and manual_add_form.validate():
@@ -197,13 +197,35 @@ class ClaimsHandler(BaseHandler):
             self.redirect(self.reverse_url('project.claims', project_id))
             return
 
-        self.render(
-            'admin/project/claims.html', project_id=project_id,
+        self._render(
+            project_id,
             delete_form=delete_form,
             manual_add_form=manual_add_form,
             release_form=release_form,
             item_action_form=item_action_form,
+        )
+
+    def _render(self, project_id, **forms):
+        status = self.get_argument('status', None)
+
+        if status not in self.STATUS_FILTERS:
+            status = None
+
+        items = Item.get_items(
+            project_id,
+            offset_id=max(0, int(self.get_argument('offset_id', 0))),
+            limit=self.ITEMS_PAGE_SIZE,
+            claimed=self.STATUS_FILTERS.get(status),
+        )
+
+        self.render(
+            'admin/project/claims.html', project_id=project_id,
             items=items,
+            summary=Item.get_summary(project_id),
+            status=status,
+            next_offset_id=items[-1]['id']
+            if len(items) == self.ITEMS_PAGE_SIZE else None,
+            **forms
         )
 
     def _add_items(self, project_id):
@@ -219,35 +241,41 @@ class ClaimsHandler(BaseHandler):
             seq_list.append((lower_seq_num, upper_seq_num))
 
         Item.add_items(project_id, seq_list)
-        Budget.calculate_budgets()
+        Budget.add_items(project_id, len(seq_list))
 
     def _delete_one(self):
         item_id = int(self.get_argument('id'))
 
-        Item.delete(item_id)
-        Budget.calculate_budgets()
+        deleted = Item.delete(item_id)
+
+        if deleted:
+            project_id, ip_address = deleted
+            Budget.remove_items(
+                project_id, 1, [ip_address] if ip_address else [])
 
         logger.info(self.user_audit_text('Deleted item %s'), item_id)
 
     def _release_one(self):
         item_id = int(self.get_argument('id'))
 
-        Item.release(item_id)
-        Budget.calculate_budgets()
+        claim = Item.release(item_id)
+
+        if claim:
+            Budget.release_claims([claim])
 
         logger.info(self.user_audit_text('Released item %s'), item_id)
 
     def _release_all(self, project_id, release_form):
         time_ago = time.time() - release_form.hours.data * 60
 
-        Item.release_all(project_id, datetime.datetime.utcfromtimestamp(time_ago))
-        Budget.calculate_budgets()
+        Budget.release_claims(Item.release_all(
+            project_id, datetime.datetime.utcfromtimestamp(time_ago)))
 
         logger.info(self.user_audit_text('Released items for %s'), project_id)
 
     def _delete_all(self, project_id):
-        Item.delete_all(project_id)
-        Budget.calculate_budgets()
+        num_items, ip_addresses = Item.delete_all(project_id)
+        Budget.remove_items(project_id, num_items, ip_addresses)
 
         logger.info(self.user_audit_text('Delete all items for %s'), project_id)
 
@@ -272,6 +300,8 @@ class SettingsHandler(BaseHandler):
             with Project.get_session_object(project_id) as project:
                 form.populate_obj(project)
 
+            Budget.update_project(project_id)
+
             logger.info(
                 self.user_audit_text('Changed project %s shortener settings'),
                 project_id)
@@ -298,7 +328,7 @@ class DeleteHandler(BaseHandler):
 
         if form.validate():
             Project.delete_project(project_id)
-            Budget.calculate_budgets()
+            Budget.update_project(project_id)
 
             logger.info(self.user_audit_text('Deleted project %s'), project_id)
             self.redirect(self.reverse_url('admin.overview'))
@@ -0,0 +1,30 @@
+# encoding=utf-8
+'''Build the leaderboard sorted set from the users lifetime stats.
+
+Run once when upgrading from a version without the leaderboard, with the
+tracker stopped.
+'''
+import logging
+
+from terroroftinytown.tracker.bootstrap import Bootstrap
+
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderboardBootstrap(Bootstrap):
+    def start(self, args=None):
+        super().start(args=args)
+
+        logging.basicConfig(level=logging.INFO)
+
+        self.setup_redis()
+        self.setup_stats()
+
+        count = self.stats.rebuild_leaderboard()
+
+        logger.info('Leaderboard rebuilt with %d users.', count)
+
+
+if __name__ == '__main__':
+    LeaderboardBootstrap().start()
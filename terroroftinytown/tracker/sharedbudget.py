@@ -0,0 +1,286 @@
+# encoding=utf-8
+'''Budget counters shared between tracker processes in Redis.'''
+from terroroftinytown.tracker.metrics import redis_duration, timed
+
+__all__ = ['SharedBudget']
+
+# Scripts compute the per project key names from the prefix so they do not
+# work with Redis Cluster. `replicate_commands` lets scripts write after
+# SMEMBERS on Redis versions older than 5.
+RESERVE_SCRIPT = '''
+if redis.replicate_commands then
+    redis.replicate_commands()
+end
+
+local prefix, ip_address, version, client_version, seed =
+    ARGV[1], ARGV[2], tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[5])
+local excluded = {}
+
+for index = 6, #ARGV do
+    excluded[ARGV[index]] = true
+end
+
+local names = redis.call('SMEMBERS', KEYS[1])
+table.sort(names)
+math.randomseed(seed)
+
+for index = #names, 2, -1 do
+    local other = math.random(index)
+    names[index], names[other] = names[other], names[index]
+end
+
+for _, name in ipairs(names) do
+    local key = prefix .. 'project:' .. name
+    local ips_key = prefix .. 'ips:' .. name
+    local info = redis.call(
+        'HMGET', key, 'max_num_items', 'min_version', 'min_client_version',
+        'items', 'claims')
+    local max_num_items, min_version, min_client_version, items, claims =
+        tonumber(info[1]), tonumber(info[2]), tonumber(info[3]),
+        tonumber(info[4]), tonumber(info[5])
+
+    if not excluded[name] and max_num_items and
+            redis.call('SISMEMBER', ips_key, ip_address) == 0 and
+            version >= min_version and
+            client_version >= min_client_version and
+            claims <= items and claims < max_num_items then
+        redis.call('HINCRBY', key, 'claims', 1)
+
+        if claims >= items and items < max_num_items then
+            redis.call('HINCRBY', key, 'items', 1)
+        end
+
+        redis.call('SADD', ips_key, ip_address)
+
+        return {name, claims, items, max_num_items}
+    end
+end
+
+return false
+'''
+
+ADJUST_SCRIPT = '''
+local claims, items, ip_action, ip_address =
+    tonumber(ARGV[1]), tonumber(ARGV[2]), ARGV[3], ARGV[4]
+
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+
+if claims ~= 0 then
+    redis.call('HINCRBY', KEYS[1], 'claims', claims)
+end
+
+if items ~= 0 then
+    redis.call('HINCRBY', KEYS[1], 'items', items)
+end
+
+if ip_action == 'add' then
+    redis.call('SADD', KEYS[2], ip_address)
+elseif ip_action == 'remove' then
+    redis.call('SREM', KEYS[2], ip_address)
+end
+
+return 1
+'''
+
+UPDATE_SETTINGS_SCRIPT = '''
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+
+redis.call(
+    'HMSET', KEYS[1], 'max_num_items', ARGV[1], 'min_version', ARGV[2],
+    'min_client_version', ARGV[3])
+
+return 1
+'''
+
+CLAIMS_FULL_SCRIPT = '''
+local prefix, ip_address = ARGV[1], ARGV[2]
+local names = redis.call('SMEMBERS', KEYS[1])
+
+if #names == 0 then
+    return 0
+end
+
+for _, name in ipairs(names) do
+    if redis.call('SISMEMBER', prefix .. 'ips:' .. name, ip_address) == 0 then
+        return 0
+    end
+end
+
+return 1
+'''
+
+SETTING_FIELDS = ('max_num_items', 'min_version', 'min_client_version')
+COUNTER_FIELDS = ('items', 'claims')
+
+
+class SharedBudget(object):
+    '''Budget counters in Redis.
+
+    Holds the same per project information as :attr:`Budget.projects`.
+    Every change is a single atomic command or script so any number of
+    tracker processes may use the counters at the same time.
+
+    Keys, under the ``budget:`` prefix:
+
+    * ``projects``: set of enabled project names.
+    * ``project:NAME``: hash of the settings and counters.
+    * ``ips:NAME``: set of IP addresses holding a claim.
+    '''
+    def __init__(self, redis, redis_prefix=''):
+        self.redis = redis
+        self.prefix = redis_prefix + 'budget:'
+        self._reserve_script = redis.register_script(RESERVE_SCRIPT)
+        self._adjust_script = redis.register_script(ADJUST_SCRIPT)
+        self._update_settings_script = redis.register_script(
+            UPDATE_SETTINGS_SCRIPT)
+        self._claims_full_script = redis.register_script(CLAIMS_FULL_SCRIPT)
+
+    def _get_project_key(self, project_id):
+        return '{0}project:{1}'.format(self.prefix, project_id)
+
+    def _get_ips_key(self, project_id):
+        return '{0}ips:{1}'.format(self.prefix, project_id)
+
+    @timed(redis_duration, 'budget_get_projects')
+    def get_projects(self, with_ip_addresses=True):
+        '''Return a dict shaped as :attr:`Budget.projects`.
+
+        Without `with_ip_addresses`, the sets of IP addresses are empty.
+        '''
+        names = sorted(
+            name.decode('utf-8')
+            for name in self.redis.smembers(self.prefix + 'projects'))
+        pipeline = self.redis.pipeline(transaction=True)
+
+        for name in names:
+            pipeline.hmget(
+                self._get_project_key(name), SETTING_FIELDS + COUNTER_FIELDS)
+
+            if with_ip_addresses:
+                pipeline.smembers(self._get_ips_key(name))
+
+        replies = iter(pipeline.execute())
+        projects = {}
+
+        for name in names:
+            values = next(replies)
+
+            if with_ip_addresses:
+                ip_addresses = set(
+                    ip_address.decode('utf-8')
+                    for ip_address in next(replies))
+            else:
+                ip_addresses = set()
+
+            if values[0] is None:
+                continue
+
+            project_info = dict(
+                (field, int(value)) for field, value
+                in zip(SETTING_FIELDS + COUNTER_FIELDS, values))
+            project_info['ip_addresses'] = ip_addresses
+            projects[name] = project_info
+
+        return projects
+
+    def set_projects(self, projects, replace=True):
+        '''Store the projects, replacing all existing ones by default.'''
+        names_key = self.prefix + 'projects'
+        old_names = [
+            name.decode('utf-8') for name in self.redis.smembers(names_key)
+        ] if replace else ()
+
+        pipeline = self.redis.pipeline(transaction=True)
+
+        for name in old_names:
+            if name not in projects:
+                pipeline.srem(names_key, name)
+                pipeline.delete(
+                    self._get_project_key(name), self._get_ips_key(name))
+
+        for name, project_info in projects.items():
+            pipeline.hset(self._get_project_key(name), mapping=dict(
+                (field, project_info[field])
+                for field in SETTING_FIELDS + COUNTER_FIELDS
+            ))
+            pipeline.delete(self._get_ips_key(name))
+
+            if project_info['ip_addresses']:
+                pipeline.sadd(
+                    self._get_ips_key(name), *project_info['ip_addresses'])
+
+            pipeline.sadd(names_key, name)
+
+        pipeline.execute()
+
+    def remove_project(self, project_id):
+        pipeline = self.redis.pipeline(transaction=True)
+        pipeline.srem(self.prefix + 'projects', project_id)
+        pipeline.delete(
+            self._get_project_key(project_id), self._get_ips_key(project_id))
+        pipeline.execute()
+
+    def update_settings(self, project_id, max_num_items, min_version,
+                        min_client_version):
+        '''Update the settings of a stored project.
+
+        Returns False if the project is not stored.
+        '''
+        return bool(self._update_settings_script(
+            keys=[self._get_project_key(project_id)],
+            args=[max_num_items, min_version, min_client_version]
+        ))
+
+    @timed(redis_duration, 'budget_reserve')
+    def reserve(self, ip_address, version, client_version, seed,
+                exclude_projects=()):
+        '''Pick an available project and count the claim atomically.
+
+        Projects are tried in an order shuffled with `seed`. Returns the
+        same tuple as :meth:`Budget.get_available_project` or None.
+        '''
+        reply = self._reserve_script(
+            keys=[self.prefix + 'projects'],
+            args=[self.prefix, ip_address, version, client_version, seed]
+            + list(exclude_projects)
+        )
+
+        if reply:
+            project_id, num_claims, num_items, max_num_items = reply
+
+            return (project_id.decode('utf-8'), int(num_claims),
+                    int(num_items), int(max_num_items))
+
+    @timed(redis_duration, 'budget_adjust')
+    def adjust(self, changes):
+        '''Apply counter changes to existing projects in one round trip.
+
+        `changes` is a list of ``(project_id, claims, items, ip_action,
+        ip_address)`` tuples where `ip_action` is ``add``, ``remove`` or
+        None. Changes to projects that are not stored are ignored.
+        '''
+        pipeline = self.redis.pipeline(transaction=False)
+
+        for project_id, claims, items, ip_action, ip_address in changes:
+            self._adjust_script(
+                keys=[self._get_project_key(project_id),
+                      self._get_ips_key(project_id)],
+                args=[claims, items, ip_action or '', ip_address or ''],
+                client=pipeline
+            )
+
+        pipeline.execute()
+
+    @timed(redis_duration, 'budget_is_claims_full')
+    def is_claims_full(self, ip_address):
+        return bool(self._claims_full_script(
+            keys=[self.prefix + 'projects'],
+            args=[self.prefix, ip_address]
+        ))
+
+    def clear(self):
+        self.set_projects({})
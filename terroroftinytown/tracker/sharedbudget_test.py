@@ -0,0 +1,166 @@
+import unittest
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from terroroftinytown.client import VERSION
+from terroroftinytown.tracker.database import Database
+from terroroftinytown.tracker.errors import FullClaim
+from terroroftinytown.tracker.model import Budget, Item, ItemPool, Project, \
+    checkin_item, checkout_item, new_session, MIN_CLIENT_VERSION_OVERRIDE
+from terroroftinytown.tracker.sharedbudget import SharedBudget
+
+
+def make_project_info(items=0, claims=0, ip_addresses=(), max_num_items=10):
+    return {
+        'max_num_items': max_num_items,
+        'min_version': 1,
+        'min_client_version': 1,
+        'items': items,
+        'claims': claims,
+        'ip_addresses': set(ip_addresses),
+    }
+
+
+@unittest.skipIf(not fakeredis, 'fakeredis is not installed')
+class TestSharedBudget(unittest.TestCase):
+    def setUp(self):
+        redis = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+        self.budget = SharedBudget(redis, 'test:')
+        self.budget.set_projects({
+            'a': make_project_info(items=2),
+            'b': make_project_info(items=1, claims=1,
+                                   ip_addresses=['1.1.1.1']),
+        })
+
+    def test_set_projects(self):
+        self.assertEqual(
+            make_project_info(items=1, claims=1, ip_addresses=['1.1.1.1']),
+            self.budget.get_projects()['b']
+        )
+        self.assertEqual(
+            set(), self.budget.get_projects(with_ip_addresses=False)['b']
+            ['ip_addresses']
+        )
+
+        self.budget.set_projects({'c': make_project_info()}, replace=False)
+        self.assertEqual(['a', 'b', 'c'],
+                         sorted(self.budget.get_projects()))
+
+        self.budget.set_projects({'c': make_project_info()})
+        self.assertEqual(['c'], list(self.budget.get_projects()))
+
+        self.budget.remove_project('c')
+        self.assertEqual({}, self.budget.get_projects())
+
+    def test_reserve(self):
+        self.assertEqual(('a', 0, 2, 10),
+                         self.budget.reserve('1.1.1.1', 1, 1, seed=1))
+        self.assertIsNone(self.budget.reserve('1.1.1.1', 1, 1, seed=1))
+        self.assertTrue(self.budget.is_claims_full('1.1.1.1'))
+
+        self.assertIsNone(self.budget.reserve('2.2.2.2', 0, 1, seed=1))
+        self.assertIsNone(self.budget.reserve(
+            '2.2.2.2', 1, 1, seed=1, exclude_projects=['a', 'b']))
+
+        project_id = self.budget.reserve('2.2.2.2', 1, 1, seed=1)[0]
+        self.assertFalse(self.budget.is_claims_full('2.2.2.2'))
+
+        projects = self.budget.get_projects()
+        self.assertEqual({'1.1.1.1', '2.2.2.2'},
+                         projects[project_id]['ip_addresses'])
+
+    def test_reserve_new_item(self):
+        self.budget.set_projects({'a': make_project_info(max_num_items=2)})
+
+        self.assertEqual(('a', 0, 0, 2),
+                         self.budget.reserve('1.1.1.1', 1, 1, seed=1))
+        self.assertEqual(('a', 1, 1, 2),
+                         self.budget.reserve('2.2.2.2', 1, 1, seed=1))
+        self.assertIsNone(self.budget.reserve('3.3.3.3', 1, 1, seed=1))
+        self.assertEqual(2, self.budget.get_projects()['a']['items'])
+
+    def test_adjust(self):
+        self.budget.adjust([
+            ('b', -1, -1, 'remove', '1.1.1.1'),
+            ('a', 0, 5, None, None),
+            ('missing', 1, 1, 'add', '1.1.1.1'),
+        ])
+        self.assertTrue(self.budget.update_settings('a', 20, 2, 3))
+        self.assertFalse(self.budget.update_settings('missing', 20, 2, 3))
+
+        projects = self.budget.get_projects()
+
+        self.assertEqual(make_project_info(), projects['b'])
+        self.assertEqual(7, projects['a']['items'])
+        self.assertEqual(20, projects['a']['max_num_items'])
+        self.assertEqual(3, projects['a']['min_client_version'])
+        self.assertNotIn('missing', projects)
+
+
+@unittest.skipIf(not fakeredis, 'fakeredis is not installed')
+class TestSharedBudgetModel(unittest.TestCase):
+    def setUp(self):
+        Database('sqlite://')
+
+        with new_session() as session:
+            session.add(Project(name='test', enabled=True))
+            session.add(Project(name='test2', enabled=True))
+
+        Item.add_items('test', [(0, 9), (10, 19)])
+        Item.add_items('test2', [(0, 9)])
+
+        redis = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+        Budget.shared = SharedBudget(redis, 'test:')
+        Budget.calculate_budgets()
+        ItemPool.clear()
+
+    def tearDown(self):
+        Budget.shared = None
+        Budget.calculate_budgets()
+
+    def checkout(self, ip_address):
+        return checkout_item('user', ip_address, VERSION,
+                             MIN_CLIENT_VERSION_OVERRIDE)
+
+    def test_checkout_checkin(self):
+        claims = [self.checkout('1.1.1.1'), self.checkout('1.1.1.1')]
+
+        self.assertEqual(
+            {'test', 'test2'}, {claim['project_id'] for claim in claims})
+
+        with self.assertRaises(FullClaim):
+            self.checkout('1.1.1.1')
+
+        projects = Budget.get_projects()
+        self.assertEqual(1, projects['test']['claims'])
+        self.assertEqual({'1.1.1.1'}, projects['test2']['ip_addresses'])
+        self.assertEqual({}, Budget.reconcile())
+
+        for claim in claims:
+            checkin_item(claim['id'], claim['tamper_key'], {})
+
+        projects = Budget.get_projects()
+        self.assertEqual(0, projects['test']['claims'])
+        self.assertEqual(1, projects['test']['items'])
+        self.assertEqual(0, projects['test2']['items'])
+        self.assertEqual(set(), projects['test2']['ip_addresses'])
+        self.assertEqual({}, Budget.reconcile())
+
+    def test_update_project(self):
+        with new_session() as session:
+            session.query(Project).get('test2').enabled = False
+
+        Budget.update_project('test2')
+        self.assertEqual(['test'], list(Budget.get_projects()))
+
+        with new_session() as session:
+            project = session.query(Project).get('test2')
+            project.enabled = True
+            project.max_num_items = 5
+
+        Budget.update_project('test2')
+        self.assertEqual(5, Budget.get_projects()['test2']['max_num_items'])
+        self.assertEqual(1, Budget.get_projects()['test2']['items'])
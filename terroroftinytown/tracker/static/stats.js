@@ -50,46 +50,57 @@ WSController.prototype._onmessage = function(evt){
 		this.stats.project = message.project;
 	}
 
-	if(message.live_new){
-		this.stats.live.unshift(message.live_new);
+	if(message.batch){
+		this._applyBatch(message.batch);
+	}
 
-		var lifetime = this.stats.lifetime[message.live_new.username];
-		if(lifetime === undefined){
-			lifetime = [0, 0];
-			this.stats.lifetime[message.live_new.username] = lifetime;
-		}
-		lifetime[0] += message.live_new.found;
-		lifetime[1] += message.live_new.scanned;
+	this.onMessage(message);
+};
 
-		this.stats.global[0] += message.live_new.found;
-		this.stats.global[1] += message.live_new.scanned;
+WSController.prototype._addCounts = function(totals, key, counts){
+	var total = totals[key];
+	if(total === undefined){
+		total = [0, 0];
+		totals[key] = total;
+	}
+	total[0] += counts[0];
+	total[1] += counts[1];
+};
 
-		var project = this.stats.project[message.live_new.project];
-		if(lifetime === undefined){
-			project = [0, 0];
-			this.stats.project[message.live_new.project] = project;
-		}
-		project[0] += message.live_new.found;
-		project[1] += message.live_new.scanned;
+WSController.prototype._applyBatch = function(batch){
+	var key;
 
-		var dateNow = new Date();
-		var bucketIndex = dateNow.getUTCSeconds();
+	// Newest last in the batch, newest first in the list
+	for (var i = 0; i < batch.live.length; i++) {
+		this.stats.live.unshift(batch.live[i]);
+	}
 
-		if (this.prevScanBucketIndex != bucketIndex) {
-			this.prevScanBucketIndex = bucketIndex;
-			this.scanRateBucket[bucketIndex] = message.live_new.scanned;
-		} else {
-			this.scanRateBucket[bucketIndex] += message.live_new.scanned;
-		}
+	for (key in batch.lifetime) {
+		this._addCounts(this.stats.lifetime, key, batch.lifetime[key]);
+	}
 
-		var sum = 0;
-		for (var i = 0; i < 60; i++) {
-			sum += this.scanRateBucket[i];
-		}
-		this.stats.currentScanRate = sum / 60.0;
+	for (key in batch.project) {
+		this._addCounts(this.stats.project, key, batch.project[key]);
 	}
 
-	this.onMessage(message);
+	this.stats.global[0] += batch.global[0];
+	this.stats.global[1] += batch.global[1];
+
+	var dateNow = new Date();
+	var bucketIndex = dateNow.getUTCSeconds();
+
+	if (this.prevScanBucketIndex != bucketIndex) {
+		this.prevScanBucketIndex = bucketIndex;
+		this.scanRateBucket[bucketIndex] = batch.global[1];
+	} else {
+		this.scanRateBucket[bucketIndex] += batch.global[1];
+	}
+
+	var sum = 0;
+	for (var j = 0; j < 60; j++) {
+		sum += this.scanRateBucket[j];
+	}
+	this.stats.currentScanRate = sum / 60.0;
 };
 
 WSController.prototype.onMessage = function(message){
@@ -1,47 +1,185 @@
 # encoding=utf-8
 '''Stats information'''
 import json
+import time
 
 from terroroftinytown.event import Bus
+from terroroftinytown.tracker.metrics import redis_duration, timed
 
 __all__ = ['Stats', 'stats_bus']
 
 stats_bus = Bus()
 
+UPDATE_SCRIPT = '''
+local stats, max_index, username, scanned, found, project =
+    ARGV[1], ARGV[2], ARGV[3], ARGV[4], ARGV[5], ARGV[6]
+
+redis.call('LPUSH', KEYS[1], stats)
+redis.call('LTRIM', KEYS[1], 0, max_index)
+redis.call('HINCRBY', KEYS[2], username, scanned)
+redis.call('HINCRBY', KEYS[3], username, found)
+redis.call('INCRBY', KEYS[4], scanned)
+redis.call('INCRBY', KEYS[5], found)
+redis.call('HINCRBY', KEYS[6], project, found)
+redis.call('HINCRBY', KEYS[7], project, scanned)
+redis.call('ZINCRBY', KEYS[8], scanned, username)
+
+for index = 9, #KEYS do
+    local ttl = ARGV[index - 2]
+    redis.call('HINCRBY', KEYS[index], 'scanned', scanned)
+    redis.call('HINCRBY', KEYS[index], 'found', found)
+    redis.call('HINCRBY', KEYS[index], 'scanned:' .. project, scanned)
+    redis.call('HINCRBY', KEYS[index], 'found:' .. project, found)
+    redis.call('EXPIRE', KEYS[index], ttl)
+end
+'''
+
+# Throughput bucket resolutions as name: (interval, retention) in seconds.
+# Older data is only kept at the coarser resolution.
+THROUGHPUT_RESOLUTIONS = {
+    'minute': (60, 2 * 86400),
+    'hour': (3600, 90 * 86400),
+}
+
+
 class Stats:
-    def __init__(self, redis, redis_prefix, count=30):
+    '''Stats stored in Redis.
+
+    `update_mode` selects how :meth:`update` writes an item's stats in
+    one round trip: ``pipeline`` sends the commands as a MULTI/EXEC
+    transaction and ``script`` runs them as a Lua script.
+    '''
+    UPDATE_MODES = ('pipeline', 'script')
+
+    def __init__(self, redis, redis_prefix, count=30, update_mode='pipeline'):
         global stats
 
+        if update_mode not in self.UPDATE_MODES:
+            raise ValueError('Unknown update mode {0}'.format(update_mode))
+
         self.redis = redis
         self.prefix = redis_prefix
         self.count = count
+        self.update_mode = update_mode
+        self._update_script = redis.register_script(UPDATE_SCRIPT)
 
         Stats.instance = self
 
     def update(self, stats):
-        # live stats
+        with redis_duration.time('update'):
+            if self.update_mode == 'script':
+                self._update_with_script(stats)
+            else:
+                self._update_with_pipeline(stats)
+
+        stats_bus.fire(**stats)
+
+    def _update_with_pipeline(self, stats):
         key = self.get_key()
-        self.redis.lpush(key, json.dumps(stats))
-        self.redis.ltrim(key, 0, self.count)
+        pipeline = self.redis.pipeline()
+
+        # live stats
+        pipeline.lpush(key, json.dumps(stats))
+        pipeline.ltrim(key, 0, self.count)
 
         # users lifetime stat
-        self.redis.hincrby(key+':s', stats['username'], stats['scanned'])
-        self.redis.hincrby(key+':f', stats['username'], stats['found'])
+        pipeline.hincrby(key+':s', stats['username'], stats['scanned'])
+        pipeline.hincrby(key+':f', stats['username'], stats['found'])
 
         # total stats
-        self.redis.incrby(key+':ts', stats['scanned'])
-        self.redis.incrby(key+':tf', stats['found'])
+        pipeline.incrby(key+':ts', stats['scanned'])
+        pipeline.incrby(key+':tf', stats['found'])
 
         # project stats
-        self.redis.hincrby(key+':pf', stats['project'], stats['found'])
-        self.redis.hincrby(key+':ps', stats['project'], stats['scanned'])
+        pipeline.hincrby(key+':pf', stats['project'], stats['found'])
+        pipeline.hincrby(key+':ps', stats['project'], stats['scanned'])
 
-        stats_bus.fire(**stats)
+        # leaderboard by scanned
+        pipeline.zincrby(key+':lb', stats['scanned'], stats['username'])
+
+        # throughput buckets
+        for bucket_key, retention in self._get_throughput_keys(stats):
+            project = stats['project']
+            pipeline.hincrby(bucket_key, 'scanned', stats['scanned'])
+            pipeline.hincrby(bucket_key, 'found', stats['found'])
+            pipeline.hincrby(bucket_key, 'scanned:' + project, stats['scanned'])
+            pipeline.hincrby(bucket_key, 'found:' + project, stats['found'])
+            pipeline.expire(bucket_key, retention)
 
+        pipeline.execute()
+
+    def _update_with_script(self, stats):
+        key = self.get_key()
+        throughput_keys = self._get_throughput_keys(stats)
+
+        self._update_script(
+            keys=[
+                key, key + ':s', key + ':f', key + ':ts', key + ':tf',
+                key + ':pf', key + ':ps', key + ':lb'
+            ] + [bucket_key for bucket_key, retention in throughput_keys],
+            args=[
+                json.dumps(stats), self.count, stats['username'],
+                stats['scanned'], stats['found'], stats['project']
+            ] + [retention for bucket_key, retention in throughput_keys]
+        )
+
+    def _get_throughput_keys(self, stats):
+        timestamp = int(stats['finished'])
+
+        return [
+            (self._get_throughput_key(name, timestamp - timestamp % interval),
+             retention)
+            for name, (interval, retention)
+            in sorted(THROUGHPUT_RESOLUTIONS.items())
+        ]
+
+    def _get_throughput_key(self, resolution, timestamp):
+        return '{0}:tp:{1}:{2}'.format(self.get_key(), resolution, timestamp)
+
+    @timed(redis_duration, 'get_throughput')
+    def get_throughput(self, resolution='minute', count=60, project=None,
+                       now=None):
+        '''
+        Return found and scanned per bucket for the last `count` buckets,
+        oldest first. The current bucket is partial.
+        Output:
+        [
+            [timestamp, found, scanned],
+            ...
+        ]
+        '''
+        interval, retention = THROUGHPUT_RESOLUTIONS[resolution]
+        count = min(count, retention // interval)
+        now = int(now or time.time())
+        last_timestamp = now - now % interval
+        timestamps = [
+            last_timestamp - interval * index
+            for index in reversed(range(count))
+        ]
+
+        if project:
+            fields = ['found:' + project, 'scanned:' + project]
+        else:
+            fields = ['found', 'scanned']
+
+        pipeline = self.redis.pipeline(transaction=False)
+
+        for timestamp in timestamps:
+            pipeline.hmget(
+                self._get_throughput_key(resolution, timestamp), fields)
+
+        return [
+            [timestamp, int(found or 0), int(scanned or 0)]
+            for timestamp, (found, scanned)
+            in zip(timestamps, pipeline.execute())
+        ]
+
+    @timed(redis_duration, 'get_live')
     def get_live(self):
         '''Return live item results, for format of output see model.checkin_item'''
         return [json.loads(item.decode('utf-8')) for item in self.redis.lrange(self.get_key(), 0, self.count)]
 
+    @timed(redis_duration, 'get_lifetime')
     def get_lifetime(self):
         '''
         Return lifetime stats for all users.
@@ -61,6 +199,67 @@ class Stats:
 
         return out
 
+    @timed(redis_duration, 'get_leaderboard')
+    def get_leaderboard(self, offset=0, limit=300):
+        '''
+        Return users sorted by scanned, highest first.
+        Output:
+        [
+            ['username', found, scanned],
+            ...
+        ]
+        '''
+        key = self.get_key()
+        rows = self.redis.zrevrange(
+            key+':lb', offset, offset + limit - 1, withscores=True)
+
+        if not rows:
+            return []
+
+        found = self.redis.hmget(key+':f', [user for user, score in rows])
+
+        return [
+            [user.decode('utf-8'), int(user_found or 0), int(scanned)]
+            for (user, scanned), user_found in zip(rows, found)
+        ]
+
+    @timed(redis_duration, 'get_leaderboard_size')
+    def get_leaderboard_size(self):
+        return self.redis.zcard(self.get_key()+':lb')
+
+    def rebuild_leaderboard(self, batch_size=1000):
+        '''Build the leaderboard from the users lifetime stats.
+
+        The tracker should be stopped while this runs since check ins
+        during the rebuild may be lost from the leaderboard.
+        '''
+        key = self.get_key()
+        temp_key = key+':lb:rebuild'
+        batch = {}
+        count = 0
+
+        self.redis.delete(temp_key)
+
+        for user, scanned in self.redis.hscan_iter(key+':s', count=batch_size):
+            batch[user] = int(scanned)
+
+            if len(batch) >= batch_size:
+                self.redis.zadd(temp_key, batch)
+                count += len(batch)
+                batch = {}
+
+        if batch:
+            self.redis.zadd(temp_key, batch)
+            count += len(batch)
+
+        if count:
+            self.redis.rename(temp_key, key+':lb')
+        else:
+            self.redis.delete(key+':lb')
+
+        return count
+
+    @timed(redis_duration, 'get_user_lifetime')
     def get_user_lifetime(self, user):
         '''Return user lifetime stats as array of [found, scanned]'''
         key = self.get_key()
@@ -68,6 +267,7 @@ class Stats:
         found = self.redis.hget(key+':f', user) or 0
         return [int(found), int(scanned)]
 
+    @timed(redis_duration, 'get_global')
     def get_global(self):
         '''Return total stats as array of [found, scanned]'''
         found = self.redis.get(self.get_key()+':tf')
@@ -78,6 +278,7 @@ class Stats:
             int(scanned) if scanned else 0
         ]
 
+    @timed(redis_duration, 'get_project')
     def get_project(self):
         key = self.get_key()
         scanned = self.redis.hgetall(key+':ps')
@@ -96,7 +297,10 @@ class Stats:
         key = self.get_key()
         self.redis.delete(
             key, key + ':s', key + ':f', key + ':ts', key + ':tf',
-            key + ':pf', key + ':ps'
+            key + ':pf', key + ':ps', key + ':lb'
         )
 
+        for bucket_key in self.redis.scan_iter(key + ':tp:*'):
+            self.redis.delete(bucket_key)
+
 Stats.instance = None
\ No newline at end of file
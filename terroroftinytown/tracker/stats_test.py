@@ -0,0 +1,104 @@
+import unittest
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from terroroftinytown.tracker.stats import Stats
+
+
+@unittest.skipIf(not fakeredis, 'fakeredis is not installed')
+class TestStats(unittest.TestCase):
+    def make_stats(self, update_mode):
+        redis = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+
+        return Stats(redis, 'test:', count=2,
+                     update_mode=update_mode)
+
+    def update(self, stats):
+        for index in range(4):
+            stats.update({
+                'project': 'project{0}'.format(index % 2),
+                'username': 'user{0}'.format(index % 3),
+                'scanned': 10,
+                'found': index,
+                'started': 0,
+                'finished': index,
+            })
+
+    def test_update_modes(self):
+        stats = self.make_stats('pipeline')
+        self.update(stats)
+
+        self.assertEqual([6, 40], stats.get_global())
+        self.assertEqual([3, 20], stats.get_user_lifetime('user0'))
+        self.assertEqual({'project0': [2, 20], 'project1': [4, 20]},
+                         stats.get_project())
+        self.assertEqual([3, 2, 1], [item['finished']
+                                     for item in stats.get_live()])
+
+        script_stats = self.make_stats('script')
+        self.update(script_stats)
+
+        self.assertEqual([6, 40], script_stats.get_global())
+        self.assertEqual(stats.get_global(), script_stats.get_global())
+        self.assertEqual(stats.get_lifetime(), script_stats.get_lifetime())
+        self.assertEqual(stats.get_project(), script_stats.get_project())
+        self.assertEqual(stats.get_live(), script_stats.get_live())
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            self.make_stats('bogus')
+
+    def test_leaderboard(self):
+        for update_mode in Stats.UPDATE_MODES:
+            stats = self.make_stats(update_mode)
+            self.update(stats)
+            stats.update({
+                'project': 'project0', 'username': 'user2', 'scanned': 15,
+                'found': 0, 'started': 0, 'finished': 0,
+            })
+
+            self.assertEqual(3, stats.get_leaderboard_size())
+            self.assertEqual([['user2', 2, 25], ['user0', 3, 20]],
+                             stats.get_leaderboard(limit=2))
+            self.assertEqual([['user1', 1, 10]],
+                             stats.get_leaderboard(offset=2))
+            self.assertEqual([], stats.get_leaderboard(offset=3))
+
+    def test_rebuild_leaderboard(self):
+        stats = self.make_stats('pipeline')
+        self.update(stats)
+        expected = stats.get_leaderboard()
+        stats.redis.delete(stats.get_key() + ':lb')
+
+        self.assertEqual(3, stats.rebuild_leaderboard(batch_size=2))
+        self.assertEqual(expected, stats.get_leaderboard())
+
+    def test_throughput(self):
+        for update_mode in Stats.UPDATE_MODES:
+            stats = self.make_stats(update_mode)
+
+            for finished, project in ((3590, 'a'), (3600, 'a'), (3659, 'b'),
+                                      (3720, 'a')):
+                stats.update({
+                    'project': project, 'username': 'user', 'scanned': 10,
+                    'found': 1, 'started': 0, 'finished': finished + 0.5,
+                })
+
+            self.assertEqual(
+                [[3540, 1, 10], [3600, 2, 20], [3660, 0, 0], [3720, 1, 10]],
+                stats.get_throughput('minute', 4, now=3750)
+            )
+            self.assertEqual(
+                [[3600, 1, 10], [3660, 0, 0], [3720, 1, 10]],
+                stats.get_throughput('minute', 3, project='a', now=3750)
+            )
+            self.assertEqual(
+                [[0, 1, 10], [3600, 3, 30]],
+                stats.get_throughput('hour', 2, now=3750)
+            )
+
+            bucket_key = stats.get_key() + ':tp:minute:3600'
+            self.assertEqual(2 * 86400, stats.redis.ttl(bucket_key))
@@ -0,0 +1,56 @@
+# encoding=utf-8
+'''Caching.'''
+import collections
+import threading
+import time
+
+
+class TTLCache(object):
+    '''Bounded mapping whose entries expire after `ttl` seconds.
+
+    When full, the least recently stored entry is evicted.
+    '''
+    def __init__(self, max_size=1000, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+
+            if entry is None:
+                return default
+
+            value, expire_time = entry
+
+            if expire_time <= time.monotonic():
+                del self._data[key]
+                return default
+
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, time.monotonic() + self.ttl)
+
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+
+            if entry is None:
+                return default
+
+            return entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,35 @@
+# encoding=utf-8
+import time
+import unittest
+
+from terroroftinytown.util.cache import TTLCache
+
+
+class TestTTLCache(unittest.TestCase):
+    def test_get_set(self):
+        cache = TTLCache()
+        cache.set('a', 1)
+
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(None, cache.get('b'))
+        self.assertEqual(1, cache.pop('a'))
+        self.assertEqual('default', cache.get('a', 'default'))
+
+    def test_max_size(self):
+        cache = TTLCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.set('c', 3)
+
+        self.assertEqual(2, len(cache))
+        self.assertEqual(None, cache.get('a'))
+        self.assertEqual(3, cache.get('c'))
+
+    def test_expire(self):
+        cache = TTLCache(ttl=0.01)
+        cache.set('a', 1)
+
+        time.sleep(0.02)
+
+        self.assertEqual(None, cache.get('a'))
+        self.assertEqual(0, len(cache))
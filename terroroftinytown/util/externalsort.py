@@ -1,7 +1,9 @@
 '''External Sorting'''
 import tempfile
 import base64
+import heapq
 import pickle
+import struct
 import subprocess
 
 
@@ -55,3 +57,195 @@ class GNUExternalSort(object):
             )
 
         self._temp_file.close()
+
+
+class SortMemory(object):
+    '''Memory shared by the in-memory runs of several ExternalSort.
+
+    When the runs of all the sorters using it reach about `max_size`
+    bytes, the largest run is spilled to a temporary file.
+    '''
+    def __init__(self, max_size=64 * 1024 * 1024):
+        self.max_size = max_size
+        self.size = 0
+        self._sorters = []
+
+    def add_sorter(self, sorter):
+        self._sorters.append(sorter)
+
+    def allocate(self, size):
+        self.size += size
+
+        if self.size >= self.max_size:
+            largest = max(self._sorters, key=lambda sorter: sorter.run_size)
+            largest._spill()
+
+    def free(self, size):
+        self.size -= size
+
+
+class ExternalSort(object):
+    '''Merge sort that spills sorted runs to temporary files.
+
+    Pairs are returned in the same order as :class:`GNUExternalSort`: by
+    the length of the key, then the key. Duplicate pairs are returned
+    once.
+
+    Pairs are kept in memory until their keys and pickled values reach
+    about `max_run_size` bytes. The run is then sorted and written to a
+    temporary file as records of a key size, a value size, the key and
+    the pickled value. The runs are merged with :func:`heapq.merge`.
+
+    With `memory`, a :class:`SortMemory` shared with other sorters also
+    bounds the total size of their in-memory runs.
+
+    To bound the number of open files, every `merge_fan_in` runs of the
+    same level are merged into one run of the next level as soon as they
+    are written. At most ``(merge_fan_in - 1) * levels + 1`` runs are
+    open and each pair is rewritten once per level.
+    '''
+    RECORD_HEADER = struct.Struct('>HI')
+
+    # Rough size of the tuple and objects that hold a pair in a run
+    RECORD_OVERHEAD = 200
+
+    def __init__(self, temp_prefix='tott', temp_dir=None,
+                 max_run_size=16 * 1024 * 1024, buffer_size=256 * 1024,
+                 merge_fan_in=32, memory=None):
+        assert merge_fan_in >= 2
+        self._temp_prefix = temp_prefix
+        self._temp_dir = temp_dir
+        self._max_run_size = max_run_size
+        self._buffer_size = buffer_size
+        self._merge_fan_in = merge_fan_in
+        self._run = []
+        self._run_size = 0
+        # (level, file) with non-increasing levels
+        self._run_files = []
+        self._memory = memory
+        self.rows = 0
+
+        if memory:
+            memory.add_sorter(self)
+
+    @property
+    def run_size(self):
+        '''Estimated size of the run in memory.'''
+        return self._run_size
+
+    def input(self, key, value):
+        self.input_many([(key, value)])
+
+    def input_many(self, key_values):
+        for key, value in key_values:
+            serialized_value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+            record_size = \
+                len(key) + len(serialized_value) + self.RECORD_OVERHEAD
+
+            self._run.append((len(key), key, serialized_value))
+            self._run_size += record_size
+            self.rows += 1
+
+            if self._memory:
+                # May spill the run of this or another sorter
+                self._memory.allocate(record_size)
+
+            if self._run_size >= self._max_run_size:
+                self._spill()
+
+    @property
+    def open_runs(self):
+        '''Number of runs in temporary files.'''
+        return len(self._run_files)
+
+    def _spill(self):
+        self._run.sort()
+        self._run_files.append((0, self._write_run(self._run)))
+        self._clear_run()
+
+        fan_in = self._merge_fan_in
+
+        while len(self._run_files) >= fan_in and \
+                len(set(level for level, run_file
+                        in self._run_files[-fan_in:])) == 1:
+            level = self._run_files[-1][0]
+            run_files = [run_file for level, run_file
+                         in self._run_files[-fan_in:]]
+            del self._run_files[-fan_in:]
+
+            merged_file = self._write_run(self._merge(
+                [self._read_run(run_file) for run_file in run_files]))
+
+            for run_file in run_files:
+                run_file.close()
+
+            self._run_files.append((level + 1, merged_file))
+
+    def _write_run(self, records):
+        run_file = tempfile.TemporaryFile(
+            prefix=self._temp_prefix, dir=self._temp_dir,
+            buffering=self._buffer_size
+        )
+        pack_header = self.RECORD_HEADER.pack
+
+        for key_size, key, serialized_value in records:
+            run_file.write(
+                pack_header(key_size, len(serialized_value)) +
+                key.encode('ascii') + serialized_value
+            )
+
+        run_file.flush()
+
+        return run_file
+
+    @classmethod
+    def _merge(cls, runs):
+        last_record = None
+
+        for record in heapq.merge(*runs):
+            if record == last_record:
+                continue
+
+            last_record = record
+
+            yield record
+
+    def _read_run(self, run_file):
+        run_file.seek(0)
+        header_size = self.RECORD_HEADER.size
+        unpack_header = self.RECORD_HEADER.unpack
+
+        while True:
+            header = run_file.read(header_size)
+
+            if not header:
+                break
+
+            key_size, value_size = unpack_header(header)
+            key = run_file.read(key_size).decode('ascii')
+
+            yield key_size, key, run_file.read(value_size)
+
+    def sort(self):
+        self._run.sort()
+
+        runs = [self._read_run(run_file) for level, run_file
+                in self._run_files]
+        runs.append(self._run)
+
+        for record in self._merge(runs):
+            yield record[1], pickle.loads(record[2])
+
+        for level, run_file in self._run_files:
+            run_file.close()
+
+        self._run_files = []
+        self._clear_run()
+
+    def _clear_run(self):
+        if self._memory:
+            self._memory.free(self._run_size)
+
+        self._run = []
+        self._run_size = 0
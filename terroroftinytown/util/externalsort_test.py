@@ -1,5 +1,6 @@
 import unittest
-from terroroftinytown.util.externalsort import GNUExternalSort
+from terroroftinytown.util.externalsort import ExternalSort, GNUExternalSort, \
+    SortMemory
 
 
 class TestExternalSort(unittest.TestCase):
@@ -23,3 +24,86 @@ class TestExternalSort(unittest.TestCase):
             ),
             results
         )
+
+    def test_external_sort(self):
+        sorter = ExternalSort(max_run_size=1000)
+        sorter.input_many(
+            (str(index % 500), index % 500) for index in range(1000))
+        sorter.input('a', 'value')
+        sorter.input('a', 'value')
+        sorter.input('a', 'other value')
+
+        self.assertEqual(1003, sorter.rows)
+        self.assertGreater(len(sorter._run_files), 1)
+
+        results = list(sorter.sort())
+        keys = [(len(key), key) for key, value in results]
+
+        self.assertEqual(sorted(keys), keys)
+        self.assertEqual(502, len(results))
+        self.assertEqual(
+            set([(str(index), index) for index in range(500)] +
+                [('a', 'value'), ('a', 'other value')]),
+            set(results)
+        )
+
+    def test_external_sort_in_memory(self):
+        sorter = ExternalSort()
+        sorter.input_many([
+            ('00', 1),
+            ('0', 2),
+        ])
+        sorter.input('11', 3)
+        sorter.input('1', 4)
+
+        results = tuple(sorter.sort())
+
+        self.assertEqual([], sorter._run_files)
+        self.assertEqual(
+            (
+                ('0', 2),
+                ('1', 4),
+                ('00', 1),
+                ('11', 3),
+            ),
+            results
+        )
+
+    def test_external_sort_merge_runs(self):
+        sorter = ExternalSort(max_run_size=1000, merge_fan_in=3)
+        max_open_runs = 0
+
+        for index in range(2000):
+            sorter.input(str(index % 1500), index % 1500)
+            max_open_runs = max(max_open_runs, sorter.open_runs)
+
+        # About 400 runs in 6 levels
+        self.assertLessEqual(max_open_runs, 2 * 6 + 1)
+
+        results = list(sorter.sort())
+        keys = [(len(key), key) for key, value in results]
+
+        self.assertEqual(sorted(keys), keys)
+        self.assertEqual(
+            [(str(index), index) for index in range(1500)],
+            sorted(results, key=lambda result: result[1])
+        )
+
+    def test_external_sort_shared_memory(self):
+        memory = SortMemory(max_size=5000)
+        sorters = [ExternalSort(memory=memory) for index in range(10)]
+
+        for index in range(1000):
+            sorters[index % 10].input(str(index), index)
+            self.assertLess(memory.size, 5000)
+
+        self.assertEqual(
+            memory.size, sum(sorter.run_size for sorter in sorters))
+
+        for offset, sorter in enumerate(sorters):
+            self.assertGreater(sorter.open_runs, 0)
+            self.assertEqual(
+                list(range(offset, 1000, 10)),
+                sorted(value for key, value in sorter.sort()))
+
+        self.assertEqual(0, memory.size)